@@ -0,0 +1,363 @@
+"""main_generator.py 的基准测试
+
+对每个生成器和每个序列化步骤按一组规模各运行若干次，记录墙钟时间、每秒条目数、峰值 RSS 和输出字节数，
+结果写成 JSON，并可与之前保存的基线结果比较：
+
+    python benchmark.py --sweep quick --output bench.json
+    python benchmark.py --sweep quick --baseline bench.json   # 有用例变慢超过容差时退出码为 1
+
+每个 (基准, 规模) 在单独的 spawn 子进程中运行，峰值 RSS 互不影响；准备输入数据的时间不计入测量。
+需要 numpy 的基准（运输工具模拟、蒙特卡洛）在没有 numpy 时跳过。
+
+基线：benchmark_baseline.json 是一份 quick 规模的参考结果，只用于查看各用例的量级；墙钟时间与机器有关，
+比较前应在同一台机器上用改动前的代码重新生成基线：
+
+    git stash && python benchmark.py --sweep quick --output /tmp/baseline.json && git stash pop
+    python benchmark.py --sweep quick --baseline /tmp/baseline.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，此时不记录峰值 RSS
+    resource = None
+
+import main_generator as mg
+
+# --- 配置项 ---
+# 每个基准的规模含义：食物数 / 运输工具数 / 粒子数 / 每个国家的热力图区域数；时间线和热力图没有规模参数，只跑一次
+BENCHMARK_SWEEPS = {
+    "quick": {
+        "foods_with_routes": [100, 1000],
+        "food_nutrients_and_carbon": [100, 1000],
+        "fused_food_records": [100, 1000],
+        "earth_3d_data": [20, 1000],
+        "timeline_data": [1],
+        "global_heatmap_data": [1],
+        "particle_system_data": [100, 10000],
+        "serialize_foods_json": [100, 1000],
+        "serialize_foods_ndjson": [100, 1000],
+        "serialize_particles_json": [100, 10000],
+        "serialize_particles_columnar": [100, 10000],
+        "serialize_foods_sharded": [100, 1000],
+        "normalized_routes": [100, 1000],
+        "route_aggregates": [100, 1000],
+        "serialize_earth_columnar": [20, 1000],
+        "vessel_frames": [20, 200],
+        "monte_carlo": [10, 100],
+        "optimal_sourcing": [100, 1000],
+        "heatmap_tiles": [8, 64],
+    },
+    "full": {
+        "foods_with_routes": [100, 1000, 10000, 100000],
+        "food_nutrients_and_carbon": [100, 1000, 10000, 100000],
+        "fused_food_records": [100, 1000, 10000, 100000],
+        "earth_3d_data": [20, 1000, 100000],
+        "timeline_data": [1],
+        "global_heatmap_data": [1],
+        "particle_system_data": [100, 10000, 1000000],
+        "serialize_foods_json": [100, 1000, 10000, 100000],
+        "serialize_foods_ndjson": [100, 1000, 10000, 100000],
+        "serialize_particles_json": [100, 10000, 1000000],
+        "serialize_particles_columnar": [100, 10000, 1000000],
+        "serialize_foods_sharded": [100, 1000, 10000, 100000],
+        "normalized_routes": [100, 1000, 10000, 100000],
+        "route_aggregates": [100, 1000, 10000, 100000],
+        "serialize_earth_columnar": [20, 1000, 100000],
+        "vessel_frames": [20, 200, 2000],
+        "monte_carlo": [10, 100, 1000],
+        "optimal_sourcing": [100, 1000, 10000],
+        "heatmap_tiles": [8, 64, 256],
+    },
+}
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.10  # 墙钟时间比基线慢 10% 以上视为变慢
+BENCHMARK_SHARD_SIZE = 100  # serialize_foods_sharded 每个分片的条目数
+BENCHMARK_VESSEL_STEPS = 48  # vessel_frames 模拟的时间步数
+BENCHMARK_MONTE_CARLO_DRAWS = 10000  # monte_carlo 每个食物的抽样次数
+NUMPY_BENCHMARKS = {"vessel_frames", "monte_carlo"}
+
+# --- 基准用例：setup(size) 准备输入（不计时），run(state, output_dir) 返回产出的条目数 ---
+def _food_names(size):
+    return list(mg.iter_synthetic_food_names(size))
+
+def _transport_factors():
+    return mg.generate_transport_factors(random.Random(0))
+
+def _foods_with_routes(size):
+    return list(mg.iter_foods_with_routes(_food_names(size), rng=random.Random(1)))
+
+def _run_foods_with_routes(names, output_dir):
+    mg.clear_distance_cache()
+    return len(list(mg.iter_foods_with_routes(names, rng=random.Random(1))))
+
+def _setup_nutrients(size):
+    return _foods_with_routes(size), _transport_factors()
+
+def _run_nutrients(state, output_dir):
+    foods, transport_factors = state
+    return len(mg.generate_food_nutrients_and_carbon_data(foods, transport_factors, random.Random(2)))
+
+def _setup_fused(size):
+    return _food_names(size), _transport_factors()
+
+def _run_fused(state, output_dir):
+    names, transport_factors = state
+    mg.clear_distance_cache()
+    return sum(1 for _ in mg.iter_fused_food_records(names, transport_factors, rng=random.Random(1)))
+
+def _run_earth(num_vessels, output_dir):
+    earth_data = mg.generate_3d_earth_data(random.Random(3), num_vessels)
+    return len(earth_data["transport_paths"]) + len(earth_data["real_time_vessels"])
+
+def _run_timeline(state, output_dir):
+    timeline_data = mg.generate_timeline_data()
+    return len(timeline_data["historical_data"]) + len(timeline_data["future_projections"])
+
+def _run_heatmap(state, output_dir):
+    return len(mg.generate_global_heatmap_data(seed=4)["countries"])
+
+def _run_particles(num_particles, output_dir):
+    return len(mg.generate_particle_system_data(num_particles, seed=5)["waste_particles"])
+
+def _run_serialize_foods(output_format):
+    def run(foods, output_dir):
+        file_path = os.path.join(output_dir, mg.output_file_name("foods_with_routes", output_format))
+        return mg.write_json_stream(file_path, foods, output_format)
+    return run
+
+def _setup_particle_data(num_particles):
+    return mg.generate_particle_system_data(num_particles, seed=5)
+
+def _run_serialize_particles_json(particle_data, output_dir):
+    mg.write_enhanced_dataset("particle_system_data", particle_data, output_dir, None)
+    return len(particle_data["waste_particles"])
+
+def _run_serialize_particles_columnar(particle_data, output_dir):
+    mg.export_particle_columns(particle_data, output_dir)
+    return len(particle_data["waste_particles"])
+
+def _run_serialize_foods_sharded(foods, output_dir):
+    with mg.open_dataset_writer("foods_with_routes", output_dir, "json", shard_size=BENCHMARK_SHARD_SIZE) as writer:
+        for food_item in foods:
+            writer.write(food_item)
+    return writer.count
+
+def _route_table(foods):
+    table = mg.RouteTable()
+    for food_item in foods:
+        table.add(food_item)
+    return table
+
+def _run_normalized_routes(foods, output_dir):
+    # 建表和写出（含二进制列）都计入测量
+    return mg.write_normalized_routes(_route_table(foods), output_dir, columnar=True)
+
+def _setup_route_aggregates(size):
+    foods = _foods_with_routes(size)
+    # 偏移索引按紧凑 JSON 的长度虚拟出各条目的位置，不实际写出食物文件
+    lengths = [len(json.dumps(food_item, ensure_ascii=False).encode('utf-8')) for food_item in foods]
+    return foods, lengths, _transport_factors()
+
+def _run_route_aggregates(state, output_dir):
+    foods, lengths, transport_factors = state
+    offset = 0
+    with mg.RouteAggregator(transport_factors, output_dir) as aggregator:
+        for food_item, length in zip(foods, lengths):
+            aggregator.add(food_item, offset, length, "foods_with_routes.json")
+            offset += length
+        mg.write_route_aggregates(aggregator, output_dir)
+    return aggregator.num_routes
+
+def _setup_earth_data(num_vessels):
+    return mg.generate_3d_earth_data(random.Random(3), num_vessels)
+
+def _run_serialize_earth_columnar(earth_data, output_dir):
+    mg.export_earth_columns(earth_data, output_dir)
+    return len(earth_data["transport_paths"]) + len(earth_data["real_time_vessels"])
+
+def _setup_vessel_frames(num_vessels):
+    return num_vessels, mg.generate_3d_earth_data(random.Random(3), 0)["transport_paths"]
+
+def _run_vessel_frames(state, output_dir):
+    num_vessels, transport_paths = state
+    mg.simulate_vessel_frames(num_vessels, BENCHMARK_VESSEL_STEPS, transport_paths=transport_paths, seed=6,
+                              output_dir=output_dir)
+    return num_vessels * (BENCHMARK_VESSEL_STEPS + 1)
+
+def _setup_monte_carlo(size):
+    table = _route_table(_foods_with_routes(size))
+    mode_distances = mg.food_mode_distances(table.route_count, table.mode, mg.np.array(table.distance_km),
+                                            table.transport_modes).tolist()
+    foods = [(name, mg.get_food_category(name), row) for name, row in zip(table.food_names, mode_distances)]
+    return [(start, foods[start:start + mg.MONTE_CARLO_FOODS_PER_TASK], BENCHMARK_MONTE_CARLO_DRAWS, 7)
+            for start in range(0, len(foods), mg.MONTE_CARLO_FOODS_PER_TASK)]
+
+def _run_monte_carlo(tasks, output_dir):
+    return sum(len(mg._monte_carlo_food_task(task)) for task in tasks)
+
+def _setup_optimal_sourcing(size):
+    return _route_table(_foods_with_routes(size)).normalized(), _transport_factors()
+
+def _run_optimal_sourcing(state, output_dir):
+    normalized_routes, transport_factors = state
+    return len(mg.solve_optimal_sourcing(normalized_routes, transport_factors)["foods"])
+
+def _setup_heatmap_tiles(regions_per_country):
+    return regions_per_country, mg.generate_global_heatmap_data(seed=4)
+
+def _run_heatmap_tiles(state, output_dir):
+    regions_per_country, heatmap_data = state
+    return mg.write_heatmap_tiles(heatmap_data, output_dir, seed=4, regions_per_country=regions_per_country)
+
+def _identity(size):
+    return size
+
+BENCHMARKS = {
+    "foods_with_routes": (_food_names, _run_foods_with_routes),
+    "food_nutrients_and_carbon": (_setup_nutrients, _run_nutrients),
+    "fused_food_records": (_setup_fused, _run_fused),
+    "earth_3d_data": (_identity, _run_earth),
+    "timeline_data": (_identity, _run_timeline),
+    "global_heatmap_data": (_identity, _run_heatmap),
+    "particle_system_data": (_identity, _run_particles),
+    "serialize_foods_json": (_foods_with_routes, _run_serialize_foods("json")),
+    "serialize_foods_ndjson": (_foods_with_routes, _run_serialize_foods("ndjson")),
+    "serialize_particles_json": (_setup_particle_data, _run_serialize_particles_json),
+    "serialize_particles_columnar": (_setup_particle_data, _run_serialize_particles_columnar),
+    "serialize_foods_sharded": (_foods_with_routes, _run_serialize_foods_sharded),
+    "normalized_routes": (_foods_with_routes, _run_normalized_routes),
+    "route_aggregates": (_setup_route_aggregates, _run_route_aggregates),
+    "serialize_earth_columnar": (_setup_earth_data, _run_serialize_earth_columnar),
+    "vessel_frames": (_setup_vessel_frames, _run_vessel_frames),
+    "monte_carlo": (_setup_monte_carlo, _run_monte_carlo),
+    "optimal_sourcing": (_setup_optimal_sourcing, _run_optimal_sourcing),
+    "heatmap_tiles": (_setup_heatmap_tiles, _run_heatmap_tiles),
+}
+
+# --- 测量 ---
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位为 KB，macOS 上为字节
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def _directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def run_case(name, size, repeat):
+    """在当前进程中运行一个 (基准, 规模)，墙钟时间取 repeat 次中的最小值"""
+    setup, run = BENCHMARKS[name]
+    state = setup(size)
+    rss_after_setup = _peak_rss_kb()
+    timings = []
+    with tempfile.TemporaryDirectory(prefix="bench_") as output_dir:
+        for _ in range(repeat):
+            # generate_* 会打印进度，测量时丢弃这些输出
+            with open(os.devnull, 'w') as devnull:
+                stdout, sys.stdout = sys.stdout, devnull
+                try:
+                    start = time.perf_counter()
+                    records = run(state, output_dir)
+                    timings.append(time.perf_counter() - start)
+                finally:
+                    sys.stdout = stdout
+        output_bytes = _directory_bytes(output_dir)
+    wall_s = min(timings)
+    peak_rss_kb = _peak_rss_kb()
+    return {
+        "benchmark": name,
+        "size": size,
+        "records": records,
+        "wall_s": round(wall_s, 6),
+        "records_per_s": round(records / wall_s, 1) if wall_s > 0 else None,
+        "peak_rss_kb": peak_rss_kb,
+        "peak_rss_delta_kb": peak_rss_kb - rss_after_setup if peak_rss_kb is not None else None,
+        "output_bytes": output_bytes,
+    }
+
+def run_sweep(sweep, names=None, repeat=DEFAULT_REPEAT):
+    """逐个在全新的 spawn 子进程中运行用例，返回结果列表"""
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with context.Pool(processes=1, maxtasksperchild=1) as pool:
+        for name, sizes in BENCHMARK_SWEEPS[sweep].items():
+            if names and name not in names:
+                continue
+            if name in NUMPY_BENCHMARKS and mg.np is None:
+                print(f"{name:<30} skipped (requires numpy)")
+                continue
+            for size in sizes:
+                result = pool.apply(run_case, (name, size, repeat))
+                print(f"{name:<30} {size:>8}  {result['wall_s']:>10.4f}s  "
+                      f"{result['records_per_s'] or 0:>12.0f} rec/s  {result['output_bytes']:>12} B")
+                results.append(result)
+    return results
+
+def compare_with_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """打印与基线的墙钟时间比值，返回变慢超过 tolerance 的用例列表"""
+    baseline_by_case = {(r["benchmark"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'benchmark':<30} {'size':>8}  {'baseline':>10}  {'current':>10}  {'ratio':>6}")
+    for result in results:
+        previous = baseline_by_case.get((result["benchmark"], result["size"]))
+        if previous is None or not previous["wall_s"]:
+            continue
+        ratio = result["wall_s"] / previous["wall_s"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append({"benchmark": result["benchmark"], "size": result["size"], "ratio": round(ratio, 3)})
+            flag = "  SLOWER"
+        print(f"{result['benchmark']:<30} {result['size']:>8}  {previous['wall_s']:>10.4f}  "
+              f"{result['wall_s']:>10.4f}  {ratio:>6.2f}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="main_generator.py 的生成器和序列化基准测试")
+    parser.add_argument("--sweep", choices=BENCHMARK_SWEEPS, default="quick", help="规模组合（默认 quick）")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="只运行这些基准")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="每个用例的重复次数，取最短时间")
+    parser.add_argument("--output", help="把结果写入该 JSON 文件")
+    parser.add_argument("--baseline", help="与该 JSON 结果文件比较；有用例变慢超过容差时退出码为 1")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"允许的相对变慢幅度（默认 {DEFAULT_TOLERANCE}）")
+    args = parser.parse_args(argv)
+
+    results = run_sweep(args.sweep, args.only, args.repeat)
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": mg.np.__version__ if mg.np is not None else None,
+            "cpu_count": os.cpu_count(),
+            "sweep": args.sweep,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with mg.AtomicFile(args.output) as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than baseline by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""把 data/ 下生成的数据集一次性加载为 NumPy 列，供 Python 批量分析使用
+
+    from data_loader import DatasetStore
+    store = DatasetStore()                       # 默认读取项目的 data/ 目录
+    store.routes(food="牛肉", mode="sea")         # 路线下标（只读数组），store.route_records(...) 转为 dict
+    store.country_emissions("中国", year=2020)
+    store.top_foods_by_co2_per_nutrient("protein_g", k=5)
+
+路线优先从 --columnar 写出的 foods_with_routes_routes.bin 以内存映射方式读取（头文件记录的 sha256
+与同目录的 foods_with_routes_normalized.json 不符时视为旧文件，不使用），其次是
+foods_with_routes_normalized.json，最后才解析 foods_with_routes 本身；单文件 JSON/NDJSON 和
+manifest.json 描述的分片数据集都能读取。每列按取值建立 CSR 形式的倒排索引（排序后的路线下标 + 每个取值的起止位置），
+查询只需切片和求交集；查询结果按参数放入 LRU 缓存。
+
+命令行：python data_loader.py routes --food 牛肉 --mode sea / country 中国 / top protein_g -k 5
+"""
+import argparse
+import functools
+import json
+import os
+import time
+from types import MappingProxyType
+
+import numpy as np
+
+import main_generator as mg
+
+# --- 配置项 ---
+DEFAULT_CACHE_SIZE = 1024  # 每种查询的 LRU 缓存条目数
+ROUTES_BINARY_STEM = mg.ROUTES_BINARY_STEM
+ROUTE_COLUMNS = ("origin", "destination", "transport_mode", "distance_km")
+
+# --- 读取生成的数据文件 ---
+def _read_records(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(".ndjson"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+def read_dataset(data_dir, dataset):
+    """读取一个数据集的全部条目：单文件 <dataset>.json / .ndjson，或 manifest.json 中登记的分片"""
+    for output_format in mg.OUTPUT_FORMATS:
+        path = os.path.join(data_dir, mg.output_file_name(dataset, output_format))
+        if os.path.exists(path):
+            return _read_records(path)
+    manifest_path = os.path.join(data_dir, mg.MANIFEST_FILE_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)["datasets"].get(dataset)
+        if entry is not None:
+            records = []
+            for shard in entry["shards"]:
+                records.extend(_read_records(os.path.join(data_dir, shard["file"])))
+            return records
+    raise FileNotFoundError(f"dataset {dataset} not found in {data_dir}")
+
+def _memmap_columns(data_dir, stem):
+    """按 <stem>.bin.json 头文件把各属性映射为只读的小端数组，返回 (列字典, 头文件)"""
+    with open(os.path.join(data_dir, f"{stem}.bin.json"), 'r', encoding='utf-8') as f:
+        header = json.load(f)
+    bin_path = os.path.join(data_dir, header["binary"])
+    columns = {}
+    for name, attribute in header["attributes"].items():
+        dtype = np.dtype(attribute["dtype"]).newbyteorder("<")
+        length = attribute["byte_length"] // dtype.itemsize
+        # 长度为 0 的属性不能映射，直接给空数组
+        columns[name] = (np.memmap(bin_path, dtype=dtype, mode='r', offset=attribute["byte_offset"], shape=(length,))
+                         if length else np.empty(0, dtype=dtype))
+    return columns, header
+
+def _readonly(arr):
+    arr.setflags(write=False)
+    return arr
+
+class InvertedIndex:
+    """整数列的倒排索引：取值 k 对应的行号为 order[bounds[k]:bounds[k + 1]]（按行号升序）"""
+
+    def __init__(self, column, num_values):
+        self.order = np.argsort(column, kind="stable")
+        self.bounds = np.searchsorted(column[self.order], np.arange(num_values + 1))
+
+    def rows(self, value):
+        return self.order[self.bounds[value]:self.bounds[value + 1]]
+
+# --- 列式存储 ---
+class DatasetStore:
+    """路线、营养/碳排放和热力图数据的列式视图，各部分在第一次使用时加载"""
+
+    def __init__(self, data_dir=mg.OUTPUT_DATA_DIR, cache_size=DEFAULT_CACHE_SIZE):
+        self.data_dir = data_dir
+        self._loaded = set()
+        # 结果都是只读的（只读数组、MappingProxyType、元组），缓存的结果不会被调用方意外修改
+        self.routes = functools.lru_cache(maxsize=cache_size)(self._routes)
+        self.country_emissions = functools.lru_cache(maxsize=cache_size)(self._country_emissions)
+        self.route_emissions_by_country = functools.lru_cache(maxsize=cache_size)(self._route_emissions_by_country)
+        self.top_foods_by_co2_per_nutrient = functools.lru_cache(maxsize=cache_size)(
+            self._top_foods_by_co2_per_nutrient)
+
+    def _load_once(self, part, loader):
+        if part not in self._loaded:
+            loader()
+            self._loaded.add(part)
+
+    # 路线
+    def _load_routes(self):
+        bin_header = os.path.join(self.data_dir, f"{ROUTES_BINARY_STEM}.bin.json")
+        normalized_path = os.path.join(self.data_dir, mg.NORMALIZED_ROUTES_FILE_NAME)
+        use_binary = False
+        if os.path.exists(bin_header):
+            with open(bin_header, 'r', encoding='utf-8') as f:
+                # 旧的二进制文件（如上次 --columnar 之后又换了种子生成）直接跳过，改读规范化 JSON
+                use_binary = mg.routes_binary_is_fresh(json.load(f), normalized_path)
+        if use_binary:
+            columns, header = _memmap_columns(self.data_dir, ROUTES_BINARY_STEM)
+            self.country_names = header["countries"]
+            self.transport_modes = header["transport_modes"]
+            self.food_names = header["foods"]
+            self.route_columns = {name: columns[name] for name in ROUTE_COLUMNS}
+            self.food_route_start = columns["food_route_start"]
+            self.food_route_count = columns["food_route_count"]
+            self.routes_source = "memmap"
+        elif os.path.exists(normalized_path):
+            with open(normalized_path, 'r', encoding='utf-8') as f:
+                normalized = json.load(f)
+            self._set_routes_from_normalized(normalized)
+            self.routes_source = "normalized"
+        else:
+            table = mg.RouteTable()
+            for food_item in read_dataset(self.data_dir, "foods_with_routes"):
+                table.add(food_item)
+            self._set_routes_from_normalized(table.normalized())
+            self.routes_source = "foods_with_routes"
+
+        self.food_ids = {name: i for i, name in enumerate(self.food_names)}
+        self.country_ids = {name: i for i, name in enumerate(self.country_names)}
+        self.mode_ids = {mode: i for i, mode in enumerate(self.transport_modes)}
+        num_routes = len(self.route_columns["origin"])
+        self.route_food = _readonly(np.repeat(np.arange(len(self.food_names), dtype=np.uint32),
+                                              np.asarray(self.food_route_count, dtype=np.int64)))
+        if len(self.route_food) != num_routes:
+            raise ValueError(f"route counts add up to {len(self.route_food)}, expected {num_routes} routes")
+        self.route_index = {
+            "origin": InvertedIndex(self.route_columns["origin"], len(self.country_names)),
+            "destination": InvertedIndex(self.route_columns["destination"], len(self.country_names)),
+            "transport_mode": InvertedIndex(self.route_columns["transport_mode"], len(self.transport_modes)),
+        }
+
+        factors_path = os.path.join(self.data_dir, "transport_factors.json")
+        factors = mg.BASE_TRANSPORT_FACTORS
+        if os.path.exists(factors_path):
+            with open(factors_path, 'r', encoding='utf-8') as f:
+                factors = json.load(f)
+        # 与 average_transport_co2_per_kg 相同的口径：距离 × 运输因子 / 1e6，单位 kg CO2 / kg 食物
+        mode_factors = np.array([factors[mode] for mode in self.transport_modes])
+        self.route_transport_co2 = _readonly(
+            self.route_columns["distance_km"] * mode_factors[self.route_columns["transport_mode"]] / 1000000)
+
+    def _set_routes_from_normalized(self, normalized):
+        foods, routes = normalized["foods"], normalized["routes"]
+        self.country_names = [country["name"] for country in normalized["countries"]]
+        self.transport_modes = normalized["transport_modes"]
+        self.food_names = foods["name"]
+        self.route_columns = {
+            "origin": _readonly(np.array(routes["origin"], dtype=np.uint32)),
+            "destination": _readonly(np.array(routes["destination"], dtype=np.uint32)),
+            "transport_mode": _readonly(np.array(routes["transport_mode"], dtype=np.uint32)),
+            "distance_km": _readonly(np.array(routes["distance_km"], dtype=np.float32)),
+        }
+        self.food_route_start = _readonly(np.array(foods["route_start"], dtype=np.uint32))
+        self.food_route_count = _readonly(np.array(foods["route_count"], dtype=np.uint32))
+
+    def _lookup(self, ids, value, kind):
+        try:
+            return ids[value]
+        except KeyError:
+            raise KeyError(f"unknown {kind}: {value}") from None
+
+    def _routes(self, food=None, origin=None, destination=None, mode=None):
+        """满足所有给定条件的路线下标（升序的只读数组）"""
+        self._load_once("routes", self._load_routes)
+        candidates = []
+        if food is not None:
+            food_id = self._lookup(self.food_ids, food, "food")
+            start = int(self.food_route_start[food_id])
+            candidates.append(np.arange(start, start + int(self.food_route_count[food_id])))
+        for column, value, ids, kind in (("origin", origin, self.country_ids, "country"),
+                                         ("destination", destination, self.country_ids, "country"),
+                                         ("transport_mode", mode, self.mode_ids, "transport mode")):
+            if value is not None:
+                candidates.append(self.route_index[column].rows(self._lookup(ids, value, kind)))
+        if not candidates:
+            return _readonly(np.arange(len(self.route_food)))
+        # 从最短的候选集开始逐个求交集
+        candidates.sort(key=len)
+        rows = candidates[0]
+        for other in candidates[1:]:
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        return _readonly(np.array(rows, dtype=np.int64))
+
+    def route_records(self, rows):
+        """把路线下标转为 dict 列表，字段名与 foods_with_routes 中的路线相同，另附食物名和运输碳排放"""
+        self._load_once("routes", self._load_routes)
+        columns = self.route_columns
+        return [{
+            "food": self.food_names[self.route_food[i]],
+            "origin_country": self.country_names[columns["origin"][i]],
+            "destination_country": self.country_names[columns["destination"][i]],
+            "distance_km": round(float(columns["distance_km"][i]), 2),
+            "transport_mode": self.transport_modes[columns["transport_mode"][i]],
+            "transport_co2_per_kg": round(float(self.route_transport_co2[i]), 6),
+        } for i in rows]
+
+    def _route_emissions_by_country(self, role="origin", mode=None):
+        """按出发国或目的国汇总路线的运输碳排放，返回只读映射 {国家: (路线数, kg CO2 / kg 食物之和)}"""
+        self._load_once("routes", self._load_routes)
+        if role not in ("origin", "destination"):
+            raise ValueError(f"role must be origin or destination, got {role}")
+        rows = self.routes(mode=mode)
+        countries = self.route_columns[role][rows]
+        counts = np.bincount(countries, minlength=len(self.country_names))
+        totals = np.bincount(countries, weights=self.route_transport_co2[rows], minlength=len(self.country_names))
+        return MappingProxyType({name: (int(counts[i]), round(float(totals[i]), 6))
+                                 for i, name in enumerate(self.country_names) if counts[i]})
+
+    # 营养素与碳排放
+    def _load_nutrients(self):
+        records = read_dataset(self.data_dir, "food_nutrients_and_carbon")
+        self.nutrient_food_names = [record["name"] for record in records]
+        self.nutrient_food_ids = {name: i for i, name in enumerate(self.nutrient_food_names)}
+        self.categories = list(dict.fromkeys(record["category"] for record in records))
+        self.category_ids = {category: i for i, category in enumerate(self.categories)}
+        self.food_category = _readonly(np.array([self.category_ids[record["category"]] for record in records],
+                                                dtype=np.uint32))
+        self.food_co2 = {key: _readonly(np.array([record[key] for record in records], dtype=np.float64))
+                         for key in ("production_co2_per_kg", "average_transport_co2_per_kg", "total_co2_per_kg")}
+        self.nutrient_names = list(mg.NUTRIENT_DEFINITIONS)
+        self.nutrient_ids = {nutrient: i for i, nutrient in enumerate(self.nutrient_names)}
+        self.nutrients = _readonly(np.array([[record["nutrients_per_100g"].get(nutrient, 0)
+                                              for nutrient in self.nutrient_names] for record in records],
+                                            dtype=np.float64).reshape(len(records), len(self.nutrient_names)))
+
+    def _top_foods_by_co2_per_nutrient(self, nutrient, k=10, category=None, largest=False):
+        """每单位营养素碳排放最低（largest=True 时最高）的 k 个食物，返回 ((食物, kg CO2eq / 单位营养素), ...)
+
+        口径与 nutrient_rankings.json 相同：total_co2_per_kg / (每 100g 含量 × 10)，含量为 0 的食物不参与排名。
+        """
+        self._load_once("nutrients", self._load_nutrients)
+        values = self.nutrients[:, self._lookup(self.nutrient_ids, nutrient, "nutrient")]
+        eligible = values > 0
+        if category is not None:
+            eligible &= self.food_category == self._lookup(self.category_ids, category, "category")
+        candidates = np.flatnonzero(eligible)
+        co2_per_unit = self.food_co2["total_co2_per_kg"][candidates] / (values[candidates] * 10)
+        sort_key = -co2_per_unit if largest else co2_per_unit
+        k = min(k, len(candidates))
+        if k == 0:
+            return ()
+        top = np.argpartition(sort_key, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+        # 与 nutrient_rankings.json 一致，数值相同时按食物原顺序排列
+        top = top[np.lexsort((candidates[top], sort_key[top]))]
+        return tuple((self.nutrient_food_names[candidates[i]], round(float(co2_per_unit[i]), 6)) for i in top)
+
+    # 各国碳足迹
+    def _load_heatmap(self):
+        path = os.path.join(self.data_dir, "global_heatmap_data.json")
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                countries = json.load(f)["countries"]
+        else:
+            countries = read_dataset(self.data_dir, "global_heatmap_data.countries")
+        self.heatmap_years = [entry["year"] for entry in countries[0]["historical_data"]] if countries else []
+        self.heatmap_year_ids = {year: i for i, year in enumerate(self.heatmap_years)}
+        self.heatmap_country_ids = {}
+        for i, country in enumerate(countries):
+            self.heatmap_country_ids[country["country_code"]] = i
+            self.heatmap_country_ids[country["country_name"]] = i
+        self.heatmap_country_names = [country["country_name"] for country in countries]
+        self.country_population = _readonly(np.array([country["population"] for country in countries],
+                                                     dtype=np.float64))
+        self.country_current_carbon = _readonly(np.array([country["current_carbon_footprint"]
+                                                          for country in countries], dtype=np.float64))
+        # (国家, 年份) 人均碳足迹矩阵
+        self.country_carbon_by_year = _readonly(np.array(
+            [[entry["carbon_per_capita"] for entry in country["historical_data"]] for country in countries],
+            dtype=np.float64).reshape(len(countries), len(self.heatmap_years)))
+
+    def _country_emissions(self, country, year=None):
+        """某国（代码或名称）的人均碳足迹和按人口折算的总排放（只读映射）；year 为 None 时使用当前数值"""
+        self._load_once("heatmap", self._load_heatmap)
+        i = self._lookup(self.heatmap_country_ids, country, "country")
+        if year is None:
+            per_capita = float(self.country_current_carbon[i])
+        else:
+            per_capita = float(self.country_carbon_by_year[i, self._lookup(self.heatmap_year_ids, year, "year")])
+        population = float(self.country_population[i])
+        return MappingProxyType({"country": self.heatmap_country_names[i], "year": year,
+                                 "carbon_per_capita": per_capita, "population": int(population),
+                                 "total_emissions": per_capita * population})
+
+    def cache_info(self):
+        return {name: getattr(self, name).cache_info()._asdict()
+                for name in ("routes", "country_emissions", "route_emissions_by_country",
+                             "top_foods_by_co2_per_nutrient")}
+
+    def clear_cache(self):
+        for name in self.cache_info():
+            getattr(self, name).cache_clear()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="对生成的数据集做索引查询")
+    parser.add_argument("--data-dir", default=mg.OUTPUT_DATA_DIR, help="数据目录（默认项目的 data/）")
+    subparsers = parser.add_subparsers(dest="query", required=True)
+    routes_parser = subparsers.add_parser("routes", help="按食物 / 出发国 / 目的国 / 运输方式查询路线")
+    routes_parser.add_argument("--food")
+    routes_parser.add_argument("--origin")
+    routes_parser.add_argument("--destination")
+    routes_parser.add_argument("--mode", choices=mg.TRANSPORT_MODES)
+    country_parser = subparsers.add_parser("country", help="某国的人均碳足迹和总排放")
+    country_parser.add_argument("country", help="国家代码或名称")
+    country_parser.add_argument("--year", type=int)
+    top_parser = subparsers.add_parser("top", help="每单位营养素碳排放最低的食物")
+    top_parser.add_argument("nutrient", choices=list(mg.NUTRIENT_DEFINITIONS))
+    top_parser.add_argument("-k", type=int, default=10)
+    top_parser.add_argument("--category")
+    top_parser.add_argument("--largest", action="store_true", help="改为取碳排放最高的食物")
+    args = parser.parse_args(argv)
+
+    store = DatasetStore(args.data_dir)
+    start = time.perf_counter()
+    if args.query == "routes":
+        result = store.route_records(store.routes(args.food, args.origin, args.destination, args.mode))
+    elif args.query == "country":
+        result = dict(store.country_emissions(args.country, args.year))
+    else:
+        result = store.top_foods_by_co2_per_nutrient(args.nutrient, args.k, args.category, args.largest)
+    elapsed = time.perf_counter() - start
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"Query took {elapsed * 1000:.2f} ms (including loading)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""本地预览服务器：代替 python -m http.server 提供 web/ 和 data/
+
+    python data_server.py --port 8000            # 在浏览器中访问 http://localhost:8000
+    python main_generator.py --precompress       # 生成数据时顺带写出 .br / .gz 压缩版本
+
+与 http.server 相比：
+- 客户端接受时优先发送 main_generator.py --precompress 预先写出的 brotli / gzip 版本（比源文件旧的不用）；
+- 每个表示都带有由内容 SHA-256 得出的强 ETag，If-None-Match 命中时返回 304；
+- 支持单个区间的 Range / If-Range 请求，前端可以只取分片或二进制文件的一部分；
+- 每个连接一个线程（HTTP/1.1 keep-alive），并发请求互不阻塞；
+- 默认只提供站点需要的 index.html、web/ 和 data/，不暴露 .git、生成脚本等仓库中的其他文件；
+  任何以 . 开头的路径段（.git、.build_cache.json、临时文件）都返回 404。
+"""
+import argparse
+import hashlib
+import http
+import os
+import posixpath
+import shutil
+import sys
+import threading
+import urllib.parse
+from email.utils import formatdate
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import main_generator as mg
+
+# --- 配置项 ---
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+DEFAULT_MAX_AGE = 0  # 0 表示 Cache-Control: no-cache，每次都用 ETag 向服务器确认
+REQUEST_QUEUE_SIZE = 128
+# 以默认的项目根目录为站点根时，只提供这些顶层条目：首页、页面和生成的数据
+SITE_ENTRIES = ("index.html", "web", "data")
+HASH_CHUNK_SIZE = 1 << 20
+# 这些类型的文件响应会因 Accept-Encoding 而不同，需要带 Vary 头
+COMPRESSIBLE_EXTENSIONS = mg.PRECOMPRESS_EXTENSIONS
+
+# --- 内容哈希缓存：按 (路径, 修改时间, 大小) 缓存，文件重新生成后自动重新计算 ---
+class ContentHashCache:
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def etag(self, path, stat):
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._hashes.get(key)
+        if cached is None:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            cached = f'"{digest.hexdigest()[:32]}"'
+            with self._lock:
+                self._hashes[key] = cached
+        return cached
+
+class _FileRange:
+    """只读出文件中 [start, start + length) 这一段的文件对象，供 copyfile 使用"""
+
+    def __init__(self, f, start, length):
+        self.file = f
+        self.remaining = length
+        f.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+def parse_range(header, size):
+    """解析 bytes=start-end / bytes=start- / bytes=-suffix，返回 (start, end)（含 end）
+
+    多个区间或格式不对时返回 None，表示忽略 Range 返回整个文件；区间落在文件之外时抛出 RangeNotSatisfiable。
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash or not (first or last) or not (first + last).isdigit():
+        return None
+    if not first:
+        # 后缀区间：最后 last 个字节
+        if int(last) == 0 or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+def _accepted_encodings(header):
+    """Accept-Encoding 中 q > 0 的编码集合"""
+    accepted = set()
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name and q > 0:
+            accepted.add(name.lower())
+    return accepted
+
+def is_path_allowed(url_path, allowed_entries=None):
+    """请求路径是否可以提供：不含以 . 开头的路径段，且（给出 allowed_entries 时）位于允许的顶层条目之下"""
+    path = urllib.parse.unquote(url_path.split("?", 1)[0].split("#", 1)[0])
+    parts = [part for part in posixpath.normpath(path).split("/") if part]
+    if any(part.startswith(".") for part in parts):
+        return False
+    return allowed_entries is None or not parts or parts[0] in allowed_entries
+
+def _etag_matches(header, etag):
+    """If-None-Match 使用弱比较：忽略 W/ 前缀"""
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+class DataRequestHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FoodCarbonDataServer/1.0"
+    extensions_map = {**SimpleHTTPRequestHandler.extensions_map,
+                      ".json": "application/json", ".ndjson": "application/x-ndjson",
+                      ".bin": "application/octet-stream", ".js": "text/javascript"}
+
+    def send_head(self):
+        if not is_path_allowed(self.path, self.server.allowed_entries):
+            self.send_error(http.HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            index = os.path.join(path, "index.html")
+            if not os.path.isfile(index) or not self.path.split("?", 1)[0].endswith("/"):
+                # 目录列表和补全末尾斜杠的重定向仍由 http.server 处理
+                return super().send_head()
+            path = index
+        if not os.path.isfile(path):
+            self.send_error(http.HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        compressible = path.endswith(COMPRESSIBLE_EXTENSIONS)
+        encoding, body_path = None, path
+        range_header = self.headers.get("Range")
+        # 区间总是针对未压缩的表示，带 Range 的请求不发送压缩版本
+        if compressible and range_header is None:
+            accepted = _accepted_encodings(self.headers.get("Accept-Encoding"))
+            for candidate, suffix in mg.PRECOMPRESS_ENCODINGS.items():
+                if candidate in accepted and mg.precompressed_variant_is_fresh(path, path + suffix):
+                    encoding, body_path = candidate, path + suffix
+                    break
+
+        try:
+            f = open(body_path, 'rb')
+        except OSError:
+            self.send_error(http.HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        try:
+            stat = os.fstat(f.fileno())
+            etag = self.server.hashes.etag(body_path, stat)
+            headers = {
+                "ETag": etag,
+                "Cache-Control": self.server.cache_control,
+                "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+                "Accept-Ranges": "bytes",
+            }
+            if compressible:
+                headers["Vary"] = "Accept-Encoding"
+
+            if_none_match = self.headers.get("If-None-Match")
+            if if_none_match is not None and _etag_matches(if_none_match, etag):
+                f.close()
+                self._send_headers(http.HTTPStatus.NOT_MODIFIED, headers)
+                return None
+
+            headers["Content-Type"] = self.guess_type(path)
+            if encoding is not None:
+                headers["Content-Encoding"] = encoding
+            size = stat.st_size
+            byte_range = None
+            if range_header is not None:
+                if_range = self.headers.get("If-Range")
+                # If-Range 只接受强 ETag 完全相等；不相等时忽略 Range 返回整个文件
+                if if_range is None or if_range.strip() == etag:
+                    try:
+                        byte_range = parse_range(range_header, size)
+                    except RangeNotSatisfiable:
+                        f.close()
+                        headers["Content-Range"] = f"bytes */{size}"
+                        headers["Content-Length"] = "0"
+                        self._send_headers(http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, headers)
+                        return None
+            if byte_range is None:
+                headers["Content-Length"] = str(size)
+                self._send_headers(http.HTTPStatus.OK, headers)
+                return f
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            self._send_headers(http.HTTPStatus.PARTIAL_CONTENT, headers)
+            return _FileRange(f, start, end - start + 1)
+        except Exception:
+            f.close()
+            raise
+
+    def _send_headers(self, status, headers):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def copyfile(self, source, outputfile):
+        try:
+            shutil.copyfileobj(source, outputfile)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开（如只需要前几个字节就取消了请求），不算服务器错误
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+class DataServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+    def __init__(self, address, root, max_age=DEFAULT_MAX_AGE, quiet=False, allowed_entries=SITE_ENTRIES):
+        self.hashes = ContentHashCache()
+        self.allowed_entries = allowed_entries
+        self.cache_control = f"public, max-age={max_age}" if max_age > 0 else "no-cache"
+        self.quiet = quiet
+        super().__init__(address, lambda *args: DataRequestHandler(*args, directory=root))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="提供 web/ 和 data/ 的本地预览服务器")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"监听地址（默认 {DEFAULT_HOST}）")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"监听端口（默认 {DEFAULT_PORT}）")
+    parser.add_argument("--root", help="站点根目录；默认项目根目录，且只提供其中的 "
+                                       + "、".join(SITE_ENTRIES) + "；指定时提供该目录下除 . 开头以外的全部文件")
+    parser.add_argument("--max-age", type=int, default=DEFAULT_MAX_AGE,
+                        help="Cache-Control 的 max-age 秒数；默认 0，即 no-cache，每次用 ETag 验证")
+    parser.add_argument("--quiet", action="store_true", help="不打印每个请求的访问日志")
+    args = parser.parse_args(argv)
+
+    root, allowed_entries = (args.root, None) if args.root else (mg.PROJECT_ROOT, SITE_ENTRIES)
+    with DataServer((args.host, args.port), root, args.max_age, args.quiet, allowed_entries) as server:
+        host, port = server.server_address[:2]
+        print(f"Serving {os.path.abspath(root)} at http://{host}:{port}/ (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nStopped")
+            sys.exit(0)
+
+if __name__ == "__main__":
+    main()
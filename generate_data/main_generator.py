@@ -1,10 +1,43 @@
+import argparse
+import cProfile
+import functools
+import gzip
+import hashlib
+import heapq
+import inspect
+import itertools
 import json
+import pstats
 import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+import types
+from array import array
 from math import radians, sin, cos, sqrt, atan2
 import os
 import math
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 
+try:
+    import numpy as np
+except ImportError:  # numpy 为可选依赖，缺失时退回纯 Python 实现
+    np = None
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，运行指标中不记录峰值 RSS
+    resource = None
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，缺失时预压缩只写出 gzip 版本
+    brotli = None
+
 # --- 配置项 ---
 NUM_FOODS_TO_GENERATE = 20
 NUM_ORIGINS_PER_FOOD_MIN = 1
@@ -12,6 +45,18 @@ NUM_ORIGINS_PER_FOOD_MAX = 3
 NUM_DESTINATIONS_PER_ORIGIN_MIN = 2
 NUM_DESTINATIONS_PER_ORIGIN_MAX = 5
 
+# 规模模式（压力测试数据集）的默认规模，可通过命令行或 --config 配置文件覆盖
+SCALE_NUM_FOODS = 100000
+SCALE_NUM_COUNTRIES = 1000
+SCALE_PROGRESS_INTERVAL = 10000  # 每生成多少个食物打印一次进度
+SYNTHETIC_FOOD_SEPARATOR = "#"   # 合成食物变体的命名分隔符，如 "苹果#12"
+
+# 分片并行生成：每个分片的食物/粒子数量。分片划分与进程数无关，保证输出只取决于主种子
+GENERATION_SHARD_SIZE = 256
+PARTICLE_SHARD_SIZE = 10000
+NUM_PARTICLES = 100
+NUM_VESSELS = 20
+
 # 修正输出目录的路径构建
 # __file__ 是当前脚本 (main_generator.py) 的路径
 # os.path.dirname(__file__) 是 generate_data 目录
@@ -19,10 +64,186 @@ NUM_DESTINATIONS_PER_ORIGIN_MAX = 5
 # 使用 os.path.abspath 确保路径的绝对性，避免相对路径问题
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 OUTPUT_DATA_DIR = os.path.join(PROJECT_ROOT, "data")
+SCALE_OUTPUT_DIR = os.path.join(OUTPUT_DATA_DIR, "scale")
+SHARDS_DIR_NAME = "shards"          # 分片输出模式下分片文件所在的子目录
+MANIFEST_FILE_NAME = "manifest.json"
+BUILD_CACHE_FILE_NAME = ".build_cache.json"  # 增量构建：各生成阶段的输入指纹和输出文件校验和
+
+EARTH_RADIUS_KM = 6371  # 地球半径 (公里)
+
+METRICS_FILE_NAME = "run_metrics.json"
+METRICS_PROFILE_TOP = 25  # 报告中列出的累计耗时最多的函数个数
+
+# --- 运行指标：按阶段记录耗时、产出条目数、写出字节数和峰值内存，未启用时几乎没有开销 ---
+class _NullStage:
+    """未启用指标时 metrics_stage() 返回的共享空上下文"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def add_items(self, count):
+        pass
+
+_NULL_STAGE = _NullStage()
+_RUN_METRICS = None  # 启用时为 RunMetrics 实例
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # macOS 上单位为字节
+
+class MetricsStage:
+    def __init__(self, metrics, name, parent):
+        self.metrics = metrics
+        self.name = name
+        self.parent = parent
+        self.items = 0
+        self.bytes_written = 0
+        self.files = 0
+        self.traced_peak = 0
+
+    def add_items(self, count):
+        self.items += count
+
+    def __enter__(self):
+        if self.metrics.trace_memory:
+            # tracemalloc 只有一个全局峰值：进入子阶段前先把目前的峰值记到父阶段上，再清零
+            if self.parent is not None:
+                self.parent.traced_peak = max(self.parent.traced_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.metrics.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        self.metrics.stack.pop()
+        record = {
+            "name": self.name,
+            "parent": self.parent.name if self.parent is not None else None,
+            "duration_s": round(duration, 6),
+            "items": self.items,
+            "items_per_s": round(self.items / duration, 1) if self.items and duration > 0 else None,
+            "bytes_written": self.bytes_written,
+            "files_written": self.files,
+            "peak_rss_kb": _peak_rss_kb(),
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        if self.metrics.trace_memory:
+            self.traced_peak = max(self.traced_peak, tracemalloc.get_traced_memory()[1])
+            record["peak_traced_kb"] = self.traced_peak // 1024
+            if self.parent is not None:
+                self.parent.traced_peak = max(self.parent.traced_peak, self.traced_peak)
+            tracemalloc.reset_peak()
+        if self.parent is not None:
+            self.parent.bytes_written += self.bytes_written
+            self.parent.files += self.files
+        self.metrics.stages.append(record)
+        return False
+
+class RunMetrics:
+    """一次生成运行的指标；阶段可以嵌套，写出的文件计入当前最内层阶段及其所有外层阶段"""
+
+    def __init__(self, profile=False, trace_memory=False):
+        self.profile = cProfile.Profile() if profile else None
+        self.trace_memory = trace_memory
+        self.stack = []
+        self.stages = []
+        self.files = []
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.start = time.perf_counter()
+        if trace_memory:
+            tracemalloc.start()
+        if self.profile is not None:
+            self.profile.enable()
+
+    def stage(self, name):
+        return MetricsStage(self, name, self.stack[-1] if self.stack else None)
+
+    def file_written(self, file_path, duration):
+        size = os.path.getsize(file_path)
+        stage = self.stack[-1] if self.stack else None
+        if stage is not None:
+            stage.bytes_written += size
+            stage.files += 1
+        self.files.append({"path": file_path, "bytes": size, "duration_s": round(duration, 6),
+                           "stage": stage.name if stage is not None else None})
+
+    def report(self, report_path, status="ok"):
+        if self.profile is not None:
+            self.profile.disable()
+        report = {
+            "started_at": self.started_at,
+            "status": status,
+            "total_s": round(time.perf_counter() - self.start, 6),
+            "peak_rss_kb": _peak_rss_kb(),
+            "bytes_written": sum(f["bytes"] for f in self.files),
+            "stages": self.stages,
+            "files": self.files,
+        }
+        if self.trace_memory:
+            # 每个阶段结束时都会清零 tracemalloc 的峰值，整次运行的峰值取各阶段峰值的最大者
+            report["peak_traced_kb"] = max([tracemalloc.get_traced_memory()[1] // 1024] +
+                                           [stage["peak_traced_kb"] for stage in self.stages])
+            tracemalloc.stop()
+        if self.profile is not None:
+            profile_path = os.path.splitext(report_path)[0] + ".prof"
+            self.profile.dump_stats(profile_path)
+            stats = pstats.Stats(self.profile)
+            top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:METRICS_PROFILE_TOP]
+            report["profile"] = {
+                "stats_file": profile_path,
+                "top_cumulative": [
+                    {"function": f"{filename}:{line}({func})", "calls": calls, "total_s": round(total, 6),
+                     "cumulative_s": round(cumulative, 6)}
+                    for (filename, line, func), (_, calls, total, cumulative, _) in top
+                ]
+            }
+        with AtomicFile(report_path, track=False) as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Run metrics written to {report_path}")
+
+def start_run_metrics(profile=False, trace_memory=False):
+    global _RUN_METRICS
+    _RUN_METRICS = RunMetrics(profile, trace_memory)
+    return _RUN_METRICS
+
+def finish_run_metrics(report_path, status="ok"):
+    global _RUN_METRICS
+    metrics, _RUN_METRICS = _RUN_METRICS, None
+    if metrics is not None:
+        metrics.report(report_path, status)
+
+def metrics_stage(name):
+    """with metrics_stage("...") as stage: ...；未启用指标时返回共享的空上下文"""
+    if _RUN_METRICS is None:
+        return _NULL_STAGE
+    return _RUN_METRICS.stage(name)
+
+def instrumented(items=None):
+    """把函数的每次调用记为一个阶段；items(result) 给出产出的条目数。未启用指标时直接调用原函数"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _RUN_METRICS is None:
+                return fn(*args, **kwargs)
+            with _RUN_METRICS.stage(fn.__name__) as stage:
+                result = fn(*args, **kwargs)
+                if items is not None:
+                    stage.add_items(items(result))
+            return result
+        return wrapper
+    return decorator
+
 
 # --- 辅助函数：计算两点间球面距离 (Haversine) ---
 def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # 地球半径 (公里)
+    R = EARTH_RADIUS_KM
     try:
         lat1_rad, lon1_rad, lat2_rad, lon2_rad = map(radians, [float(lat1), float(lon1), float(lat2), float(lon2)])
     except ValueError:
@@ -38,6 +259,95 @@ def haversine(lat1, lon1, lat2, lon2):
     distance = R * c
     return round(distance, 2)
 
+# --- 批量距离引擎：预计算弧度坐标，按产地一次向量化计算它到所需目的地的距离 ---
+_DISTANCE_TABLE_CACHE = {}
+
+def _to_radians(values):
+    """把角度序列转换为弧度数组 (numpy 可用时为 ndarray，否则为 list)"""
+    values = [radians(float(v)) for v in values]
+    return np.array(values, dtype=np.float64) if np is not None else values
+
+def haversine_matrix(lat1_rad, lon1_rad, lat2_rad, lon2_rad):
+    """计算 len(lat1)×len(lat2) 的球面距离矩阵（公里，未取整），输入为弧度"""
+    if np is not None:
+        lat1 = np.asarray(lat1_rad, dtype=np.float64)[:, None]
+        lon1 = np.asarray(lon1_rad, dtype=np.float64)[:, None]
+        lat2 = np.asarray(lat2_rad, dtype=np.float64)[None, :]
+        lon2 = np.asarray(lon2_rad, dtype=np.float64)[None, :]
+        a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+        a = np.clip(a, 0.0, 1.0)
+        return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    cos_lat2 = [cos(lat) for lat in lat2_rad]
+    matrix = []
+    for lat1, lon1 in zip(lat1_rad, lon1_rad):
+        cos_lat1 = cos(lat1)
+        row = []
+        for lat2, lon2, cos_l2 in zip(lat2_rad, lon2_rad, cos_lat2):
+            a = sin((lat2 - lat1) / 2)**2 + cos_lat1 * cos_l2 * sin((lon2 - lon1) / 2)**2
+            a = min(max(a, 0.0), 1.0)
+            row.append(EARTH_RADIUS_KM * 2 * atan2(sqrt(a), sqrt(1 - a)))
+        matrix.append(row)
+    return matrix
+
+def haversine_pairs(coords_from, coords_to):
+    """逐对计算距离（公里，未取整）：coords_from[i] -> coords_to[i]，坐标为 {"lat", "lon"} 字典"""
+    lat1 = _to_radians([c["lat"] for c in coords_from])
+    lon1 = _to_radians([c["lon"] for c in coords_from])
+    lat2 = _to_radians([c["lat"] for c in coords_to])
+    lon2 = _to_radians([c["lon"] for c in coords_to])
+    if np is not None:
+        a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+        a = np.clip(a, 0.0, 1.0)
+        return (EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))).tolist()
+
+    distances = []
+    for la1, lo1, la2, lo2 in zip(lat1, lon1, lat2, lon2):
+        a = sin((la2 - la1) / 2)**2 + cos(la1) * cos(la2) * sin((lo2 - lo1) / 2)**2
+        a = min(max(a, 0.0), 1.0)
+        distances.append(EARTH_RADIUS_KM * 2 * atan2(sqrt(a), sqrt(1 - a)))
+    return distances
+
+class DistanceTable:
+    """国家间按 haversine() 精度取整的距离，按需计算
+
+    只缓存各国的弧度坐标（与国家数成正比），row() 每次只计算一个产地到给出的目的地的距离，
+    不保存 N×N 的矩阵，规模模式下内存不随国家数平方增长。
+    """
+
+    def __init__(self, countries_data):
+        self.names = list(countries_data)
+        self.country_index = {name: i for i, name in enumerate(self.names)}
+        self._lats = _to_radians([countries_data[name]["lat"] for name in self.names])
+        self._lons = _to_radians([countries_data[name]["lon"] for name in self.names])
+
+    def __len__(self):
+        return len(self.names)
+
+    def row(self, origin_idx, dest_indices):
+        """origin_idx 到 dest_indices 中各国的距离列表（公里，保留 2 位小数）"""
+        dest_indices = list(dest_indices)
+        if np is not None:
+            distances = haversine_matrix(self._lats[origin_idx:origin_idx + 1], self._lons[origin_idx:origin_idx + 1],
+                                         self._lats[dest_indices], self._lons[dest_indices])
+            return np.round(distances[0], 2).tolist()
+        distances = haversine_matrix([self._lats[origin_idx]], [self._lons[origin_idx]],
+                                     [self._lats[j] for j in dest_indices], [self._lons[j] for j in dest_indices])
+        return [round(d, 2) for d in distances[0]]
+
+def get_distance_table(countries_data=None):
+    """返回国家表对应的 DistanceTable；在一次生成过程中按国家表缓存，每次生成开始时由 clear_distance_cache() 清空"""
+    if countries_data is None:
+        countries_data = COUNTRIES_DATA
+    cache_key = tuple((name, coords["lat"], coords["lon"]) for name, coords in countries_data.items())
+    table = _DISTANCE_TABLE_CACHE.get(cache_key)
+    if table is None:
+        table = _DISTANCE_TABLE_CACHE[cache_key] = DistanceTable(countries_data)
+    return table
+
+def clear_distance_cache():
+    _DISTANCE_TABLE_CACHE.clear()
+
 # --- 预定义数据 ---
 FOOD_CATEGORIES = {
     "fruit": ["苹果", "香蕉", "橙子", "葡萄", "草莓", "芒果", "菠萝"],
@@ -51,6 +361,26 @@ FOOD_CATEGORIES = {
 
 ALL_FOOD_NAMES = sum(FOOD_CATEGORIES.values(), [])
 
+# 食物 -> 分类的反向索引，生成过程中按名称 O(1) 查询分类
+FOOD_CATEGORY_INDEX = {name: cat for cat, names in FOOD_CATEGORIES.items() for name in names}
+
+# 各分类的生成属性：是否易腐、生产碳排放范围 (kg CO2eq/kg)、无路线时的运输碳排放范围、消费环节浪费比例范围
+CATEGORY_ATTRIBUTES = {
+    "fruit":         {"perishable": True,  "production_co2_range": (0.1, 1.5),  "fallback_transport_co2_range": (0.2, 1.5),  "waste_range": (0.15, 0.40)},
+    "vegetable":     {"perishable": False, "production_co2_range": (0.1, 1.5),  "fallback_transport_co2_range": (0.05, 0.5), "waste_range": (0.15, 0.40)},
+    "grain":         {"perishable": False, "production_co2_range": (0.5, 3.0),  "fallback_transport_co2_range": (0.05, 0.5), "waste_range": (0.05, 0.15)},
+    "protein_meat":  {"perishable": True,  "production_co2_range": (2.0, 20.0), "fallback_transport_co2_range": (0.2, 1.5),  "waste_range": (0.10, 0.25)},
+    "protein_plant": {"perishable": False, "production_co2_range": (0.5, 3.0),  "fallback_transport_co2_range": (0.05, 0.5), "waste_range": (0.05, 0.15)},
+    "dairy":         {"perishable": True,  "production_co2_range": (2.0, 20.0), "fallback_transport_co2_range": (0.2, 1.5),  "waste_range": (0.15, 0.40)},
+    "other":         {"perishable": False, "production_co2_range": (0.1, 1.5),  "fallback_transport_co2_range": (0.05, 0.5), "waste_range": (0.05, 0.15)},
+}
+
+# 运输时空运概率较高的易腐食品：易腐分类的全部食物，加上部分叶菜
+PERISHABLE_FOODS = frozenset(
+    [name for name, cat in FOOD_CATEGORY_INDEX.items() if CATEGORY_ATTRIBUTES[cat]["perishable"]]
+    + ["西兰花", "菠菜", "生菜"]
+)
+
 COUNTRIES_DATA = {
     "中国": {"lat": 35.8617, "lon": 104.1954},
     "美国": {"lat": 38.9637, "lon": -95.7129},
@@ -91,6 +421,7 @@ BASE_TRANSPORT_FACTORS = {
     "land_truck": 75,
     "land_train": 30
 }
+TRANSPORT_FACTOR_RANGE = (0.8, 1.2)  # 运输因子相对 BASE_TRANSPORT_FACTORS 的浮动范围 (±20%)
 
 # --- 新增：营养素定义和生成范围 ---
 NUTRIENT_DEFINITIONS = {
@@ -124,60 +455,103 @@ NUTRIENT_DEFINITIONS = {
     }}
 }
 
-# --- 数据生成主函数 ---
-def generate_foods_with_routes_data():
-    generated_foods_data = []
-    country_names = list(COUNTRIES_DATA.keys())
+# --- 规模模式：合成食物变体与国家节点 ---
+def base_food_name(food_name):
+    """合成变体 "苹果#12" 的基础食物名为 "苹果"；普通食物名原样返回"""
+    return food_name.partition(SYNTHETIC_FOOD_SEPARATOR)[0]
 
-    # 使用分类的食物名称
-    current_food_selection = random.sample(ALL_FOOD_NAMES, min(NUM_FOODS_TO_GENERATE, len(ALL_FOOD_NAMES)))
+def iter_synthetic_food_names(num_foods):
+    """按 ALL_FOOD_NAMES 轮转生成任意数量的食物名，超出部分为带编号的变体"""
+    num_base = len(ALL_FOOD_NAMES)
+    for i in range(num_foods):
+        variant, base_idx = divmod(i, num_base)
+        base_name = ALL_FOOD_NAMES[base_idx]
+        yield base_name if variant == 0 else f"{base_name}{SYNTHETIC_FOOD_SEPARATOR}{variant}"
+
+def make_synthetic_countries(num_countries):
+    """返回包含 num_countries 个节点的国家表：先取 COUNTRIES_DATA，不足部分在球面上均匀合成
 
-    # 为 transport_factors.json 生成随机但一致的因子
-    transport_factors_for_json = {
-        mode: round(random.uniform(BASE_TRANSPORT_FACTORS[mode]*0.8, BASE_TRANSPORT_FACTORS[mode]*1.2), 2)
+    合成节点使用斐波那契球面格点，坐标只取决于节点数量，保证同样的配置得到同样的国家表。
+    """
+    countries = dict(list(COUNTRIES_DATA.items())[:num_countries])
+    num_synthetic = num_countries - len(countries)
+    golden_angle = math.pi * (3 - math.sqrt(5))
+    for i in range(num_synthetic):
+        z = 1 - 2 * (i + 0.5) / num_synthetic
+        lat = math.degrees(math.asin(z))
+        lon = (math.degrees(i * golden_angle) + 180) % 360 - 180
+        countries[f"合成国家_{i + 1:05d}"] = {"lat": round(lat, 4), "lon": round(lon, 4)}
+    return countries
+
+# --- 数据生成主函数 ---
+def generate_transport_factors(rng=random):
+    """为 transport_factors.json 生成随机但一致的因子"""
+    return {
+        mode: round(rng.uniform(BASE_TRANSPORT_FACTORS[mode]*TRANSPORT_FACTOR_RANGE[0],
+                                BASE_TRANSPORT_FACTORS[mode]*TRANSPORT_FACTOR_RANGE[1]), 2)
         for mode in TRANSPORT_MODES
     }
 
-    for food_name in current_food_selection:
-        production_co2 = 0
-        if any(food_name in category_list for category_list in [FOOD_CATEGORIES["protein_meat"], FOOD_CATEGORIES["dairy"]]):
-            production_co2 = round(random.uniform(2.0, 20.0), 2) # 肉类和乳制品生产碳排放较高
-        elif any(food_name in category_list for category_list in [FOOD_CATEGORIES["protein_plant"], FOOD_CATEGORIES["grain"]]):
-            production_co2 = round(random.uniform(0.5, 3.0), 2)
-        else: # 水果蔬菜等
-            production_co2 = round(random.uniform(0.1, 1.5), 2)
+def iter_foods_with_routes(food_names, countries_data=None,
+                           origins_range=(NUM_ORIGINS_PER_FOOD_MIN, NUM_ORIGINS_PER_FOOD_MAX),
+                           destinations_range=(NUM_DESTINATIONS_PER_ORIGIN_MIN, NUM_DESTINATIONS_PER_ORIGIN_MAX),
+                           rng=random):
+    """逐个生成带运输路线的食物条目，不保留已生成的结果"""
+    for food_item, _, _ in _iter_food_routes(food_names, countries_data, origins_range, destinations_range, rng=rng):
+        yield food_item
+
+def _iter_food_routes(food_names, countries_data, origins_range, destinations_range, transport_factors=None,
+                      rng=random):
+    """生成 (食物条目, 分类, 各路线运输碳排放之和)
+
+    传入 transport_factors 时在生成每条路线的同时累加其运输碳排放 (kg CO2eq / kg 食物)，
+    供融合流水线直接得出平均运输碳排放，无需再遍历一次路线。
+    """
+    if countries_data is None:
+        countries_data = COUNTRIES_DATA
+    country_names = list(countries_data.keys())
+    num_countries = len(country_names)
+    distance_table = get_distance_table(countries_data)
+    country_index = distance_table.country_index
+
+    for food_name in food_names:
+        base_name = base_food_name(food_name)
+        food_cat_assigned = FOOD_CATEGORY_INDEX.get(base_name, "other")
+        is_perishable = base_name in PERISHABLE_FOODS
+        # 肉类和乳制品生产碳排放较高，水果蔬菜等较低
+        production_co2 = round(rng.uniform(*CATEGORY_ATTRIBUTES[food_cat_assigned]["production_co2_range"]), 2)
 
         food_item = {
             "name": food_name,
             "production_co2_per_kg": production_co2,
             "routes": []
         }
+        transport_co2_total = 0
 
-        num_origins_for_this_food = random.randint(NUM_ORIGINS_PER_FOOD_MIN, NUM_ORIGINS_PER_FOOD_MAX)
-        possible_origins = random.sample(country_names, min(num_origins_for_this_food * 3, len(country_names))) # 多选一些以备用
-        actual_origins = random.sample(possible_origins, min(num_origins_for_this_food, len(possible_origins)))
+        num_origins_for_this_food = rng.randint(*origins_range)
+        possible_origins = rng.sample(country_names, min(num_origins_for_this_food * 3, num_countries)) # 多选一些以备用
+        actual_origins = rng.sample(possible_origins, min(num_origins_for_this_food, len(possible_origins)))
 
         for origin_country_name in actual_origins:
-            origin_coords = COUNTRIES_DATA[origin_country_name]
+            origin_coords = countries_data[origin_country_name]
+            origin_idx = country_index[origin_country_name]
 
-            possible_destinations = [c for c in country_names if c != origin_country_name]
-            if not possible_destinations:
+            if num_countries < 2:
                 continue
 
-            num_dests_for_this_origin = random.randint(NUM_DESTINATIONS_PER_ORIGIN_MIN, NUM_DESTINATIONS_PER_ORIGIN_MAX)
-            actual_destinations = random.sample(possible_destinations, min(num_dests_for_this_origin, len(possible_destinations)))
+            # 按下标在“除产地外的国家”中抽样，避免每个产地都复制一遍国家列表
+            num_dests_for_this_origin = rng.randint(*destinations_range)
+            dest_indices = rng.sample(range(num_countries - 1), min(num_dests_for_this_origin, num_countries - 1))
+            dest_indices = [dest_idx + 1 if dest_idx >= origin_idx else dest_idx for dest_idx in dest_indices]
 
-            for dest_country_name in actual_destinations:
-                dest_coords = COUNTRIES_DATA[dest_country_name]
-                distance = haversine(origin_coords["lat"], origin_coords["lon"], dest_coords["lat"], dest_coords["lon"])
-                transport_mode = random.choice(TRANSPORT_MODES)
+            for dest_idx, distance in zip(dest_indices, distance_table.row(origin_idx, dest_indices)):
+                dest_country_name = country_names[dest_idx]
+                dest_coords = countries_data[dest_country_name]
+                transport_mode = rng.choice(TRANSPORT_MODES)
 
                 # 运输易腐食品（水果、部分蔬菜、乳制品、肉类）时，空运概率稍高
-                if food_name in FOOD_CATEGORIES["fruit"] or \
-                   food_name in ["西兰花", "菠菜", "生菜"] or \
-                   food_name in FOOD_CATEGORIES["dairy"] or \
-                   food_name in FOOD_CATEGORIES["protein_meat"]:
-                    if random.random() < 0.15: # 15% 概率空运
+                if is_perishable:
+                    if rng.random() < 0.15: # 15% 概率空运
                         transport_mode = "air"
 
                 route = {
@@ -191,22 +565,98 @@ def generate_foods_with_routes_data():
                     "transport_mode": transport_mode
                 }
                 food_item["routes"].append(route)
+                if transport_factors is not None:
+                    factor = transport_factors.get(transport_mode, BASE_TRANSPORT_FACTORS[transport_mode])
+                    transport_co2_total += (distance * factor) / 1000000 # kg CO2eq per kg food
 
         if food_item["routes"]:
-            generated_foods_data.append(food_item)
+            yield food_item, food_cat_assigned, transport_co2_total
+
+def iter_fused_food_records(food_names, transport_factors, countries_data=None,
+                            origins_range=(NUM_ORIGINS_PER_FOOD_MIN, NUM_ORIGINS_PER_FOOD_MAX),
+                            destinations_range=(NUM_DESTINATIONS_PER_ORIGIN_MIN, NUM_DESTINATIONS_PER_ORIGIN_MAX),
+                            rng=random):
+    """融合流水线：生成每个食物路线的同时得出其营养和碳足迹条目，逐个产出 (路线条目, 营养条目)
+
+    与先生成全部路线、再由 iter_food_nutrients_and_carbon() 遍历一次相比，
+    只遍历一遍目录，分类也只查询一次，且不保留中间列表。
+    """
+    food_routes = _iter_food_routes(food_names, countries_data, origins_range, destinations_range,
+                                    transport_factors, rng)
+    for food_item, food_cat_assigned, transport_co2_total in food_routes:
+        avg_transport_co2 = round(transport_co2_total / len(food_item["routes"]), 3)
+        nutrient_record = build_food_nutrient_record(
+            food_item["name"], food_cat_assigned, food_item["production_co2_per_kg"], avg_transport_co2, rng)
+        yield food_item, nutrient_record
+
+@instrumented(items=lambda result: len(result[0]))
+def generate_foods_with_routes_data(rng=random):
+    """返回 (foods_with_routes 条目列表, 运输因子)"""
+    # 使用分类的食物名称
+    current_food_selection = rng.sample(ALL_FOOD_NAMES, min(NUM_FOODS_TO_GENERATE, len(ALL_FOOD_NAMES)))
+
+    transport_factors_for_json = generate_transport_factors(rng)
+    generated_foods_data = list(iter_foods_with_routes(current_food_selection, rng=rng))
 
     return generated_foods_data, transport_factors_for_json
 
+def generate_route_table(rng=random):
+    """与 generate_foods_with_routes_data 相同的生成过程，但返回 (RouteTable, 运输因子)
+
+    路线按列存放在定长数组中，遍历 RouteTable 得到与列表版本相同的食物条目。
+    """
+    current_food_selection = rng.sample(ALL_FOOD_NAMES, min(NUM_FOODS_TO_GENERATE, len(ALL_FOOD_NAMES)))
+    transport_factors = generate_transport_factors(rng)
+    route_table = RouteTable()
+    for food_item in iter_foods_with_routes(current_food_selection, rng=rng):
+        route_table.add(food_item)
+    return route_table, transport_factors
+
 # --- 新增：生成食物营养和碳足迹数据 (food_nutrients_and_carbon.json) ---
-def generate_food_nutrients_and_carbon_data(foods_with_routes, transport_factors):
-    food_nutrients_data = []
+def get_food_category(food_name):
+    """返回食物（或其合成变体）所属的分类，未知食物归为 "other\""""
+    return FOOD_CATEGORY_INDEX.get(base_food_name(food_name), "other") # 默认分类
+
+def build_food_nutrient_record(food_name, food_cat_assigned, production_co2, avg_transport_co2, rng=random):
+    """根据已知的分类、生产和平均运输碳排放，生成一条营养和碳足迹条目"""
+    total_co2 = round(production_co2 + avg_transport_co2, 3)
+
+    # 生成营养素
+    nutrients = {}
+    for nutrient, details in NUTRIENT_DEFINITIONS.items():
+        val_range = details["range_by_category"].get(food_cat_assigned, (0,1)) # 获取该食物分类的营养素范围
+        if nutrient == "energy_kcal":
+             nutrients[nutrient] = rng.randint(int(val_range[0]), int(val_range[1]))
+        elif nutrient in ["protein_g", "fat_g", "carbohydrate_g", "fiber_g"]:
+             nutrients[nutrient] = round(rng.uniform(val_range[0], val_range[1]), 1)
+        else: # mg 单位的
+             nutrients[nutrient] = round(rng.uniform(val_range[0], val_range[1]), 2)
 
+    # 消费环节浪费百分比 (为后续功能三准备)
+    waste_percentage = round(rng.uniform(*CATEGORY_ATTRIBUTES[food_cat_assigned]["waste_range"]), 2)
+
+    return {
+        "name": food_name,
+        "category": food_cat_assigned,
+        "production_co2_per_kg": production_co2,
+        "average_transport_co2_per_kg": avg_transport_co2,
+        "total_co2_per_kg": total_co2,
+        "nutrients_per_100g": nutrients,
+        "average_consumer_waste_percentage": waste_percentage
+    }
+
+def _fallback_transport_co2(food_cat_assigned, rng=random):
+    """没有路线数据时，给一个基于类型的随机运输碳排放（易腐或高价值食品较高）"""
+    return round(rng.uniform(*CATEGORY_ATTRIBUTES[food_cat_assigned]["fallback_transport_co2_range"]), 3)
+
+def iter_food_nutrients_and_carbon(foods_with_routes, transport_factors, rng=random):
+    """逐个生成食物的营养和碳足迹条目，foods_with_routes 可以是任意可迭代对象"""
     for food_from_routes in foods_with_routes:
         food_name = food_from_routes["name"]
+        food_cat_assigned = get_food_category(food_name)
         production_co2 = food_from_routes["production_co2_per_kg"]
 
         # 估算平均运输碳足迹
-        avg_transport_co2 = 0
         if food_from_routes["routes"]:
             total_transport_co2_for_routes = 0
             for route in food_from_routes["routes"]:
@@ -215,83 +665,1729 @@ def generate_food_nutrients_and_carbon_data(foods_with_routes, transport_factors
                 factor = transport_factors.get(mode, BASE_TRANSPORT_FACTORS[mode]) # 获取一致的因子
                 total_transport_co2_for_routes += (distance * factor) / 1000000 # kg CO2eq per kg food
             avg_transport_co2 = round(total_transport_co2_for_routes / len(food_from_routes["routes"]), 3)
-        else: # 如果没有路线数据，给一个基于类型的随机值
-            if any(food_name in category_list for category_list in [FOOD_CATEGORIES["protein_meat"], FOOD_CATEGORIES["dairy"], FOOD_CATEGORIES["fruit"]]):
-                 avg_transport_co2 = round(random.uniform(0.2, 1.5), 3) # 易腐或高价值，运输碳排放可能较高
-            else:
-                 avg_transport_co2 = round(random.uniform(0.05, 0.5), 3)
-
-        total_co2 = round(production_co2 + avg_transport_co2, 3)
-
-        # 生成营养素
-        nutrients = {}
-        food_cat_assigned = "other" # 默认分类
-        for cat, names in FOOD_CATEGORIES.items():
-            if food_name in names:
-                food_cat_assigned = cat
-                break
-
-        for nutrient, details in NUTRIENT_DEFINITIONS.items():
-            val_range = details["range_by_category"].get(food_cat_assigned, (0,1)) # 获取该食物分类的营养素范围
-            if nutrient == "energy_kcal":
-                 nutrients[nutrient] = random.randint(int(val_range[0]), int(val_range[1]))
-            elif nutrient in ["protein_g", "fat_g", "carbohydrate_g", "fiber_g"]:
-                 nutrients[nutrient] = round(random.uniform(val_range[0], val_range[1]), 1)
-            else: # mg 单位的
-                 nutrients[nutrient] = round(random.uniform(val_range[0], val_range[1]), 2)
-
-        # 消费环节浪费百分比 (为后续功能三准备)
-        waste_percentage = 0.0
-        if food_cat_assigned in ["fruit", "vegetable", "dairy"]:
-            waste_percentage = round(random.uniform(0.15, 0.40), 2) # 15-40% 浪费
-        elif food_cat_assigned in ["protein_meat"]:
-            waste_percentage = round(random.uniform(0.10, 0.25), 2) # 10-25%
         else:
-            waste_percentage = round(random.uniform(0.05, 0.15), 2) # 5-15%
+            avg_transport_co2 = _fallback_transport_co2(food_cat_assigned, rng)
 
-        food_nutrients_data.append({
-            "name": food_name,
-            "category": food_cat_assigned,
-            "production_co2_per_kg": production_co2,
-            "average_transport_co2_per_kg": avg_transport_co2,
-            "total_co2_per_kg": total_co2,
-            "nutrients_per_100g": nutrients,
-            "average_consumer_waste_percentage": waste_percentage
+        yield build_food_nutrient_record(food_name, food_cat_assigned, production_co2, avg_transport_co2, rng)
+
+@instrumented(items=len)
+def generate_food_nutrients_and_carbon_data(foods_with_routes, transport_factors, rng=random):
+    return list(iter_food_nutrients_and_carbon(foods_with_routes, transport_factors, rng))
+
+# --- 原子写入：先写同目录下的临时文件，成功后再整体替换，读者永远看不到写了一半的文件 ---
+_WRITTEN_FILES = []  # 本进程中通过 AtomicFile 写出的文件，供增量构建记录每个阶段的输出
+
+def _default_file_mode():
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+class AtomicFile:
+    """以临时文件的形式打开 file_path；commit() 时 os.replace 到目标路径，discard() 时删除临时文件
+
+    作为上下文管理器使用时，正常退出自动 commit，出现异常则 discard。
+    track=False 的文件（如多个阶段共享的 manifest.json）不计入增量构建的阶段输出。
+    """
+
+    def __init__(self, file_path, mode='w', track=True):
+        self.file_path = file_path
+        self.track = track
+        directory = os.path.dirname(os.path.abspath(file_path))
+        fd, self._tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(file_path)}.", suffix=".tmp")
+        # mkstemp 创建的文件权限为 0600，改成与普通 open() 相同的权限，方便静态服务器读取
+        os.chmod(self._tmp_path, _default_file_mode())
+        self.file = os.fdopen(fd, mode, encoding=None if 'b' in mode else 'utf-8')
+        self._opened_at = time.perf_counter()
+
+    def __enter__(self):
+        return self.file
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+    def commit(self):
+        self.file.close()
+        os.replace(self._tmp_path, self.file_path)
+        if self.track:
+            _WRITTEN_FILES.append(os.path.abspath(self.file_path))
+            if _RUN_METRICS is not None:
+                _RUN_METRICS.file_written(self.file_path, time.perf_counter() - self._opened_at)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self._tmp_path):
+            os.unlink(self._tmp_path)
+
+# --- 流式 JSON 输出：逐条写出条目，内存占用与数据集大小无关 ---
+OUTPUT_FORMATS = ("json", "ndjson")
+
+def output_file_name(stem, output_format="json"):
+    """按输出格式返回文件名，如 foods_with_routes.json / foods_with_routes.ndjson"""
+    return f"{stem}.{output_format}"
+
+class JsonStreamWriter:
+    """把条目逐个写成 JSON 数组或 NDJSON（每行一个 JSON 对象）
+
+    非紧凑的 JSON 数组输出与 json.dump(items, indent=indent) 的结果逐字节一致；
+    compact=True 时使用无空白的分隔符。NDJSON 总是每行一个紧凑对象。
+    bytes_written 记录已写出的字节数；write() 返回条目 JSON 文本在文件中的 (字节偏移, 字节长度)，
+    可用于给条目建立偏移索引，按 HTTP Range 只读取其中一条。
+    """
+
+    def __init__(self, file_path, output_format="json", compact=False, indent=4):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
+        self.file_path = file_path
+        self.output_format = output_format
+        self.indent = None if compact or output_format == "ndjson" else indent
+        self.separators = (",", ":") if self.indent is None else None
+        self.count = 0
+        self.bytes_written = 0
+        self._sha256 = hashlib.sha256()
+        self._atomic = AtomicFile(file_path, 'wb')
+        self._file = self._atomic.file
+        if output_format == "json":
+            self._write("[")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    @property
+    def current_file(self):
+        """当前条目所在的文件名（相对输出目录）"""
+        return os.path.basename(self.file_path)
+
+    def _write(self, text):
+        data = text.encode('utf-8')
+        self._file.write(data)
+        self._sha256.update(data)
+        self.bytes_written += len(data)
+
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    def write(self, item):
+        text = json.dumps(item, ensure_ascii=False, indent=self.indent, separators=self.separators)
+        if self.output_format == "ndjson":
+            prefix, suffix = "", "\n"
+        elif self.indent is not None:
+            # 数组内的条目整体再缩进一级，与 json.dump 的嵌套缩进保持一致
+            pad = " " * self.indent
+            text = pad + text.replace("\n", "\n" + pad)
+            prefix, suffix = ("\n" if self.count == 0 else ",\n"), ""
+        else:
+            prefix, suffix = ("" if self.count == 0 else ","), ""
+        self._write(prefix)
+        offset = self.bytes_written
+        self._write(text)
+        length = self.bytes_written - offset
+        self._write(suffix)
+        self.count += 1
+        return offset, length
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self.output_format == "json":
+            self._write("\n]" if self.count and self.indent is not None else "]")
+        self._atomic.commit()
+
+    def discard(self):
+        if not self._file.closed:
+            self._atomic.discard()
+
+def write_json_stream(file_path, items, output_format="json", compact=False, indent=4):
+    """把可迭代对象 items 流式写入 file_path，返回写出的条目数"""
+    with JsonStreamWriter(file_path, output_format, compact, indent) as writer:
+        for item in items:
+            writer.write(item)
+    return writer.count
+
+# --- 分片输出：把数据集切成固定大小的分片文件，并在 manifest.json 中记录数量、校验和与键范围 ---
+class ShardedDatasetWriter:
+    """与 JsonStreamWriter 接口相同，但每 shard_size 个条目换一个分片文件
+
+    分片写在 <output_dir>/shards/<dataset>/<dataset>-00000.json 等文件中；
+    每个分片记录条目数、字节数、sha256 以及分片内 key_field 取值的最小值和最大值（键范围）；
+    条目不按键排序，客户端按键查找时需要检查所有键范围包含该键的分片。
+    full_file=True 时同时写出完整的单文件 <dataset>.json / .ndjson（与不分片时相同），供仍按单文件读取的页面使用。
+    """
+
+    def __init__(self, dataset, output_dir, shard_size, key_field, output_format="json", compact=False,
+                 full_file=False):
+        if shard_size < 1:
+            raise ValueError(f"shard_size must be positive, got {shard_size}")
+        self.dataset = dataset
+        self.shard_size = shard_size
+        self.key_field = key_field
+        self.output_format = output_format
+        self.compact = compact
+        self.file_path = os.path.join(output_dir, SHARDS_DIR_NAME, dataset)
+        self.count = 0
+        self.shards = []
+        self._writer = None
+        self._shard_name = None
+        self._key_range = None
+        self._full_writer = None
+        # 清掉上一次生成留下的分片，避免分片数量变少时残留旧文件
+        shutil.rmtree(self.file_path, ignore_errors=True)
+        os.makedirs(self.file_path)
+        if full_file:
+            self._full_writer = JsonStreamWriter(os.path.join(output_dir, output_file_name(dataset, output_format)),
+                                                 output_format, compact)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        for writer in (self._writer, self._full_writer):
+            if writer is not None:
+                writer.discard()
+
+    @property
+    def current_file(self):
+        return self._shard_name
+
+    def write(self, item):
+        if self._writer is None or self._writer.count >= self.shard_size:
+            self._finish_shard()
+            file_name = output_file_name(f"{self.dataset}-{len(self.shards):05d}", self.output_format)
+            self._shard_name = f"{SHARDS_DIR_NAME}/{self.dataset}/{file_name}"
+            self._writer = JsonStreamWriter(os.path.join(self.file_path, file_name), self.output_format, self.compact)
+            self._key_range = None
+        key = item.get(self.key_field)
+        if key is not None:
+            if self._key_range is None:
+                self._key_range = [key, key]
+            else:
+                self._key_range = [min(self._key_range[0], key), max(self._key_range[1], key)]
+        if self._full_writer is not None:
+            self._full_writer.write(item)
+        self.count += 1
+        return self._writer.write(item)
+
+    def _finish_shard(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self.shards.append({
+            "file": self._shard_name,
+            "count": self._writer.count,
+            "key_range": self._key_range,
+            "bytes": self._writer.bytes_written,
+            "sha256": self._writer.sha256()
         })
+        self._writer = None
 
-    return food_nutrients_data
+    def close(self):
+        self._finish_shard()
+        if self._full_writer is not None:
+            self._full_writer.close()
+
+    def manifest_entry(self):
+        return {
+            "key": self.key_field,
+            "count": self.count,
+            "shard_size": self.shard_size,
+            "format": self.output_format,
+            "shards": self.shards
+        }
+
+def open_dataset_writer(dataset, output_dir, output_format="json", compact=False, shard_size=None, key_field="name"):
+    """shard_size 为 None 时写单个文件，否则按固定大小分片写出（同时照常写出单文件）"""
+    if shard_size:
+        return ShardedDatasetWriter(dataset, output_dir, shard_size, key_field, output_format, compact,
+                                    full_file=True)
+    return JsonStreamWriter(os.path.join(output_dir, output_file_name(dataset, output_format)), output_format, compact)
+
+def update_manifest(output_dir, datasets, meta=None, unsharded=()):
+    """把分片数据集的清单合并进 manifest.json（食物数据和增强版数据分别生成，共用一份清单）
+
+    unsharded 为本次以单文件写出的数据集或增强版数据名：删除它们（及 <名称>.<部分>）上次留下的分片条目和 meta。
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        if not datasets:
+            return
+        manifest = {"datasets": {}, "meta": {}}
+    else:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    stale = [name for name in manifest["datasets"]
+             if any(name == prefix or name.startswith(prefix + ".") for prefix in unsharded)]
+    stale_meta = [name for name in manifest["meta"] if name in unsharded]
+    if not (datasets or meta or stale or stale_meta):
+        return
+    for name in stale:
+        del manifest["datasets"][name]
+        shutil.rmtree(os.path.join(output_dir, SHARDS_DIR_NAME, name), ignore_errors=True)
+    for name in stale_meta:
+        del manifest["meta"][name]
+    manifest["generated_at"] = datetime.now().isoformat(timespec="seconds")
+    manifest["datasets"].update(datasets)
+    manifest["meta"].update(meta or {})
+    if not manifest["datasets"] and not manifest["meta"]:
+        # 所有数据集都改为单文件写出，清单已经没有内容
+        os.remove(manifest_path)
+        shutil.rmtree(os.path.join(output_dir, SHARDS_DIR_NAME), ignore_errors=True)
+        print(f"Removed {manifest_path}")
+        return
+    with AtomicFile(manifest_path, track=False) as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"Updated {manifest_path}")
+
+# --- 分片并行生成：固定大小分片 + 由主种子派生的分片随机数，结果与进程数无关 ---
+def derive_seed(master_seed, *keys):
+    """由主种子和分片标识 (数据流名称、分片序号等) 派生出稳定的 64 位子种子"""
+    text = ":".join(str(part) for part in (master_seed,) + keys)
+    return int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], "little")
+
+def shard_rng(master_seed, stream, shard_index=0):
+    """返回某个数据流、某个分片专用的随机数生成器
+
+    master_seed 为 None 时返回全局 random 模块，保持未指定种子时原有的（不可复现的）行为。
+    """
+    if master_seed is None:
+        return random
+    return random.Random(derive_seed(master_seed, stream, shard_index))
+
+def resolve_master_seed(seed, workers):
+    """多进程生成必须有主种子：否则各个 fork 出来的子进程会继承同一份全局随机状态"""
+    if seed is None and workers > 1:
+        seed = random.randrange(2**32)
+        print(f"No seed given for parallel generation, using master seed {seed}")
+    return seed
+
+def iter_parallel_shards(worker_fn, shard_tasks, workers=1, initializer=None, initargs=()):
+    """按分片顺序产出 worker_fn(task) 的结果
+
+    workers > 1 时在进程池中执行，同时最多保留 workers * 2 个在途分片，内存占用有上限；
+    workers <= 1 时在当前进程中依次执行。两种方式的输出完全相同。
+    """
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in shard_tasks:
+            yield worker_fn(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        pending = deque()
+        for task in shard_tasks:
+            pending.append(executor.submit(worker_fn, task))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+_SHARD_COUNTRIES_DATA = None
+
+def _init_food_shard_worker(countries_data):
+    global _SHARD_COUNTRIES_DATA
+    _SHARD_COUNTRIES_DATA = countries_data
+
+def _generate_food_shard(task):
+    shard_index, food_names, transport_factors, origins_range, destinations_range, seed = task
+    rng = shard_rng(seed, "foods", shard_index)
+    return list(iter_fused_food_records(food_names, transport_factors, _SHARD_COUNTRIES_DATA,
+                                        origins_range, destinations_range, rng))
+
+def iter_sharded_food_records(food_names, transport_factors, countries_data=None,
+                              origins_range=(NUM_ORIGINS_PER_FOOD_MIN, NUM_ORIGINS_PER_FOOD_MAX),
+                              destinations_range=(NUM_DESTINATIONS_PER_ORIGIN_MIN, NUM_DESTINATIONS_PER_ORIGIN_MAX),
+                              seed=None, workers=1, shard_size=GENERATION_SHARD_SIZE):
+    """把食物目录切成固定大小的分片并行生成，按原顺序逐个产出 (路线条目, 营养条目)"""
+    if countries_data is None:
+        countries_data = COUNTRIES_DATA
+    food_names = iter(food_names)
+
+    def shard_tasks():
+        for shard_index in itertools.count():
+            shard_names = list(itertools.islice(food_names, shard_size))
+            if not shard_names:
+                return
+            yield (shard_index, shard_names, transport_factors, origins_range, destinations_range, seed)
+
+    shards = iter_parallel_shards(_generate_food_shard, shard_tasks(), workers,
+                                  _init_food_shard_worker, (countries_data,))
+    for shard_records in shards:
+        yield from shard_records
+
+# --- 路线排放预聚合：生成时一次算好，页面无需遍历全部路线 ---
+def _new_emission_bucket():
+    return {"routes": 0, "distance_km": 0.0, "transport_co2_per_kg": 0.0}
+
+def _round_emission_bucket(bucket):
+    return {
+        "routes": bucket["routes"],
+        "distance_km": round(bucket["distance_km"], 2),
+        "transport_co2_per_kg": round(bucket["transport_co2_per_kg"], 3)
+    }
+
+def _compact_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+class RouteAggregator:
+    """在写出食物路线的同时累计排放汇总，并记录每个食物条目在输出文件中的位置
+
+    单条路线的运输排放与 web/js/main.js 相同：distance_km × 因子 / 1e6 (kg CO2eq / kg 食物)。
+    内存中只保留按运输方式、产地国和目的地国的累计值；每个食物的汇总和偏移索引条目产生后立即
+    追加到 output_dir 下临时目录中的 ColumnSpool，由 write_route_aggregates 拼接成最终文件。
+    """
+
+    def __init__(self, transport_factors, output_dir):
+        self.transport_factors = transport_factors
+        self.num_foods = 0
+        self.num_routes = 0
+        self.by_mode = {mode: _new_emission_bucket() for mode in TRANSPORT_MODES}
+        self.by_origin = {}
+        self.by_destination = {}
+        # 偏移索引引用的文件（单文件或各分片），数量只与分片数有关
+        self.files = []
+        self.file_ids = {}
+        self._spool_dir = tempfile.mkdtemp(prefix=".route_aggregates.", dir=output_dir)
+        self.by_food = ColumnSpool(self._spool_dir, "by_food", fmt=_compact_json)
+        self.index_foods = ColumnSpool(self._spool_dir, "index_foods", fmt=_compact_json)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.discard()
+        return False
+
+    def discard(self):
+        self.by_food.close()
+        self.index_foods.close()
+        shutil.rmtree(self._spool_dir, ignore_errors=True)
+
+    def add(self, food_item, offset=None, length=None, file_name=None):
+        food_bucket = _new_emission_bucket()
+        food_by_mode = {}
+        for route in food_item["routes"]:
+            mode = route["transport_mode"]
+            distance = route["distance_km"]
+            factor = self.transport_factors.get(mode, BASE_TRANSPORT_FACTORS[mode])
+            co2 = (distance * factor) / 1000000
+            buckets = (
+                food_bucket,
+                self.by_mode[mode],
+                self.by_origin.setdefault(route["origin_country"], _new_emission_bucket()),
+                self.by_destination.setdefault(route["destination_country"], _new_emission_bucket()),
+            )
+            for bucket in buckets:
+                bucket["routes"] += 1
+                bucket["distance_km"] += distance
+                bucket["transport_co2_per_kg"] += co2
+            food_by_mode[mode] = food_by_mode.get(mode, 0.0) + co2
+        self.num_routes += food_bucket["routes"]
+
+        food_summary = _round_emission_bucket(food_bucket)
+        food_summary["name"] = food_item["name"]
+        food_summary["production_co2_per_kg"] = food_item["production_co2_per_kg"]
+        food_summary["average_transport_co2_per_kg"] = (
+            round(food_bucket["transport_co2_per_kg"] / food_bucket["routes"], 3) if food_bucket["routes"] else 0.0)
+        food_summary["transport_co2_by_mode"] = {mode: round(co2, 3) for mode, co2 in food_by_mode.items()}
+        # 全部路线都改用某种运输方式时的运输排放，对应页面上的“模拟模式”
+        food_summary["simulated_transport_co2_per_kg"] = {
+            mode: round(food_bucket["distance_km"] * factor / 1000000, 3)
+            for mode, factor in self.transport_factors.items()
+        }
+        self.by_food.extend([food_summary])
+        if offset is not None:
+            file_id = self.file_ids.get(file_name)
+            if file_id is None:
+                file_id = self.file_ids[file_name] = len(self.files)
+                self.files.append(file_name)
+            self.index_foods.extend([{"name": food_item["name"], "routes": food_bucket["routes"], "file": file_id,
+                                      "offset": offset, "length": length}])
+        self.num_foods += 1
+
+    def aggregates(self):
+        """route_aggregates.json 中除 by_food 以外的部分（by_food 由 write_route_aggregates 从磁盘拼接）"""
+        return {
+            "transport_factors": self.transport_factors,
+            "totals": {
+                "foods": self.num_foods,
+                "routes": self.num_routes,
+                "transport_co2_per_kg": round(sum(b["transport_co2_per_kg"] for b in self.by_mode.values()), 3)
+            },
+            "by_mode": {mode: _round_emission_bucket(b) for mode, b in self.by_mode.items()},
+            "by_origin_country": {c: _round_emission_bucket(b) for c, b in self.by_origin.items()},
+            "by_destination_country": {c: _round_emission_bucket(b) for c, b in self.by_destination.items()}
+        }
+
+    def index(self, output_format):
+        """食物 -> 路线条目所在文件（或分片）以及其中的字节偏移和长度；file 为 files 列表中的下标
+
+        不含 foods 列表（由 write_route_aggregates 从磁盘拼接）。
+        """
+        return {"format": output_format, "files": self.files}
+
+def _write_json_with_spooled_array(file_path, head, key, spool):
+    """写出 head 对象，并在末尾追加键 key，其值为 spool 中逐条追加的 JSON 数组"""
+    text = _compact_json(head)
+    with AtomicFile(file_path) as f:
+        f.write(text[:-1])
+        f.write(f'{"," if head else ""}{_compact_json(key)}:[')
+        spool.copy_text(f)
+        f.write("]}")
+
+@instrumented()
+def write_route_aggregates(aggregator, output_dir, output_format="json"):
+    aggregator.by_food.close()
+    aggregator.index_foods.close()
+    aggregates_file_path = os.path.join(output_dir, "route_aggregates.json")
+    _write_json_with_spooled_array(aggregates_file_path, aggregator.aggregates(), "by_food", aggregator.by_food)
+    print(f"Generated {aggregates_file_path}")
+
+    index_file_path = os.path.join(output_dir, "foods_with_routes_index.json")
+    _write_json_with_spooled_array(index_file_path, aggregator.index(output_format), "foods", aggregator.index_foods)
+    print(f"Generated {index_file_path}")
+
+# --- 营养效率排名：每种营养素的单位营养碳排放、排序、分类汇总和分位点，前端筛选排序只需查表 ---
+NUTRIENT_RANKING_PERCENTILES = (5, 25, 50, 75, 95)
+NUTRIENT_RANKINGS_FILE_NAME = "nutrient_rankings.json"
+
+def _percentile(sorted_values, p):
+    """与 numpy.percentile 默认方式相同的线性插值分位数；sorted_values 须已升序排列"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * p / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+class NutrientRankings:
+    """在写出 food_nutrients_and_carbon 的同时收集各食物的总碳排放和营养素含量
+
+    效率与 web/js/nutrition_analyzer_enhanced.js 相同：total_co2_per_kg / (每 100g 含量 × 10)，
+    即每单位营养素（每公斤食物）对应的 kg CO2eq，越小越好；含量为 0 的食物不参与该营养素的排名。
+    """
+
+    def __init__(self):
+        self.names = []
+        self.category_ids = {}
+        self.food_category = []
+        self.total_co2 = []
+        self.nutrient_values = {nutrient: [] for nutrient in NUTRIENT_DEFINITIONS}
+
+    def add(self, nutrient_record):
+        self.names.append(nutrient_record["name"])
+        category = nutrient_record["category"]
+        self.food_category.append(self.category_ids.setdefault(category, len(self.category_ids)))
+        self.total_co2.append(nutrient_record["total_co2_per_kg"])
+        for nutrient, values in self.nutrient_values.items():
+            values.append(nutrient_record["nutrients_per_100g"].get(nutrient, 0))
+
+    def _nutrient_ranking(self, nutrient):
+        categories = list(self.category_ids)
+        co2_per_unit = [round(total / (value * 10), 6) if value > 0 else None
+                        for total, value in zip(self.total_co2, self.nutrient_values[nutrient])]
+        rank = sorted((i for i, value in enumerate(co2_per_unit) if value is not None),
+                      key=lambda i: (co2_per_unit[i], i))
+        sorted_values = [co2_per_unit[i] for i in rank]
+        # 每个食物在该营养素排名中的名次（从 0 开始），不参与排名的为 None
+        position = [None] * len(self.names)
+        for n, i in enumerate(rank):
+            position[i] = n
+
+        rank_by_category = {category: [] for category in categories}
+        for i in rank:
+            rank_by_category[categories[self.food_category[i]]].append(i)
+        by_category = {}
+        for category, food_ids in rank_by_category.items():
+            values = [co2_per_unit[i] for i in food_ids]
+            if values:
+                by_category[category] = {
+                    "foods": len(values),
+                    "mean_co2_per_unit": round(sum(values) / len(values), 6),
+                    "median_co2_per_unit": round(_percentile(values, 50), 6),
+                    "min_co2_per_unit": values[0],
+                    "max_co2_per_unit": values[-1],
+                    "best_food": food_ids[0]
+                }
+        return {
+            "unit": NUTRIENT_DEFINITIONS[nutrient]["unit"],
+            "co2_per_unit": co2_per_unit,
+            "rank": rank,
+            "rank_position": position,
+            "rank_by_category": rank_by_category,
+            # 按分类平均效率从高到低排列的分类，对应页面上的分类对比图
+            "category_order": sorted(by_category, key=lambda c: by_category[c]["mean_co2_per_unit"]),
+            "by_category": by_category,
+            "percentiles": {f"p{p}": round(_percentile(sorted_values, p), 6) if sorted_values else None
+                            for p in NUTRIENT_RANKING_PERCENTILES}
+        }
+
+    def rankings(self):
+        categories = list(self.category_ids)
+        totals_by_category = {category: [] for category in categories}
+        for category_id, total in zip(self.food_category, self.total_co2):
+            totals_by_category[categories[category_id]].append(total)
+        return {
+            "foods": self.names,
+            "categories": categories,
+            "food_category": self.food_category,
+            "total_co2_per_kg": self.total_co2,
+            "total_co2_rank": sorted(range(len(self.names)), key=lambda i: (self.total_co2[i], i)),
+            "by_category": {category: {"foods": len(totals),
+                                       "mean_total_co2_per_kg": round(sum(totals) / len(totals), 3)}
+                            for category, totals in totals_by_category.items()},
+            "nutrients": {nutrient: self._nutrient_ranking(nutrient) for nutrient in NUTRIENT_DEFINITIONS}
+        }
+
+def remove_stale_outputs(output_dir, file_names):
+    """删除上次运行留下、本次运行不再生成的输出文件，避免与本次的输出混在一起"""
+    for file_name in file_names:
+        file_path = os.path.join(output_dir, file_name)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            print(f"Removed stale {file_path}")
+
+@instrumented(items=lambda result: result)
+def write_nutrient_rankings(rankings, output_dir):
+    file_path = os.path.join(output_dir, NUTRIENT_RANKINGS_FILE_NAME)
+    with AtomicFile(file_path) as f:
+        json.dump(rankings.rankings(), f, ensure_ascii=False, separators=(",", ":"))
+    print(f"Generated {file_path} for {len(rankings.names)} foods × {len(NUTRIENT_DEFINITIONS)} nutrients")
+    return len(rankings.names)
+
+# --- 饮食情景与浪费影响查询表：与 web/js/diet_simulator.js 相同的饮食结构，按消费倍数 × 浪费率预先算好 ---
+# 数据中的食物 -> 饮食结构中的大类；键与 diet_simulator.js 的 CATEGORY_MAPPING 相同，
+# 并补上本数据集中其余食物名（JS 中的映射按食物名查询，数据分类为 fruit 等英文键时会全部落到“其他”）
+CATEGORY_MAPPING = {
+    '牛肉': '红肉', '猪肉': '红肉', '羊肉': '红肉', '禽肉': '禽肉', '鱼类': '鱼类及海鲜', '海鲜': '鱼类及海鲜',
+    '乳制品': '乳制品', '奶酪': '乳制品', '鸡蛋': '蛋类',
+    '豆类': '豆类及坚果', '坚果': '豆类及坚果', '豆腐': '豆类及坚果',
+    '谷物': '谷物', '米饭': '谷物', '面食': '谷物', '土豆': '淀粉类蔬菜',
+    '蔬菜': '蔬菜', '绿叶蔬菜': '蔬菜', '根茎蔬菜': '蔬菜', '水果': '水果', '浆果': '水果',
+    '糖和甜品': '其他', '植物油': '其他',
+    # 本数据集中的其余食物
+    '鸡肉': '禽肉', '鱼肉': '鱼类及海鲜', '牛奶': '乳制品', '酸奶': '乳制品',
+    '扁豆': '豆类及坚果', '鹰嘴豆': '豆类及坚果', '黑豆': '豆类及坚果',
+}
+# 不在 CATEGORY_MAPPING 中的食物按数据分类归入大类
+DATA_CATEGORY_DIET_CATEGORIES = {
+    "fruit": "水果", "vegetable": "蔬菜", "grain": "谷物", "protein_meat": "红肉",
+    "protein_plant": "豆类及坚果", "dairy": "乳制品", "other": "其他",
+}
+DIET_CATEGORIES = ['红肉', '禽肉', '鱼类及海鲜', '乳制品', '蛋类', '谷物', '豆类及坚果', '淀粉类蔬菜', '蔬菜', '水果', '其他']
+
+# 各饮食的年消费量 (kg/人/年)，与 diet_simulator.js 的 DIET_STRUCTURES 相同
+DIET_STRUCTURES = {
+    "high_meat": {"name": "高肉食饮食", "color": "rgba(211, 47, 47, 0.8)", "annual_consumption_kg": {
+        '红肉': 70, '禽肉': 30, '鱼类及海鲜': 15, '乳制品': 150, '蛋类': 12, '谷物': 100,
+        '豆类及坚果': 10, '淀粉类蔬菜': 50, '蔬菜': 100, '水果': 80, '其他': 20}},
+    "balanced": {"name": "均衡饮食", "color": "rgba(76, 175, 80, 0.8)", "annual_consumption_kg": {
+        '红肉': 25, '禽肉': 25, '鱼类及海鲜': 25, '乳制品': 180, '蛋类': 13, '谷物': 120,
+        '豆类及坚果': 30, '淀粉类蔬菜': 60, '蔬菜': 150, '水果': 110, '其他': 15}},
+    "vegetarian": {"name": "素食饮食 (含蛋奶)", "color": "rgba(173, 223, 173, 0.8)", "annual_consumption_kg": {
+        '红肉': 0, '禽肉': 0, '鱼类及海鲜': 0, '乳制品': 200, '蛋类': 15, '谷物': 130,
+        '豆类及坚果': 50, '淀粉类蔬菜': 70, '蔬菜': 200, '水果': 150, '其他': 10}},
+    "vegan": {"name": "纯素饮食", "color": "rgba(33, 150, 243, 0.8)", "annual_consumption_kg": {
+        '红肉': 0, '禽肉': 0, '鱼类及海鲜': 0, '乳制品': 0, '蛋类': 0, '谷物': 140,
+        '豆类及坚果': 70, '淀粉类蔬菜': 80, '蔬菜': 250, '水果': 180, '其他': 5}},
+}
+
+# 查询表的两个轴：消费量倍数 0~2（步长 0.05）和浪费率 0~50%（步长 1%）
+DIET_CONSUMPTION_MULTIPLIERS = [round(i * 0.05, 2) for i in range(41)]
+DIET_WASTE_RATES = [round(i * 0.01, 2) for i in range(51)]
+DIET_SCENARIOS_STEM = "diet_scenarios"
+
+def diet_category(food_name, data_category):
+    base_name = base_food_name(food_name)
+    return CATEGORY_MAPPING.get(base_name) or DATA_CATEGORY_DIET_CATEGORIES.get(data_category, '其他')
+
+class DietCategoryStats:
+    """在写出 food_nutrients_and_carbon 的同时按饮食大类累计总碳排放和消费环节浪费率"""
+
+    def __init__(self):
+        self.co2 = {category: 0.0 for category in DIET_CATEGORIES}
+        self.waste = {category: 0.0 for category in DIET_CATEGORIES}
+        self.count = {category: 0 for category in DIET_CATEGORIES}
+
+    def add(self, nutrient_record):
+        category = diet_category(nutrient_record["name"], nutrient_record["category"])
+        self.co2[category] += nutrient_record["total_co2_per_kg"]
+        self.waste[category] += nutrient_record["average_consumer_waste_percentage"]
+        self.count[category] += 1
+
+    def averages(self):
+        """返回 (各大类平均 kg CO2eq/kg, 各大类平均浪费率)；没有食物的大类碳排放记为 0（与页面相同），浪费率取全体平均"""
+        total_count = sum(self.count.values())
+        overall_waste = sum(self.waste.values()) / total_count if total_count else 0.0
+        co2 = {c: self.co2[c] / self.count[c] if self.count[c] else 0.0 for c in DIET_CATEGORIES}
+        waste = {c: self.waste[c] / self.count[c] if self.count[c] else overall_waste for c in DIET_CATEGORIES}
+        return co2, waste
+
+def _waste_adjusted(consumption_kg, co2_per_kg, waste_rate):
+    """吃掉 consumption_kg 需要购买 consumption_kg / (1 - 浪费率)，返回 (总排放, 其中浪费部分的排放)"""
+    purchased = consumption_kg / (1 - waste_rate)
+    return purchased * co2_per_kg, (purchased - consumption_kg) * co2_per_kg
+
+@instrumented(items=lambda result: result)
+def write_diet_scenarios(stats, output_dir):
+    """写出 diet_scenarios.bin（小端 float32 查询表）和描述它的 diet_scenarios.bin.json
+
+    emissions 的形状为 [饮食][大类][消费倍数][浪费率]（其中浪费部分的排放 = emissions × 浪费率，不再单独存放），
+    total_emissions / total_wasted_emissions 为对所有大类求和后的 [饮食][消费倍数][浪费率]，单位 kg CO2eq/人/年。
+    """
+    co2, waste = stats.averages()
+    emissions, totals, total_wasted = [], [], []
+    baseline = {}
+    for diet_key, diet in DIET_STRUCTURES.items():
+        consumption = diet["annual_consumption_kg"]
+        grid_total = [[0.0] * len(DIET_WASTE_RATES) for _ in DIET_CONSUMPTION_MULTIPLIERS]
+        grid_wasted = [[0.0] * len(DIET_WASTE_RATES) for _ in DIET_CONSUMPTION_MULTIPLIERS]
+        by_category = {}
+        for category in DIET_CATEGORIES:
+            for m, multiplier in enumerate(DIET_CONSUMPTION_MULTIPLIERS):
+                for w, waste_rate in enumerate(DIET_WASTE_RATES):
+                    total, wasted_part = _waste_adjusted(consumption.get(category, 0) * multiplier, co2[category],
+                                                         waste_rate)
+                    emissions.append(total)
+                    grid_total[m][w] += total
+                    grid_wasted[m][w] += wasted_part
+            total, wasted_part = _waste_adjusted(consumption.get(category, 0), co2[category], waste[category])
+            by_category[category] = {
+                "consumption_kg": consumption.get(category, 0),
+                "emissions_kg": round(consumption.get(category, 0) * co2[category], 3),
+                "waste_adjusted_emissions_kg": round(total, 3),
+                "wasted_emissions_kg": round(wasted_part, 3)
+            }
+        totals.extend(itertools.chain.from_iterable(grid_total))
+        total_wasted.extend(itertools.chain.from_iterable(grid_wasted))
+        # 消费倍数 1、各大类按数据中的平均浪费率时的结果，emissions_kg 与页面上的年度碳足迹相同
+        baseline[diet_key] = {
+            "name": diet["name"],
+            "color": diet["color"],
+            "emissions_kg": round(sum(c["emissions_kg"] for c in by_category.values()), 3),
+            "waste_adjusted_emissions_kg": round(sum(c["waste_adjusted_emissions_kg"] for c in by_category.values()), 3),
+            "by_category": by_category
+        }
+
+    write_columnar_export(DIET_SCENARIOS_STEM, [
+        ("emissions", "float32", 1, emissions),
+        ("total_emissions", "float32", 1, totals),
+        ("total_wasted_emissions", "float32", 1, total_wasted),
+    ], output_dir, meta={
+        "diets": list(DIET_STRUCTURES),
+        "categories": DIET_CATEGORIES,
+        "consumption_multipliers": DIET_CONSUMPTION_MULTIPLIERS,
+        "waste_rates": DIET_WASTE_RATES,
+        "shape": {"emissions": ["diet", "category", "consumption_multiplier", "waste_rate"],
+                  "total_emissions": ["diet", "consumption_multiplier", "waste_rate"]},
+        "category_co2_per_kg": {c: round(v, 4) for c, v in co2.items()},
+        "category_waste_rate": {c: round(v, 4) for c, v in waste.items()},
+        "category_foods": stats.count,
+        "baseline": baseline
+    })
+    return len(emissions)
+
+def finish_diet_scenarios(stats, output_dir):
+    """stats 不为 None 时写出饮食情景查询表，否则删除上次 --diet-scenarios 留下的旧文件"""
+    if stats is not None:
+        write_diet_scenarios(stats, output_dir)
+    else:
+        remove_stale_outputs(output_dir, [f"{DIET_SCENARIOS_STEM}.bin", f"{DIET_SCENARIOS_STEM}.bin.json"])
+
+# --- 规范化路线表：国家和运输方式驻留为整数 id，路线按列存放在定长数组中 ---
+NORMALIZED_ROUTES_FILE_NAME = "foods_with_routes_normalized.json"
+ROUTES_BINARY_STEM = "foods_with_routes_routes"  # --columnar 时写出的路线列二进制版本
+
+def _id_typecode(num_values):
+    """能容纳 num_values 个 id 的最小无符号整数 array 类型码"""
+    for typecode in ("B", "H", "I"):
+        if num_values <= 1 << (8 * array(typecode).itemsize):
+            return typecode
+    return "L"
+
+class RouteTable:
+    """紧凑的食物路线表
+
+    每条路线只占 origin / destination / transport_mode 三个整数 id 和一个 float32 距离（约 9~13 字节），
+    而不是重复国家名和坐标的 dict；同一食物的路线连续存放，由 route_start / route_count 定位。
+    遍历 RouteTable 按原顺序产出与 foods_with_routes.json 完全相同的食物条目（兼容视图）。
+    """
+
+    def __init__(self, countries_data=None, transport_modes=TRANSPORT_MODES):
+        if countries_data is None:
+            countries_data = COUNTRIES_DATA
+        self.countries_data = countries_data
+        self.country_names = list(countries_data)
+        self.country_ids = {name: i for i, name in enumerate(self.country_names)}
+        self.transport_modes = list(transport_modes)
+        self.mode_ids = {mode: i for i, mode in enumerate(self.transport_modes)}
+
+        self.food_names = []
+        self.production_co2 = array("d")
+        self.route_start = array("I")
+        self.route_count = array("I")
+        country_typecode = _id_typecode(len(self.country_names))
+        self.origin = array(country_typecode)
+        self.destination = array(country_typecode)
+        self.mode = array(_id_typecode(len(self.transport_modes)))
+        self.distance_km = array("f")
+
+    def __len__(self):
+        return len(self.food_names)
+
+    @property
+    def num_routes(self):
+        return len(self.distance_km)
+
+    @property
+    def nbytes(self):
+        columns = (self.production_co2, self.route_start, self.route_count,
+                   self.origin, self.destination, self.mode, self.distance_km)
+        return sum(column.itemsize * len(column) for column in columns)
+
+    def add(self, food_item):
+        """追加一个 foods_with_routes 格式的食物条目，返回其食物 id"""
+        food_id = len(self.food_names)
+        self.food_names.append(food_item["name"])
+        self.production_co2.append(food_item["production_co2_per_kg"])
+        self.route_start.append(len(self.distance_km))
+        self.route_count.append(len(food_item["routes"]))
+        for route in food_item["routes"]:
+            self.origin.append(self.country_ids[route["origin_country"]])
+            self.destination.append(self.country_ids[route["destination_country"]])
+            self.mode.append(self.mode_ids[route["transport_mode"]])
+            self.distance_km.append(route["distance_km"])
+        return food_id
+
+    def food_item(self, food_id):
+        """按食物 id 还原反规范化的食物条目；float32 距离在 2 万公里内误差小于 0.005，round 后与原值一致"""
+        start = self.route_start[food_id]
+        routes = []
+        for i in range(start, start + self.route_count[food_id]):
+            origin_name = self.country_names[self.origin[i]]
+            dest_name = self.country_names[self.destination[i]]
+            origin_coords = self.countries_data[origin_name]
+            dest_coords = self.countries_data[dest_name]
+            routes.append({
+                "origin_country": origin_name,
+                "origin_lat": origin_coords["lat"],
+                "origin_lon": origin_coords["lon"],
+                "destination_country": dest_name,
+                "destination_lat": dest_coords["lat"],
+                "destination_lon": dest_coords["lon"],
+                "distance_km": round(self.distance_km[i], 2),
+                "transport_mode": self.transport_modes[self.mode[i]]
+            })
+        return {
+            "name": self.food_names[food_id],
+            "production_co2_per_kg": self.production_co2[food_id],
+            "routes": routes
+        }
+
+    def __iter__(self):
+        for food_id in range(len(self.food_names)):
+            yield self.food_item(food_id)
+
+    def normalized(self):
+        """规范化导出：国家表 + 运输方式表 + 按列存放的食物和路线，路线中的国家和运输方式均为表中下标"""
+        return {
+            "countries": [{"name": name, "lat": self.countries_data[name]["lat"], "lon": self.countries_data[name]["lon"]}
+                          for name in self.country_names],
+            "transport_modes": self.transport_modes,
+            "foods": {
+                "name": self.food_names,
+                "production_co2_per_kg": list(self.production_co2),
+                "route_start": list(self.route_start),
+                "route_count": list(self.route_count)
+            },
+            "routes": {
+                "origin": list(self.origin),
+                "destination": list(self.destination),
+                "transport_mode": list(self.mode),
+                "distance_km": [round(d, 2) for d in self.distance_km]
+            }
+        }
+
+class ColumnSpool:
+    """逐批追加到磁盘临时文件的一列数值，已写出的部分不留在内存中
+
+    文本文件保存逗号分隔的 JSON 值（拼到 "[" 和 "]" 之间即为 JSON 数组）；dtype 不为 None 时另存一份
+    小端二进制，write_columnar_export 可以直接把它当作属性的数值序列。
+    """
+
+    def __init__(self, directory, name, dtype=None, fmt=repr):
+        self.dtype = dtype
+        self.count = 0
+        self._format = fmt
+        self.text_path = os.path.join(directory, f"{name}.txt")
+        self._text = open(self.text_path, 'w', encoding='utf-8')
+        self.binary_path = None
+        self._binary = None
+        if dtype is not None:
+            self.binary_path = os.path.join(directory, f"{name}.bin")
+            self._binary = open(self.binary_path, 'wb')
+
+    def extend(self, values):
+        values = list(values)
+        if not values:
+            return
+        if self.count:
+            self._text.write(",")
+        self._text.write(",".join(map(self._format, values)))
+        if self._binary is not None:
+            self._binary.write(_little_endian_array(self.dtype, values).tobytes())
+        self.count += len(values)
+
+    def close(self):
+        self._text.close()
+        if self._binary is not None:
+            self._binary.close()
+
+    def copy_text(self, f):
+        with open(self.text_path, 'r', encoding='utf-8') as text:
+            shutil.copyfileobj(text, f)
+
+    def copy_binary(self, f):
+        """把二进制列复制到 f，返回写入的字节数"""
+        with open(self.binary_path, 'rb') as binary:
+            shutil.copyfileobj(binary, f)
+        return self.count * COLUMNAR_ITEM_BYTES
+
+def _json_string(value):
+    return json.dumps(value, ensure_ascii=False)
+
+class NormalizedRouteWriter:
+    """边生成边写出 foods_with_routes_normalized.json（columnar=True 时另有 foods_with_routes_routes.bin）
+
+    每一列先追加到输出目录下临时目录中的 ColumnSpool，close() 时按列拼接成最终文件，
+    内存占用只与国家数和运输方式数有关，与食物数和路线数无关。
+    """
+    FOOD_COLUMNS = (("name", None), ("production_co2_per_kg", None),
+                    ("route_start", "uint32"), ("route_count", "uint32"))
+    ROUTE_COLUMNS = (("origin", "uint32"), ("destination", "uint32"),
+                     ("transport_mode", "uint32"), ("distance_km", "float32"))
+
+    def __init__(self, output_dir, countries_data=None, transport_modes=TRANSPORT_MODES, columnar=False):
+        if countries_data is None:
+            countries_data = COUNTRIES_DATA
+        self.output_dir = output_dir
+        self.file_path = os.path.join(output_dir, NORMALIZED_ROUTES_FILE_NAME)
+        self.columnar = columnar
+        self.countries_data = countries_data
+        self.country_ids = {name: i for i, name in enumerate(countries_data)}
+        self.transport_modes = list(transport_modes)
+        self.mode_ids = {mode: i for i, mode in enumerate(self.transport_modes)}
+        self.num_foods = 0
+        self.num_routes = 0
+        self._spool_dir = tempfile.mkdtemp(prefix=".foods_with_routes_normalized.", dir=output_dir)
+        self.foods = {name: ColumnSpool(self._spool_dir, f"food_{name}", dtype if columnar else None,
+                                        _json_string if name == "name" else repr)
+                      for name, dtype in self.FOOD_COLUMNS}
+        self.routes = {name: ColumnSpool(self._spool_dir, f"route_{name}", dtype if columnar else None)
+                       for name, dtype in self.ROUTE_COLUMNS}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+    def add(self, food_item):
+        """追加一个 foods_with_routes 格式的食物条目"""
+        routes = food_item["routes"]
+        self.add_food(food_item["name"], food_item["production_co2_per_kg"],
+                      [self.country_ids[route["origin_country"]] for route in routes],
+                      [self.country_ids[route["destination_country"]] for route in routes],
+                      [self.mode_ids[route["transport_mode"]] for route in routes],
+                      [route["distance_km"] for route in routes])
+
+    def add_food(self, name, production_co2, origins, destinations, modes, distances):
+        """按 id 追加一个食物及其路线；距离 round 到 2 位小数，与 RouteTable 的 float32 往返结果一致"""
+        self.foods["name"].extend([name])
+        self.foods["production_co2_per_kg"].extend([production_co2])
+        self.foods["route_start"].extend([self.num_routes])
+        self.foods["route_count"].extend([len(distances)])
+        self.routes["origin"].extend(origins)
+        self.routes["destination"].extend(destinations)
+        self.routes["transport_mode"].extend(modes)
+        self.routes["distance_km"].extend([round(d, 2) for d in distances])
+        self.num_foods += 1
+        self.num_routes += len(distances)
+
+    def close(self):
+        try:
+            for spool in itertools.chain(self.foods.values(), self.routes.values()):
+                spool.close()
+            head = json.dumps({
+                "countries": [{"name": name, "lat": coords["lat"], "lon": coords["lon"]}
+                              for name, coords in self.countries_data.items()],
+                "transport_modes": self.transport_modes
+            }, ensure_ascii=False, separators=(",", ":"))
+            with AtomicFile(self.file_path) as f:
+                f.write(head[:-1])
+                for section, columns in (("foods", self.foods), ("routes", self.routes)):
+                    f.write(f',"{section}":{{')
+                    for i, (name, spool) in enumerate(columns.items()):
+                        f.write(f'{"," if i else ""}"{name}":[')
+                        spool.copy_text(f)
+                        f.write("]")
+                    f.write("}")
+                f.write("}")
+            print(f"Generated {self.file_path} with {self.num_routes} routes.")
+            if self.columnar:
+                write_columnar_export(ROUTES_BINARY_STEM, [
+                    ("origin", "uint32", 1, self.routes["origin"]),
+                    ("destination", "uint32", 1, self.routes["destination"]),
+                    ("transport_mode", "uint32", 1, self.routes["transport_mode"]),
+                    ("distance_km", "float32", 1, self.routes["distance_km"]),
+                    ("food_route_start", "uint32", 1, self.foods["route_start"]),
+                    ("food_route_count", "uint32", 1, self.foods["route_count"]),
+                ], self.output_dir, meta={
+                    "countries": list(self.countries_data),
+                    "transport_modes": self.transport_modes,
+                    # 读取方据此确认二进制版本与同目录的规范化 JSON 来自同一次生成
+                    "source": {"file": NORMALIZED_ROUTES_FILE_NAME, **file_stamp(self.file_path),
+                               "sha256": file_sha256(self.file_path), "routes": self.num_routes},
+                    "foods": self.foods["name"]
+                })
+            else:
+                # 不写二进制版本时删除上次 --columnar 留下的旧文件，免得与新的 JSON 不一致
+                remove_stale_outputs(self.output_dir, [f"{ROUTES_BINARY_STEM}.bin", f"{ROUTES_BINARY_STEM}.bin.json"])
+        finally:
+            self.discard()
+        return self.num_routes
+
+    def discard(self):
+        for spool in itertools.chain(self.foods.values(), self.routes.values()):
+            spool.close()
+        shutil.rmtree(self._spool_dir, ignore_errors=True)
+
+@instrumented(items=lambda result: result)
+def write_normalized_routes(route_table, output_dir, columnar=False):
+    """把内存中的 RouteTable 写出为 foods_with_routes_normalized.json；columnar=True 时另外写出路线列的二进制版本"""
+    with NormalizedRouteWriter(output_dir, route_table.countries_data, route_table.transport_modes,
+                               columnar) as writer:
+        for food_id, name in enumerate(route_table.food_names):
+            start = route_table.route_start[food_id]
+            end = start + route_table.route_count[food_id]
+            writer.add_food(name, route_table.production_co2[food_id],
+                            route_table.origin[start:end], route_table.destination[start:end],
+                            route_table.mode[start:end], route_table.distance_km[start:end])
+    return writer.num_routes
+
+def routes_binary_is_fresh(header, normalized_path):
+    """二进制路线列是否由与 normalized_path 相同的一次生成写出
+
+    头文件记录的大小和修改时间与 JSON 一致时直接认为一致；不一致（如文件被复制过）时才读整个文件比较 sha256。
+    """
+    source = header.get("source") or {}
+    if not os.path.exists(normalized_path) or "sha256" not in source:
+        return False
+    stamp = file_stamp(normalized_path)
+    if all(source.get(key) == value for key, value in stamp.items()):
+        return True
+    return source["sha256"] == file_sha256(normalized_path)
+
+def read_route_columns(output_dir, names=("transport_mode", "distance_km", "food_route_count")):
+    """从 foods_with_routes_routes.bin 读出指定的路线列（numpy 数组），返回 (列字典, 头文件)
+
+    二进制版本不存在或与同目录的规范化 JSON 不一致时返回 (None, None)，由调用方决定如何退回。
+    """
+    _require_numpy("reading the routes binary")
+    header_path = os.path.join(output_dir, f"{ROUTES_BINARY_STEM}.bin.json")
+    if not os.path.exists(header_path):
+        return None, None
+    with open(header_path, 'r', encoding='utf-8') as f:
+        header = json.load(f)
+    if not routes_binary_is_fresh(header, os.path.join(output_dir, NORMALIZED_ROUTES_FILE_NAME)):
+        return None, None
+    columns = {}
+    for name in names:
+        attribute = header["attributes"][name]
+        dtype = np.dtype(attribute["dtype"]).newbyteorder("<")
+        columns[name] = np.fromfile(os.path.join(output_dir, header["binary"]), dtype=dtype,
+                                    count=attribute["byte_length"] // dtype.itemsize, offset=attribute["byte_offset"])
+    return columns, header
 
 # --- 主执行函数 ---
-def generate_all_data():
+def write_transport_factors(transport_factors, output_dir):
+    factors_file_path = os.path.join(output_dir, "transport_factors.json")
+    with AtomicFile(factors_file_path) as f:
+        json.dump(transport_factors, f, ensure_ascii=False, indent=4)
+    print(f"Generated {factors_file_path}")
+
+@instrumented(items=lambda result: result[0])
+def write_fused_food_records(records, transport_factors, output_dir, output_format="json", compact=False,
+                             progress_total=None, shard_size=None, countries_data=None, columnar=False,
+                             nutrient_rankings=False, diet_scenarios=False):
+    """把融合流水线产出的 (路线条目, 营养条目) 同时写入 foods_with_routes 和 food_nutrients_and_carbon
+
+    写出的同时汇总路线排放、建立偏移索引并流式写出规范化路线表，返回 (食物数, 路线数)；
+    nutrient_rankings=True 时另外收集营养效率排名（需要在内存中保留每个食物的数值）；
+    diet_scenarios=True 时另外写出饮食情景查询表。
+    """
+    start_time = time.perf_counter()
+    rankings = NutrientRankings() if nutrient_rankings else None
+    diet_stats = DietCategoryStats()
+    with RouteAggregator(transport_factors, output_dir) as aggregator:
+        with open_dataset_writer("foods_with_routes", output_dir, output_format, compact, shard_size) as foods_writer, \
+             open_dataset_writer("food_nutrients_and_carbon", output_dir, output_format, compact,
+                                 shard_size) as nutrients_writer, \
+             NormalizedRouteWriter(output_dir, countries_data, columnar=columnar) as route_writer:
+            for food_item, nutrient_record in records:
+                offset, length = foods_writer.write(food_item)
+                aggregator.add(food_item, offset, length, foods_writer.current_file)
+                route_writer.add(food_item)
+                nutrients_writer.write(nutrient_record)
+                if rankings is not None:
+                    rankings.add(nutrient_record)
+                diet_stats.add(nutrient_record)
+                if progress_total and foods_writer.count % SCALE_PROGRESS_INTERVAL == 0:
+                    elapsed = time.perf_counter() - start_time
+                    print(f"  {foods_writer.count}/{progress_total} foods, {aggregator.num_routes} routes, "
+                          f"{aggregator.num_routes / elapsed:.0f} routes/s")
+
+        print(f"Generated {foods_writer.file_path} with {foods_writer.count} food items.")
+        print(f"Generated {nutrients_writer.file_path} with {nutrients_writer.count} food items.")
+        write_route_aggregates(aggregator, output_dir, output_format)
+    if rankings is not None:
+        write_nutrient_rankings(rankings, output_dir)
+    else:
+        remove_stale_outputs(output_dir, [NUTRIENT_RANKINGS_FILE_NAME])
+    finish_diet_scenarios(diet_stats if diet_scenarios else None, output_dir)
+    if shard_size:
+        update_manifest(output_dir, {
+            "foods_with_routes": foods_writer.manifest_entry(),
+            "food_nutrients_and_carbon": nutrients_writer.manifest_entry()
+        })
+    else:
+        update_manifest(output_dir, {}, unsharded=["foods_with_routes", "food_nutrients_and_carbon"])
+    return foods_writer.count, aggregator.num_routes
+
+# --- 增量构建：按输入指纹跳过未变化的生成阶段 ---
+def file_stamp(file_path):
+    """文件的 (大小, 修改时间)，在比较内容哈希之前用来廉价地判断文件是否未变"""
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# 只决定输出位置、不影响输出内容的模块级常量，不计入代码指纹
+FINGERPRINT_IGNORED_CONSTANTS = {"PROJECT_ROOT", "OUTPUT_DATA_DIR", "SCALE_OUTPUT_DIR"}
+
+def _code_objects(obj):
+    """函数（含被装饰的函数和闭包中的函数）或类中全部方法的代码对象"""
+    if isinstance(obj, type):
+        for value in vars(obj).values():
+            if isinstance(value, (staticmethod, classmethod)):
+                value = value.__func__
+            elif isinstance(value, property):
+                yield from (f.__code__ for f in (value.fget, value.fset, value.fdel) if f is not None)
+                continue
+            if isinstance(value, types.FunctionType):
+                yield from _code_objects(value)
+        return
+    func = inspect.unwrap(obj)
+    yield func.__code__
+    for cell in func.__closure__ or ():
+        try:
+            contents = cell.cell_contents
+        except ValueError:  # 尚未赋值的闭包变量
+            continue
+        if isinstance(contents, types.FunctionType):
+            yield from _code_objects(contents)
+
+def _global_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _global_names(const)
+    return names
+
+def stage_code_fingerprint(entry_point):
+    """entry_point 传递地用到的本模块函数、类的源码，以及它们读取的大写模块级常量的取值
+
+    只改动某个阶段用到的代码或常量时，只有这个阶段需要重新生成；改动其他阶段的代码不影响它的指纹。
+    """
+    module_globals = globals()
+    pending, seen = [entry_point], set()
+    sources, constants = {}, {}
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        # lambda 的源码是调用处的整行，随参数格式变化；它引用的函数和常量会在下面计入
+        if getattr(obj, "__module__", None) == __name__ and getattr(obj, "__name__", "") != "<lambda>":
+            sources[obj.__qualname__] = inspect.getsource(obj)
+        for code in _code_objects(obj):
+            for name in _global_names(code):
+                value = module_globals.get(name)
+                if isinstance(value, (types.FunctionType, type)):
+                    if getattr(value, "__module__", None) == __name__:
+                        pending.append(value)
+                elif (name.isupper() and not name.startswith("_") and name not in FINGERPRINT_IGNORED_CONSTANTS
+                      and not isinstance(value, types.ModuleType) and name in module_globals):
+                    constants[name] = value
+    return {"sources": sources, "constants": constants}
+
+def fingerprint_inputs(inputs, entry_point=None):
+    """对一个生成阶段的输入（配置、种子、输出选项）以及该阶段用到的代码和常量取 sha256"""
+    payload = {"inputs": inputs}
+    if entry_point is not None:
+        payload["code"] = stage_code_fingerprint(entry_point)
+    text = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=sorted)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class IncrementalBuild:
+    """在 <output_dir>/.build_cache.json 中记录各阶段的输入指纹和输出文件的 sha256
+
+    某阶段的指纹与上次相同、且上次写出的文件都还在并且内容未被改动时，该阶段可以跳过。
+    每个输出文件同时记录大小和修改时间：两者都没变时不再读文件计算哈希，变了才比较 sha256。
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.cache_path = os.path.join(output_dir, BUILD_CACHE_FILE_NAME)
+        self.stages = {}
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                self.stages = json.load(f)
+
+    def is_fresh(self, stage, fingerprint):
+        entry = self.stages.get(stage)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return False
+        for rel_path, recorded in entry["outputs"].items():
+            file_path = os.path.join(self.output_dir, rel_path)
+            if not os.path.exists(file_path):
+                return False
+            if isinstance(recorded, str):
+                # 旧格式缓存只记录了哈希
+                recorded = {"sha256": recorded}
+            stamp = file_stamp(file_path)
+            if all(recorded.get(key) == value for key, value in stamp.items()):
+                continue
+            if file_sha256(file_path) != recorded["sha256"]:
+                return False
+        return True
+
+    def record(self, stage, fingerprint, written_files):
+        outputs = {}
+        for file_path in written_files:
+            outputs[os.path.relpath(file_path, self.output_dir).replace(os.sep, "/")] = {
+                "sha256": file_sha256(file_path), **file_stamp(file_path)}
+        self.stages[stage] = {"fingerprint": fingerprint, "outputs": outputs}
+        with AtomicFile(self.cache_path, track=False) as f:
+            json.dump(self.stages, f, ensure_ascii=False, indent=2)
+
+def run_build_stage(build, stage, inputs, generate):
+    """build 为 None 时直接执行 generate()；否则在输入指纹未变时跳过，执行后记录其写出的文件"""
+    if build is None:
+        with metrics_stage(stage):
+            generate()
+        return True
+    fingerprint = fingerprint_inputs(inputs, generate)
+    if build.is_fresh(stage, fingerprint):
+        print(f"Skipping {stage}: inputs unchanged since last build")
+        return False
+    first_written = len(_WRITTEN_FILES)
+    with metrics_stage(stage):
+        generate()
+    build.record(stage, fingerprint, _WRITTEN_FILES[first_written:])
+    return True
+
+def food_stage_inputs(seed, output_format, compact, fused, shard_size, columnar, nutrient_rankings=False,
+                      diet_scenarios=False):
+    return {
+        "config": {
+            "NUM_FOODS_TO_GENERATE": NUM_FOODS_TO_GENERATE,
+            "origins_range": [NUM_ORIGINS_PER_FOOD_MIN, NUM_ORIGINS_PER_FOOD_MAX],
+            "destinations_range": [NUM_DESTINATIONS_PER_ORIGIN_MIN, NUM_DESTINATIONS_PER_ORIGIN_MAX],
+            "GENERATION_SHARD_SIZE": GENERATION_SHARD_SIZE,
+        },
+        "FOOD_CATEGORIES": FOOD_CATEGORIES,
+        "CATEGORY_ATTRIBUTES": CATEGORY_ATTRIBUTES,
+        "PERISHABLE_FOODS": PERISHABLE_FOODS,
+        "COUNTRIES_DATA": COUNTRIES_DATA,
+        "NUTRIENT_DEFINITIONS": NUTRIENT_DEFINITIONS,
+        "BASE_TRANSPORT_FACTORS": BASE_TRANSPORT_FACTORS,
+        "TRANSPORT_MODES": TRANSPORT_MODES,
+        "diet_model": {"CATEGORY_MAPPING": CATEGORY_MAPPING, "DIET_STRUCTURES": DIET_STRUCTURES,
+                       "multipliers": DIET_CONSUMPTION_MULTIPLIERS, "waste_rates": DIET_WASTE_RATES},
+        "seed": seed,
+        "output": {"format": output_format, "compact": compact, "fused": fused, "shard_size": shard_size,
+                   "columnar": columnar, "nutrient_rankings": nutrient_rankings, "diet_scenarios": diet_scenarios},
+    }
+
+def generate_all_data(output_format="json", compact=False, fused=False, seed=None, workers=1, shard_size=None,
+                      incremental=False, columnar=False, nutrient_rankings=False, diet_scenarios=False):
     if not os.path.exists(OUTPUT_DATA_DIR):
         os.makedirs(OUTPUT_DATA_DIR)
         print(f"Created directory: {OUTPUT_DATA_DIR}")
     else:
         print(f"Output directory already exists: {OUTPUT_DATA_DIR}")
 
+    seed = resolve_master_seed(seed, workers)
+    build = IncrementalBuild(OUTPUT_DATA_DIR) if incremental else None
+    run_build_stage(build, "foods", food_stage_inputs(seed, output_format, compact, fused, shard_size, columnar,
+                                                      nutrient_rankings, diet_scenarios),
+                    lambda: _generate_food_datasets(output_format, compact, fused, seed, workers, shard_size,
+                                                    columnar, nutrient_rankings, diet_scenarios))
+
+def _generate_food_datasets(output_format, compact, fused, seed, workers, shard_size, columnar,
+                            nutrient_rankings=False, diet_scenarios=False):
+    # 距离矩阵只在本次生成过程中缓存
+    clear_distance_cache()
+
+    if fused or seed is not None:
+        # 融合流水线：路线和营养/碳足迹条目在同一次遍历中生成并写出；
+        # 指定种子或多进程时按分片生成，输出只取决于种子而与进程数无关
+        catalogue_rng = shard_rng(seed, "catalogue")
+        current_food_selection = catalogue_rng.sample(ALL_FOOD_NAMES, min(NUM_FOODS_TO_GENERATE, len(ALL_FOOD_NAMES)))
+        transport_factors = generate_transport_factors(catalogue_rng)
+        records = iter_sharded_food_records(current_food_selection, transport_factors, seed=seed, workers=workers)
+        write_fused_food_records(records, transport_factors, OUTPUT_DATA_DIR, output_format, compact,
+                                 shard_size=shard_size, columnar=columnar, nutrient_rankings=nutrient_rankings,
+                                 diet_scenarios=diet_scenarios)
+        write_transport_factors(transport_factors, OUTPUT_DATA_DIR)
+        return
+
     # 1. 生成 foods_with_routes.json 和 transport_factors.json
-    foods_with_routes, transport_factors = generate_foods_with_routes_data()
+    foods_with_routes, transport_factors = generate_route_table()
 
-    foods_file_path = os.path.join(OUTPUT_DATA_DIR, "foods_with_routes.json")
-    with open(foods_file_path, 'w', encoding='utf-8') as f:
-        json.dump(foods_with_routes, f, ensure_ascii=False, indent=4)
-    print(f"Generated {foods_file_path} with {len(foods_with_routes)} food items.")
+    with RouteAggregator(transport_factors, OUTPUT_DATA_DIR) as aggregator:
+        with open_dataset_writer("foods_with_routes", OUTPUT_DATA_DIR, output_format, compact,
+                                 shard_size) as foods_writer:
+            for food_item in foods_with_routes:
+                offset, length = foods_writer.write(food_item)
+                aggregator.add(food_item, offset, length, foods_writer.current_file)
+        print(f"Generated {foods_writer.file_path} with {foods_writer.count} food items.")
 
-    factors_file_path = os.path.join(OUTPUT_DATA_DIR, "transport_factors.json")
-    with open(factors_file_path, 'w', encoding='utf-8') as f:
-        json.dump(transport_factors, f, ensure_ascii=False, indent=4)
-    print(f"Generated {factors_file_path}")
+        write_transport_factors(transport_factors, OUTPUT_DATA_DIR)
+        write_route_aggregates(aggregator, OUTPUT_DATA_DIR, output_format)
+    write_normalized_routes(foods_with_routes, OUTPUT_DATA_DIR, columnar)
 
     # 2. 生成 food_nutrients_and_carbon.json
-    food_nutrients_carbon_data = generate_food_nutrients_and_carbon_data(foods_with_routes, transport_factors)
-    nutrients_file_path = os.path.join(OUTPUT_DATA_DIR, "food_nutrients_and_carbon.json")
-    with open(nutrients_file_path, 'w', encoding='utf-8') as f:
-        json.dump(food_nutrients_carbon_data, f, ensure_ascii=False, indent=4)
-    print(f"Generated {nutrients_file_path} with {len(food_nutrients_carbon_data)} food items.")
+    food_nutrients_carbon_data = iter_food_nutrients_and_carbon(foods_with_routes, transport_factors)
+    rankings = NutrientRankings() if nutrient_rankings else None
+    diet_stats = DietCategoryStats()
+    with open_dataset_writer("food_nutrients_and_carbon", OUTPUT_DATA_DIR, output_format, compact,
+                             shard_size) as nutrients_writer:
+        for nutrient_record in food_nutrients_carbon_data:
+            nutrients_writer.write(nutrient_record)
+            if rankings is not None:
+                rankings.add(nutrient_record)
+            diet_stats.add(nutrient_record)
+    print(f"Generated {nutrients_writer.file_path} with {nutrients_writer.count} food items.")
+    if rankings is not None:
+        write_nutrient_rankings(rankings, OUTPUT_DATA_DIR)
+    else:
+        remove_stale_outputs(OUTPUT_DATA_DIR, [NUTRIENT_RANKINGS_FILE_NAME])
+    finish_diet_scenarios(diet_stats if diet_scenarios else None, OUTPUT_DATA_DIR)
+
+    if shard_size:
+        update_manifest(OUTPUT_DATA_DIR, {
+            "foods_with_routes": foods_writer.manifest_entry(),
+            "food_nutrients_and_carbon": nutrients_writer.manifest_entry()
+        })
+    else:
+        update_manifest(OUTPUT_DATA_DIR, {}, unsharded=["foods_with_routes", "food_nutrients_and_carbon"])
+
+# --- 蒙特卡洛不确定性：对运输因子和生产碳排放大批量抽样，给出总碳足迹的 p5/p50/p95 ---
+MONTE_CARLO_DRAWS = 100000
+MONTE_CARLO_BATCH_SIZE = 1 << 18     # 每批抽样的次数，限制 (批大小 × 运输方式) 临时数组的内存
+MONTE_CARLO_FOODS_PER_TASK = 8
+MONTE_CARLO_PERCENTILES = (5, 50, 95)
+CO2_UNCERTAINTY_FILE_NAME = "food_co2_uncertainty.json"
+
+def _monte_carlo_food_task(task):
+    """对一组食物各抽样 draws 次，返回每个食物生产、运输、总碳排放的分位数
+
+    每次抽样：各运输方式的因子在 TRANSPORT_FACTOR_RANGE 内均匀抽取，生产碳排放在分类范围内均匀抽取；
+    平均运输碳排放 = Σ_mode (该方式路线的平均距离 × 因子) / 1e6，即一次矩阵乘法。
+    """
+    first_food_index, foods, draws, seed = task
+    base_factors = np.array([BASE_TRANSPORT_FACTORS[mode] for mode in TRANSPORT_MODES])
+    results = []
+    for food_index, (name, category, mode_distances) in enumerate(foods, first_food_index):
+        rng = np.random.default_rng(None if seed is None else derive_seed(seed, "monte_carlo", food_index))
+        mode_distances = np.asarray(mode_distances) / 1000000
+        production_range = CATEGORY_ATTRIBUTES[category]["production_co2_range"]
+        samples = np.empty((3, draws))
+        for start in range(0, draws, MONTE_CARLO_BATCH_SIZE):
+            n = min(MONTE_CARLO_BATCH_SIZE, draws - start)
+            factors = base_factors * rng.uniform(*TRANSPORT_FACTOR_RANGE, (n, len(base_factors)))
+            samples[0, start:start + n] = rng.uniform(*production_range, n)
+            samples[1, start:start + n] = factors @ mode_distances
+        samples[2] = samples[0] + samples[1]
+        quantiles = np.percentile(samples, MONTE_CARLO_PERCENTILES, axis=1)
+        record = {"name": name, "category": category}
+        for row, key in enumerate(("production_co2_per_kg", "transport_co2_per_kg", "total_co2_per_kg")):
+            record[key] = {f"p{p}": round(float(q), 3) for p, q in zip(MONTE_CARLO_PERCENTILES, quantiles[:, row])}
+        results.append(record)
+    return results
+
+def food_mode_distances(route_count, route_modes, route_distances, transport_modes):
+    """由路线列算出每个食物按运输方式的“平均距离”矩阵 (食物 × 运输方式)
+
+    第 m 列为该食物所有 m 方式路线的距离之和除以路线总数，与平均运输碳排放的定义一致。
+    """
+    mode_order = [transport_modes.index(mode) for mode in TRANSPORT_MODES]
+    route_count = np.asarray(route_count, dtype=np.int64)
+    food_of_route = np.repeat(np.arange(len(route_count)), route_count)
+    distances = np.zeros((len(route_count), len(transport_modes)))
+    np.add.at(distances, (food_of_route, np.asarray(route_modes, dtype=np.int64)), route_distances)
+    return distances[:, mode_order] / np.maximum(route_count, 1)[:, None]
+
+def load_food_mode_distances(output_dir):
+    """读取食物名和 food_mode_distances 矩阵
+
+    优先读 --monte-carlo 时随路线一起写出的二进制列（float32 距离 round 回 2 位小数，与 JSON 中的值一致）；
+    没有可用的二进制版本时才整体解析 foods_with_routes_normalized.json。
+    """
+    columns, header = read_route_columns(output_dir)
+    if columns is not None:
+        return header["foods"], food_mode_distances(columns["food_route_count"], columns["transport_mode"],
+                                                    np.round(columns["distance_km"].astype(np.float64), 2),
+                                                    header["transport_modes"])
+    with open(os.path.join(output_dir, NORMALIZED_ROUTES_FILE_NAME), 'r', encoding='utf-8') as f:
+        normalized_routes = json.load(f)
+    foods = normalized_routes["foods"]
+    routes = normalized_routes["routes"]
+    return foods["name"], food_mode_distances(foods["route_count"], routes["transport_mode"],
+                                              np.array(routes["distance_km"]), normalized_routes["transport_modes"])
+
+@instrumented(items=lambda result: result)
+def generate_co2_uncertainty(output_dir=OUTPUT_DATA_DIR, draws=MONTE_CARLO_DRAWS, seed=None, workers=1):
+    """读取路线列，写出每个食物碳足迹的蒙特卡洛分位数"""
+    _require_numpy("Monte Carlo uncertainty")
+    names, mode_distances = load_food_mode_distances(output_dir)
+    mode_distances = mode_distances.tolist()
+    foods = [(name, get_food_category(name), row) for name, row in zip(names, mode_distances)]
+    tasks = [(start, foods[start:start + MONTE_CARLO_FOODS_PER_TASK], draws, seed)
+             for start in range(0, len(foods), MONTE_CARLO_FOODS_PER_TASK)]
+
+    start_time = time.perf_counter()
+    records = [record for chunk in iter_parallel_shards(_monte_carlo_food_task, tasks, workers) for record in chunk]
+    elapsed = time.perf_counter() - start_time
+
+    file_path = os.path.join(output_dir, CO2_UNCERTAINTY_FILE_NAME)
+    with AtomicFile(file_path) as f:
+        json.dump({
+            "draws_per_food": draws,
+            "percentiles": list(MONTE_CARLO_PERCENTILES),
+            "transport_factor_range": list(TRANSPORT_FACTOR_RANGE),
+            "foods": records
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Generated {file_path}: {len(records)} foods × {draws} draws in {elapsed:.1f}s")
+    return len(records)
+
+def run_co2_uncertainty_stage(output_dir, draws, seed, workers, incremental=False):
+    """蒙特卡洛阶段的输入为路线数据本身（按文件内容取指纹）以及抽样次数和种子"""
+    build = IncrementalBuild(output_dir) if incremental else None
+    routes_path = os.path.join(output_dir, NORMALIZED_ROUTES_FILE_NAME)
+    inputs = {"routes_sha256": file_sha256(routes_path), "draws": draws, "seed": seed,
+              "CATEGORY_ATTRIBUTES": CATEGORY_ATTRIBUTES, "BASE_TRANSPORT_FACTORS": BASE_TRANSPORT_FACTORS}
+    run_build_stage(build, "co2_uncertainty", inputs,
+                    lambda: generate_co2_uncertainty(output_dir, draws, seed, workers))
+
+# --- 最低碳采购：在国家 × 运输方式的多式联运图上求每个目的地的最低排放来源 ---
+# 陆运只在同一块陆地内、且不超过各方式的最大单段距离时可用；非洲与欧亚大陆经西奈半岛相连，岛国各自独立
+COUNTRY_LANDMASSES = {
+    "中国": "afro_eurasia", "印度": "afro_eurasia", "俄罗斯": "afro_eurasia", "德国": "afro_eurasia",
+    "法国": "afro_eurasia", "韩国": "afro_eurasia", "泰国": "afro_eurasia", "越南": "afro_eurasia",
+    "西班牙": "afro_eurasia", "意大利": "afro_eurasia", "土耳其": "afro_eurasia", "南非": "afro_eurasia",
+    "埃及": "afro_eurasia", "肯尼亚": "afro_eurasia", "埃塞俄比亚": "afro_eurasia",
+    "美国": "north_america", "加拿大": "north_america", "墨西哥": "north_america",
+    # 达连隘口没有公路，南美洲与北美洲按两块陆地处理
+    "巴西": "south_america", "阿根廷": "south_america", "哥伦比亚": "south_america", "秘鲁": "south_america",
+    "智利": "south_america", "厄瓜多尔": "south_america",
+    "日本": "japan", "澳大利亚": "australia", "新西兰": "new_zealand", "印度尼西亚": "indonesia",
+    "菲律宾": "philippines",
+}
+LANDLOCKED_COUNTRIES = {"埃塞俄比亚"}  # 不能直接走海运，需先经陆路到沿海国家
+LAND_LEG_MAX_KM = {"land_truck": 3000, "land_train": 8000}
+# 实际路程相对质心间大圆距离的绕行系数（航道绕行大陆、公路铁路不走直线）
+ROUTE_DETOUR_FACTORS = {"sea": 1.3, "air": 1.05, "land_truck": 1.2, "land_train": 1.25}
+OPTIMAL_SOURCING_FILE_NAME = "optimal_sourcing.json"
+
+def build_transport_graph(transport_factors, countries_data=None):
+    """返回 (国家名列表, 邻接表)；邻接表 graph[i] 为 [(j, 运输方式, 实际距离 km, kg CO2eq/kg 食物)]
+
+    每对国家之间每种可用的运输方式各有一条边，边权为该段的运输碳排放；图是无向的。
+    """
+    distance_table = get_distance_table(countries_data)
+    names = distance_table.names
+    graph = [[] for _ in names]
+    for i, origin in enumerate(names):
+        for j, distance in enumerate(distance_table.row(i, range(i + 1, len(names))), i + 1):
+            destination = names[j]
+            modes = ["air"]
+            if origin not in LANDLOCKED_COUNTRIES and destination not in LANDLOCKED_COUNTRIES:
+                modes.append("sea")
+            landmass = COUNTRY_LANDMASSES.get(origin)
+            if landmass is not None and landmass == COUNTRY_LANDMASSES.get(destination):
+                modes.extend(mode for mode, max_km in LAND_LEG_MAX_KM.items() if distance <= max_km)
+            for mode in modes:
+                leg_km = distance * ROUTE_DETOUR_FACTORS[mode]
+                factor = transport_factors.get(mode, BASE_TRANSPORT_FACTORS[mode])
+                co2 = leg_km * factor / 1000000
+                graph[i].append((j, mode, leg_km, co2))
+                graph[j].append((i, mode, leg_km, co2))
+    return names, graph
+
+def lowest_carbon_paths(graph, source):
+    """Dijkstra：从 source 出发到各节点的最低排放，以及最优路径上每个节点的前驱边 (前驱, 方式, 距离, 排放)"""
+    best = [math.inf] * len(graph)
+    previous = [None] * len(graph)
+    best[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        co2, node = heapq.heappop(heap)
+        if co2 > best[node]:
+            continue
+        for neighbour, mode, leg_km, leg_co2 in graph[node]:
+            candidate = co2 + leg_co2
+            if candidate < best[neighbour]:
+                best[neighbour] = candidate
+                previous[neighbour] = (node, mode, leg_km, leg_co2)
+                heapq.heappush(heap, (candidate, neighbour))
+    return best, previous
+
+def _path_legs(names, previous, origin):
+    """沿前驱边从 origin 走回 Dijkstra 的源点；图是无向的，因此得到的就是 origin -> 目的地的各段"""
+    legs = []
+    node = origin
+    while previous[node] is not None:
+        prev, mode, leg_km, leg_co2 = previous[node]
+        legs.append({"from": names[node], "to": names[prev], "mode": mode,
+                     "distance_km": round(leg_km, 2), "co2_per_kg": round(leg_co2, 4)})
+        node = prev
+    return legs
+
+def solve_optimal_sourcing(normalized_routes, transport_factors, countries_data=None, destinations=None):
+    """对每个 (食物, 目的地) 求排放最低的 (产地, 运输路径)
+
+    每个目的地跑一次 Dijkstra 即得到所有产地到它的最低排放；各食物只在其已有产地中选择。
+    产地之间的生产碳排放相同（每个食物只有一个生产排放值），因此总排放最低等价于运输排放最低。
+    destinations 为 None 时对所有国家求解，否则只对给出的目的地求解；paths 中只保留被某个食物选中的路径。
+    """
+    names, graph = build_transport_graph(transport_factors, countries_data)
+    node_ids = {name: i for i, name in enumerate(names)}
+    if destinations is None:
+        destination_ids = range(len(names))
+    else:
+        unknown = [name for name in destinations if name not in node_ids]
+        if unknown:
+            raise ValueError(f"unknown destination countries: {', '.join(unknown)}")
+        destination_ids = [node_ids[name] for name in destinations]
+
+    graph_ids = [node_ids[country["name"]] for country in normalized_routes["countries"]]
+    foods_table = normalized_routes["foods"]
+    origins_column = normalized_routes["routes"]["origin"]
+    food_origins = [sorted({graph_ids[origins_column[i]] for i in range(start, start + count)})
+                    for start, count in zip(foods_table["route_start"], foods_table["route_count"])]
+    foods = {name: {"production_co2_per_kg": production_co2, "origins": [names[o] for o in origins],
+                    "destinations": {}}
+             for name, production_co2, origins in zip(foods_table["name"], foods_table["production_co2_per_kg"],
+                                                      food_origins)}
+
+    paths = {}
+    for destination in destination_ids:
+        best, previous = lowest_carbon_paths(graph, destination)
+        chosen = set()
+        for food, origins in zip(foods.values(), food_origins):
+            origin = min(origins, key=best.__getitem__)
+            chosen.add(origin)
+            food["destinations"][names[destination]] = {
+                "origin": names[origin],
+                "transport_co2_per_kg": round(best[origin], 4),
+                "total_co2_per_kg": round(food["production_co2_per_kg"] + best[origin], 3)
+            }
+        paths[names[destination]] = {
+            names[origin]: {"transport_co2_per_kg": round(best[origin], 4), "legs": _path_legs(names, previous, origin)}
+            for origin in sorted(chosen) if origin != destination
+        }
+    return {
+        "transport_factors": transport_factors,
+        "detour_factors": ROUTE_DETOUR_FACTORS,
+        "land_leg_max_km": LAND_LEG_MAX_KM,
+        "foods": foods,
+        # paths[目的地][产地]：被选中的最优路径的各段，产地为目的地本身时不需要运输
+        "paths": paths
+    }
+
+@instrumented(items=lambda result: result)
+def generate_optimal_sourcing(output_dir=OUTPUT_DATA_DIR, countries_data=None, destinations=None):
+    """读取已生成的路线和运输因子，写出 optimal_sourcing.json 查询表"""
+    with open(os.path.join(output_dir, NORMALIZED_ROUTES_FILE_NAME), 'r', encoding='utf-8') as f:
+        normalized_routes = json.load(f)
+    with open(os.path.join(output_dir, "transport_factors.json"), 'r', encoding='utf-8') as f:
+        transport_factors = json.load(f)
+    if countries_data is None:
+        countries_data = {c["name"]: {"lat": c["lat"], "lon": c["lon"]} for c in normalized_routes["countries"]}
+    sourcing = solve_optimal_sourcing(normalized_routes, transport_factors, countries_data, destinations)
+    file_path = os.path.join(output_dir, OPTIMAL_SOURCING_FILE_NAME)
+    with AtomicFile(file_path) as f:
+        json.dump(sourcing, f, ensure_ascii=False, separators=(",", ":"))
+    print(f"Generated {file_path} for {len(sourcing['foods'])} foods × {len(sourcing['paths'])} destinations")
+    return len(sourcing["foods"])
+
+def run_optimal_sourcing_stage(output_dir, incremental=False, destinations=None):
+    build = IncrementalBuild(output_dir) if incremental else None
+    inputs = {name: file_sha256(os.path.join(output_dir, name))
+              for name in (NORMALIZED_ROUTES_FILE_NAME, "transport_factors.json")}
+    inputs.update({"landmasses": COUNTRY_LANDMASSES, "landlocked": LANDLOCKED_COUNTRIES,
+                   "land_leg_max_km": LAND_LEG_MAX_KM, "detour_factors": ROUTE_DETOUR_FACTORS,
+                   "destinations": destinations})
+    run_build_stage(build, "optimal_sourcing", inputs,
+                    lambda: generate_optimal_sourcing(output_dir, destinations=destinations))
+
+# --- 规模模式：生成任意规模的合成数据集，逐条写出，内存占用与食物数量无关 ---
+def generate_scale_data(num_foods=SCALE_NUM_FOODS, num_countries=SCALE_NUM_COUNTRIES,
+                        origins_range=(NUM_ORIGINS_PER_FOOD_MIN, NUM_ORIGINS_PER_FOOD_MAX),
+                        destinations_range=(NUM_DESTINATIONS_PER_ORIGIN_MIN, NUM_DESTINATIONS_PER_ORIGIN_MAX),
+                        output_dir=SCALE_OUTPUT_DIR, output_format="ndjson", compact=True,
+                        seed=None, workers=1, shard_size=None, incremental=False, columnar=False,
+                        nutrient_rankings=False, diet_scenarios=False):
+    """生成 num_foods 个合成食物 × num_countries 个国家节点的压力测试数据集"""
+    os.makedirs(output_dir, exist_ok=True)
+    seed = resolve_master_seed(seed, workers)
+    inputs = {
+        "num_foods": num_foods, "num_countries": num_countries,
+        "origins_range": list(origins_range), "destinations_range": list(destinations_range),
+        "GENERATION_SHARD_SIZE": GENERATION_SHARD_SIZE,
+        "BASE_TRANSPORT_FACTORS": BASE_TRANSPORT_FACTORS, "CATEGORY_ATTRIBUTES": CATEGORY_ATTRIBUTES,
+        "NUTRIENT_DEFINITIONS": NUTRIENT_DEFINITIONS, "seed": seed,
+        "output": {"format": output_format, "compact": compact, "shard_size": shard_size, "columnar": columnar,
+                   "nutrient_rankings": nutrient_rankings, "diet_scenarios": diet_scenarios},
+    }
+    build = IncrementalBuild(output_dir) if incremental else None
+    run_build_stage(build, "scale", inputs,
+                    lambda: _generate_scale_datasets(num_foods, num_countries, origins_range, destinations_range,
+                                                     output_dir, output_format, compact, seed, workers, shard_size,
+                                                     columnar, nutrient_rankings, diet_scenarios))
+
+def _generate_scale_datasets(num_foods, num_countries, origins_range, destinations_range, output_dir,
+                             output_format, compact, seed, workers, shard_size, columnar, nutrient_rankings=False,
+                             diet_scenarios=False):
+    clear_distance_cache()
+
+    countries_data = make_synthetic_countries(num_countries)
+    # 预估路线数量，便于事先判断运行时间和输出大小
+    avg_origins = min(sum(origins_range) / 2, num_countries)
+    avg_dests = min(sum(destinations_range) / 2, max(num_countries - 1, 0))
+    print(f"Scale mode: {num_foods} foods × {len(countries_data)} countries, "
+          f"~{int(num_foods * avg_origins * avg_dests)} routes expected")
+
+    countries_file_path = os.path.join(output_dir, "countries.json")
+    with AtomicFile(countries_file_path) as f:
+        json.dump(countries_data, f, ensure_ascii=False)
+
+    transport_factors = generate_transport_factors(shard_rng(seed, "catalogue"))
+    write_transport_factors(transport_factors, output_dir)
+
+    start_time = time.perf_counter()
+    records = iter_sharded_food_records(iter_synthetic_food_names(num_foods), transport_factors, countries_data,
+                                        origins_range, destinations_range, seed=seed, workers=workers)
+    num_written, num_routes = write_fused_food_records(records, transport_factors, output_dir, output_format,
+                                                       compact, progress_total=num_foods, shard_size=shard_size,
+                                                       countries_data=countries_data, columnar=columnar,
+                                                       nutrient_rankings=nutrient_rankings,
+                                                       diet_scenarios=diet_scenarios)
+    elapsed = time.perf_counter() - start_time
+    print(f"Scale mode: {num_written} food items and {num_routes} routes in {elapsed:.1f}s.")
+
+# --- 大圆路径采样：球面插值，按弦误差容差决定点数，并输出多级细节 ---
+# 每一级的容差：折线与真实大圆弧（以及空运高度曲线）之间的最大偏差，单位为公里；第一级最精细
+PATH_LOD_TOLERANCES_KM = (1.0, 10.0, 100.0)
+AIR_ROUTE_HEIGHT = 0.1  # 空运路线中点的高度（地球半径的倍数），沿路线按 sin(πt) 变化
+MAX_PATH_SEGMENTS = 4096
+
+def _lat_lon_to_ecef(lat, lon):
+    lat_r, lon_r = math.radians(lat), math.radians(lon)
+    return (math.cos(lat_r) * math.cos(lon_r), math.cos(lat_r) * math.sin(lon_r), math.sin(lat_r))
+
+def _ecef_to_lat_lon(x, y, z):
+    return math.degrees(math.atan2(z, math.hypot(x, y))), math.degrees(math.atan2(y, x))
+
+def path_segment_count(central_angle, tolerance_km, height=0.0):
+    """满足容差所需的最少线段数
+
+    弦与大圆弧的最大偏差为 R(1 - cos(δ/2))，δ 为每段的圆心角；
+    高度曲线 h·sin(πt) 用折线近似的最大偏差约为 h·R·π²Δt²/8。
+    """
+    tolerance = tolerance_km / EARTH_RADIUS_KM
+    max_segment_angle = 2 * math.acos(max(1 - tolerance, -1.0))
+    segments = math.ceil(central_angle / max_segment_angle) if central_angle > 0 else 1
+    if height > 0:
+        segments = max(segments, math.ceil(math.pi * math.sqrt(height / (8 * tolerance))))
+    return min(max(segments, 1), MAX_PATH_SEGMENTS)
+
+def great_circle_path(start, end, num_segments, height=0.0):
+    """在 start 和 end（含 lat/lon 的 dict）之间按球面线性插值 (slerp) 取 num_segments + 1 个等角距点
+
+    slerp 写成 cos(θt)·a + sin(θt)·u，u 为大圆平面内与 a 垂直的单位向量。
+    """
+    a = _lat_lon_to_ecef(start["lat"], start["lon"])
+    b = _lat_lon_to_ecef(end["lat"], end["lon"])
+    dot = max(-1.0, min(1.0, sum(p * q for p, q in zip(a, b))))
+    angle = math.acos(dot)
+    u = tuple(q - dot * p for p, q in zip(a, b))
+    norm = math.sqrt(sum(c * c for c in u))
+    if norm < 1e-12:
+        # 两点重合或几乎相对，大圆不唯一：任取一个与 a 垂直的方向
+        axis = (0.0, 0.0, 1.0) if abs(a[2]) < 0.9 else (1.0, 0.0, 0.0)
+        u = (axis[1] * a[2] - axis[2] * a[1], axis[2] * a[0] - axis[0] * a[2], axis[0] * a[1] - axis[1] * a[0])
+        norm = math.sqrt(sum(c * c for c in u))
+    u = tuple(c / norm for c in u)
+
+    points = []
+    for i in range(num_segments + 1):
+        t = i / num_segments
+        cos_t, sin_t = math.cos(angle * t), math.sin(angle * t)
+        lat, lon = _ecef_to_lat_lon(*(cos_t * p + sin_t * q for p, q in zip(a, u)))
+        points.append({
+            "lat": round(lat, 5),
+            "lon": round(lon, 5),
+            "height": round(math.sin(t * math.pi) * height, 5),
+            "progress": round(t, 5)
+        })
+    return points
+
+def great_circle_lod_paths(start, end, height=0.0, tolerances_km=PATH_LOD_TOLERANCES_KM):
+    """按 tolerances_km 中的每个容差各采样一次，返回 [{"tolerance_km", "path"}]，顺序与容差相同"""
+    central_angle = haversine_pairs([start], [end])[0] / EARTH_RADIUS_KM
+    return [
+        {"tolerance_km": tolerance,
+         "path": great_circle_path(start, end, path_segment_count(central_angle, tolerance, height), height)}
+        for tolerance in tolerances_km
+    ]
 
 # 添加新的数据生成功能
 
-def generate_3d_earth_data():
+@instrumented(items=lambda result: len(result["transport_paths"]) + len(result["real_time_vessels"]))
+def generate_3d_earth_data(rng=random, num_vessels=NUM_VESSELS):
     """生成3D地球可视化所需的数据"""
     earth_data = {
         "transport_paths": [],
@@ -313,53 +2409,45 @@ def generate_3d_earth_data():
          "mode": "ship", "goods": "咖啡豆", "carbon_intensity": 0.008}
     ]
     
-    for route in major_routes:
-        # 生成曲线路径点
-        num_points = 50
-        path_points = []
-        for i in range(num_points):
-            t = i / (num_points - 1)
-            # 使用贝塞尔曲线生成平滑路径
-            lat = route["from"]["lat"] * (1-t) + route["to"]["lat"] * t
-            lon = route["from"]["lon"] * (1-t) + route["to"]["lon"] * t
-            # 添加高度变化（模拟飞行或航行）
-            height = math.sin(t * math.pi) * 0.1 if route["mode"] == "air" else 0
-            path_points.append({
-                "lat": lat,
-                "lon": lon,
-                "height": height,
-                "progress": t
-            })
-        
+    # 一次批量计算所有主要航线的距离
+    route_distances = haversine_pairs([r["from"] for r in major_routes], [r["to"] for r in major_routes])
+
+    for route, route_distance in zip(major_routes, route_distances):
+        # 沿大圆弧自适应采样，空运路线叠加飞行高度；path 为最精细的一级，lod 中依次为更粗的级别
+        height_profile = AIR_ROUTE_HEIGHT if route["mode"] == "air" else 0.0
+        tiers = great_circle_lod_paths(route["from"], route["to"], height_profile)
+        path_points = tiers[0]["path"]
         earth_data["transport_paths"].append({
             "id": f"route_{len(earth_data['transport_paths'])}",
             "from": route["from"],
             "to": route["to"],
             "path": path_points,
+            "lod": tiers[1:],
             "mode": route["mode"],
             "goods": route["goods"],
             "carbon_per_km": route["carbon_intensity"],
-            "total_distance": calculate_distance(route["from"], route["to"]),
-            "animation_duration": random.randint(5000, 15000)  # 毫秒
+            "total_distance": route_distance,
+            "animation_duration": rng.randint(5000, 15000)  # 毫秒
         })
     
     # 生成实时运输工具位置
-    for i in range(20):
+    for i in range(num_vessels):
         earth_data["real_time_vessels"].append({
             "id": f"vessel_{i}",
-            "type": random.choice(["cargo_ship", "airplane", "truck"]),
+            "type": rng.choice(["cargo_ship", "airplane", "truck"]),
             "position": {
-                "lat": random.uniform(-90, 90),
-                "lon": random.uniform(-180, 180)
+                "lat": rng.uniform(-90, 90),
+                "lon": rng.uniform(-180, 180)
             },
-            "heading": random.uniform(0, 360),
-            "speed": random.uniform(10, 50),  # km/h
-            "cargo": random.choice(["水果", "蔬菜", "肉类", "谷物"]),
-            "carbon_rate": random.uniform(0.01, 0.5)
+            "heading": rng.uniform(0, 360),
+            "speed": rng.uniform(10, 50),  # km/h
+            "cargo": rng.choice(["水果", "蔬菜", "肉类", "谷物"]),
+            "carbon_rate": rng.uniform(0.01, 0.5)
         })
     
     return earth_data
 
+@instrumented(items=lambda result: len(result["historical_data"]) + len(result["future_projections"]))
 def generate_timeline_data():
     """生成时间线数据，展示饮食碳足迹的历史变化"""
     timeline_data = {
@@ -437,57 +2525,180 @@ def generate_timeline_data():
     
     return timeline_data
 
-def generate_global_heatmap_data():
-    """生成全球饮食碳足迹热力图数据"""
-    countries_data = []
-    
-    # 主要国家和地区的数据
-    country_profiles = [
-        {"code": "CHN", "name": "中国", "lat": 35.8617, "lon": 104.1954, 
-         "diet_profile": {"meat": 60, "plant": 40}, "trend": "increasing"},
-        {"code": "USA", "name": "美国", "lat": 37.0902, "lon": -95.7129, 
-         "diet_profile": {"meat": 80, "plant": 20}, "trend": "stable"},
-        {"code": "IND", "name": "印度", "lat": 20.5937, "lon": 78.9629, 
-         "diet_profile": {"meat": 20, "plant": 80}, "trend": "stable"},
-        {"code": "BRA", "name": "巴西", "lat": -14.2350, "lon": -51.9253, 
-         "diet_profile": {"meat": 70, "plant": 30}, "trend": "increasing"},
-        {"code": "DEU", "name": "德国", "lat": 51.1657, "lon": 10.4515, 
-         "diet_profile": {"meat": 60, "plant": 40}, "trend": "decreasing"}
+# --- 时间线情景集合：对 (情景 × 时间步 × 饮食类型) 广播计算逐年/逐月预测，输出分位带和可选的完整集合 ---
+TIMELINE_ENSEMBLE_STEM = "timeline_ensemble"
+TIMELINE_ENSEMBLE_SCENARIOS = 10000
+TIMELINE_ENSEMBLE_BATCH_SIZE = 2048  # 每批计算的情景数，限制 (批大小 × 时间步 × 饮食类型) 临时数组的内存
+TIMELINE_ENSEMBLE_YEARS = (2025, 2050)
+TIMELINE_ENSEMBLE_PERCENTILES = (5, 25, 50, 75, 95)
+TIMELINE_RESOLUTIONS = {"yearly": 1, "monthly": 12}
+# 情景参数及其抽样范围：与 future_projections 相同，碳排放降幅和植物性饮食增长随年数线性累积，人口按年复合增长
+TIMELINE_SCENARIO_PARAMETERS = {
+    "carbon_reduction_rate": (-0.01, 0.02),    # 每年降低的碳排放强度比例
+    "plant_based_growth_rate": (0.1, 0.5),     # 每年从高肉/均衡饮食转向素食/纯素的百分点
+    "population_growth_rate": (0.0, 0.01),
+}
+# generate_timeline_data() 中三种固定情景的参数，作为参考曲线一并计算
+TIMELINE_REFERENCE_SCENARIOS = {
+    "optimistic": (0.02, 0.5, 0.005),
+    "neutral": (0.01, 0.3, 0.005),
+    "pessimistic": (-0.01, 0.1, 0.005),
+}
+
+def _project_timeline(params, years_ahead, base_shares, base_carbon, base_population):
+    """对一批情景参数 (S, 3) 计算各时间步的饮食结构和碳排放
+
+    返回 (shares, diet_carbon, carbon_per_capita, total_emissions_gt)，形状分别为
+    (S, T, D)、(S, T, D)、(S, T)、(S, T)；diet_carbon 为各饮食类型对人均碳足迹的贡献（占比 × 强度）。
+    """
+    reduction, growth, population_growth = (params[:, k, None] for k in range(3))
+    t = years_ahead[None, :]
+    # 转向的百分点从高肉和均衡饮食中按当前占比扣除，平分给素食和纯素，不会扣成负数
+    shifting = base_shares[0] + base_shares[1]
+    shifted = np.minimum(growth * t, shifting)[:, :, None]
+    shares = base_shares + shifted * np.array([-base_shares[0] / shifting, -base_shares[1] / shifting, 0.5, 0.5])
+    intensity = base_carbon * np.maximum(1 - reduction * t, 0)[:, :, None]
+    diet_carbon = shares / 100 * intensity
+    carbon_per_capita = diet_carbon.sum(axis=2)
+    population = base_population * (1 + population_growth) ** t
+    return shares, diet_carbon, carbon_per_capita, carbon_per_capita * population / 1e9
+
+@instrumented(items=lambda result: result)
+def generate_timeline_ensemble(output_dir=OUTPUT_DATA_DIR, num_scenarios=TIMELINE_ENSEMBLE_SCENARIOS,
+                               resolution="yearly", full=False, seed=None):
+    """写出 timeline_ensemble.bin / .bin.json，返回 情景数 × 时间步数
+
+    以 timeline_data.json 最后一个历史年份的饮食结构、各饮食类型碳排放和人口为起点，
+    在 TIMELINE_SCENARIO_PARAMETERS 的范围内均匀抽取 num_scenarios 组参数。各 *_bands 属性按
+    (分位数, [饮食类型,] 时间步) 排列，每行是一条时间序列；full=True 时另外写出每个情景的参数和序列。
+    """
+    _require_numpy("timeline scenario ensemble")
+    baseline = generate_timeline_data()["historical_data"][-1]
+    diet_types = list(baseline["diet_types"])
+    shares = np.array([baseline["diet_types"][d]["percentage"] for d in diet_types], dtype=float)
+    base_shares = shares / shares.sum() * 100
+    base_carbon = np.array([baseline["diet_types"][d]["carbon"] for d in diet_types])
+    base_population = baseline["global_average"]["population"]
+
+    steps_per_year = TIMELINE_RESOLUTIONS[resolution]
+    first_year, last_year = TIMELINE_ENSEMBLE_YEARS
+    times = np.arange(first_year * steps_per_year, last_year * steps_per_year + 1) / steps_per_year
+    years_ahead = times - 2024  # 与 future_projections 的 years_ahead 相同
+
+    rng = np.random.default_rng(None if seed is None else derive_seed(seed, "timeline_ensemble"))
+    low, high = np.array(list(TIMELINE_SCENARIO_PARAMETERS.values())).T
+    params = low + (high - low) * rng.random((num_scenarios, len(low)))
+
+    # 情景放在最后一维，求分位数时沿连续内存做 partition
+    num_steps = len(times)
+    carbon_per_capita = np.empty((num_steps, num_scenarios), dtype=np.float32)
+    total_emissions = np.empty((num_steps, num_scenarios), dtype=np.float32)
+    diet_shares = np.empty((len(diet_types), num_steps, num_scenarios), dtype=np.float32)
+    diet_carbon = np.empty((len(diet_types), num_steps, num_scenarios), dtype=np.float32)
+    for start in range(0, num_scenarios, TIMELINE_ENSEMBLE_BATCH_SIZE):
+        batch = slice(start, start + TIMELINE_ENSEMBLE_BATCH_SIZE)
+        shares, carbon, batch_carbon, batch_emissions = _project_timeline(
+            params[batch], years_ahead, base_shares, base_carbon, base_population)
+        carbon_per_capita[:, batch] = batch_carbon.T
+        total_emissions[:, batch] = batch_emissions.T
+        diet_shares[:, :, batch] = shares.transpose(2, 1, 0)
+        diet_carbon[:, :, batch] = carbon.transpose(2, 1, 0)
+
+    reference_params = np.array(list(TIMELINE_REFERENCE_SCENARIOS.values()))
+    _, _, reference_carbon, reference_emissions = _project_timeline(
+        reference_params, years_ahead, base_shares, base_carbon, base_population)
+
+    percentiles = list(TIMELINE_ENSEMBLE_PERCENTILES)
+    attributes = [
+        ("carbon_per_capita_bands", "float32", num_steps, np.percentile(carbon_per_capita, percentiles, axis=-1)),
+        ("total_emissions_bands", "float32", num_steps, np.percentile(total_emissions, percentiles, axis=-1)),
+        ("diet_share_bands", "float32", num_steps, np.percentile(diet_shares, percentiles, axis=-1)),
+        ("diet_carbon_bands", "float32", num_steps, np.percentile(diet_carbon, percentiles, axis=-1)),
+        ("reference_carbon_per_capita", "float32", num_steps, reference_carbon),
+        ("reference_total_emissions", "float32", num_steps, reference_emissions),
     ]
+    if full:
+        attributes += [
+            ("parameters", "float32", len(low), params),
+            ("carbon_per_capita", "float32", num_steps, carbon_per_capita.T),
+            ("total_emissions", "float32", num_steps, total_emissions.T),
+        ]
+    write_columnar_export(TIMELINE_ENSEMBLE_STEM, attributes, output_dir, meta={
+        "resolution": resolution,
+        "steps_per_year": steps_per_year,
+        "start": first_year,
+        "end": last_year,
+        "num_steps": num_steps,
+        "num_scenarios": num_scenarios,
+        "percentiles": percentiles,
+        "diet_types": diet_types,
+        "parameters": {name: list(bounds) for name, bounds in TIMELINE_SCENARIO_PARAMETERS.items()},
+        "reference_scenarios": list(TIMELINE_REFERENCE_SCENARIOS),
+        "baseline": {"year": baseline["year"], "diet_shares": dict(zip(diet_types, base_shares.round(3).tolist())),
+                     "population": base_population},
+        "units": {"carbon_per_capita": "吨CO2/人/年", "total_emissions": "十亿吨CO2/年", "diet_share": "%"},
+        "full_ensemble": full,
+    })
+    print(f"Projected {num_scenarios} timeline scenarios over {num_steps} {resolution} steps")
+    return num_scenarios * num_steps
+
+# 主要国家和地区的数据
+HEATMAP_COUNTRY_PROFILES = [
+    {"code": "CHN", "name": "中国", "lat": 35.8617, "lon": 104.1954, 
+     "diet_profile": {"meat": 60, "plant": 40}, "trend": "increasing"},
+    {"code": "USA", "name": "美国", "lat": 37.0902, "lon": -95.7129, 
+     "diet_profile": {"meat": 80, "plant": 20}, "trend": "stable"},
+    {"code": "IND", "name": "印度", "lat": 20.5937, "lon": 78.9629, 
+     "diet_profile": {"meat": 20, "plant": 80}, "trend": "stable"},
+    {"code": "BRA", "name": "巴西", "lat": -14.2350, "lon": -51.9253, 
+     "diet_profile": {"meat": 70, "plant": 30}, "trend": "increasing"},
+    {"code": "DEU", "name": "德国", "lat": 51.1657, "lon": 10.4515, 
+     "diet_profile": {"meat": 60, "plant": 40}, "trend": "decreasing"}
+]
+
+def _generate_heatmap_country(task):
+    """生成单个国家的热力图条目，每个国家使用各自的分片随机数"""
+    country_index, country, seed = task
+    rng = shard_rng(seed, "heatmap", country_index)
+
+    # 计算碳足迹
+    meat_carbon = country["diet_profile"]["meat"] * 0.027  # kg CO2/kg
+    plant_carbon = country["diet_profile"]["plant"] * 0.002
+    total_carbon = meat_carbon + plant_carbon
     
-    for country in country_profiles:
-        # 计算碳足迹
-        meat_carbon = country["diet_profile"]["meat"] * 0.027  # kg CO2/kg
-        plant_carbon = country["diet_profile"]["plant"] * 0.002
-        total_carbon = meat_carbon + plant_carbon
+    # 生成历史数据
+    historical = []
+    for year in range(2010, 2025):
+        yearly_carbon = total_carbon + rng.uniform(-0.5, 0.5)
+        if country["trend"] == "increasing":
+            yearly_carbon += (year - 2010) * 0.05
+        elif country["trend"] == "decreasing":
+            yearly_carbon -= (year - 2010) * 0.03
         
-        # 生成历史数据
-        historical = []
-        for year in range(2010, 2025):
-            yearly_carbon = total_carbon + random.uniform(-0.5, 0.5)
-            if country["trend"] == "increasing":
-                yearly_carbon += (year - 2010) * 0.05
-            elif country["trend"] == "decreasing":
-                yearly_carbon -= (year - 2010) * 0.03
-            
-            historical.append({
-                "year": year,
-                "carbon_per_capita": yearly_carbon,
-                "meat_percentage": country["diet_profile"]["meat"] + random.uniform(-5, 5)
-            })
-        
-        countries_data.append({
-            "country_code": country["code"],
-            "country_name": country["name"],
-            "coordinates": {"lat": country["lat"], "lon": country["lon"]},
-            "current_carbon_footprint": total_carbon,
-            "diet_composition": country["diet_profile"],
-            "trend": country["trend"],
-            "historical_data": historical,
-            "population": random.randint(10000000, 1400000000),
-            "urbanization_rate": random.uniform(0.3, 0.9)
+        historical.append({
+            "year": year,
+            "carbon_per_capita": yearly_carbon,
+            "meat_percentage": country["diet_profile"]["meat"] + rng.uniform(-5, 5)
         })
     
+    return {
+        "country_code": country["code"],
+        "country_name": country["name"],
+        "coordinates": {"lat": country["lat"], "lon": country["lon"]},
+        "current_carbon_footprint": total_carbon,
+        "diet_composition": country["diet_profile"],
+        "trend": country["trend"],
+        "historical_data": historical,
+        "population": rng.randint(10000000, 1400000000),
+        "urbanization_rate": rng.uniform(0.3, 0.9)
+    }
+
+@instrumented(items=lambda result: len(result["countries"]))
+def generate_global_heatmap_data(seed=None, workers=1):
+    """生成全球饮食碳足迹热力图数据"""
+    tasks = [(i, country, seed) for i, country in enumerate(HEATMAP_COUNTRY_PROFILES)]
+    countries_data = list(iter_parallel_shards(_generate_heatmap_country, tasks, workers))
+    
     return {
         "countries": countries_data,
         "global_statistics": {
@@ -502,77 +2713,901 @@ def generate_global_heatmap_data():
         }
     }
 
-def generate_particle_system_data():
-    """生成粒子系统数据，用于展示食物浪费等效果"""
-    particle_data = {
-        "waste_particles": [],
-        "emission_particles": [],
-        "savings_particles": []
+# --- 热力图瓦片金字塔：国家下的合成区域按 Web 墨卡托瓦片 (z, x, y) 逐级聚合，前端只需加载可见瓦片 ---
+HEATMAP_TILES_STEM = "heatmap_tiles"
+HEATMAP_TILE_MAX_ZOOM = 6  # 与 global_heatmap.js 中地图的 maxZoom 相同
+HEATMAP_TILE_BINS = 16  # 每个瓦片每边的格子数
+HEATMAP_REGIONS_PER_COUNTRY = 64
+HEATMAP_REGION_SPREAD_DEG = 6.0  # 合成区域围绕国家中心点分布的标准差（度）
+HEATMAP_REGION_FACTOR_RANGE = (0.7, 1.3)  # 区域人均碳足迹相对国家水平的倍数
+WEB_MERCATOR_MAX_LAT = 85.05112878
+
+# GeoJSON 要素名称（world.geojson 的 properties.name）到国家代码的对应关系，生成时预先算好，前端无需再匹配
+HEATMAP_FEATURE_NAMES = {
+    "CHN": ["China"],
+    "USA": ["United States", "United States of America", "USA"],
+    "IND": ["India"],
+    "BRA": ["Brazil"],
+    "DEU": ["Germany"],
+}
+
+def _web_mercator_unit(lat, lon):
+    """经纬度 -> [0, 1) 范围内的 Web 墨卡托坐标 (x 向东, y 向南)，与 Leaflet 瓦片编号一致"""
+    lat = max(-WEB_MERCATOR_MAX_LAT, min(WEB_MERCATOR_MAX_LAT, lat))
+    x = (lon + 180.0) / 360.0 % 1.0
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0
+    return x, y
+
+def generate_heatmap_regions(heatmap_data, seed=None, regions_per_country=HEATMAP_REGIONS_PER_COUNTRY):
+    """在每个国家中心点周围生成合成的次国家级区域
+
+    各区域的人口之和等于国家人口，逐年人均碳足迹为国家当年的数值乘以区域自身的倍数。
+    """
+    regions = []
+    for country_index, country in enumerate(heatmap_data["countries"]):
+        rng = shard_rng(seed, "heatmap_regions", country_index)
+        weights = [rng.expovariate(1.0) for _ in range(regions_per_country)]
+        total_weight = sum(weights)
+        center = country["coordinates"]
+        for i, weight in enumerate(weights):
+            lat = max(-WEB_MERCATOR_MAX_LAT,
+                      min(WEB_MERCATOR_MAX_LAT, center["lat"] + rng.gauss(0, HEATMAP_REGION_SPREAD_DEG)))
+            lon = (center["lon"] + rng.gauss(0, HEATMAP_REGION_SPREAD_DEG) + 180.0) % 360.0 - 180.0
+            factor = rng.uniform(*HEATMAP_REGION_FACTOR_RANGE)
+            regions.append({
+                "id": f"{country['country_code']}-{i:04d}",
+                "country_code": country["country_code"],
+                "lat": lat,
+                "lon": lon,
+                "population": max(1, round(country["population"] * weight / total_weight)),
+                "carbon_per_capita": [entry["carbon_per_capita"] * factor for entry in country["historical_data"]]
+            })
+    return regions
+
+def build_heatmap_pyramid(regions, num_years, max_zoom=HEATMAP_TILE_MAX_ZOOM, bins=HEATMAP_TILE_BINS):
+    """把区域分箱到最细一级的格网，再逐级把 2×2 个格子合并到上一级
+
+    返回 levels，levels[z] 为 {(全局格子 x, 全局格子 y): [人口, 区域数, 各年份人口加权碳足迹之和...]}；
+    第 z 级的格网每边有 2^z * bins 个格子。
+    """
+    size = (1 << max_zoom) * bins
+    finest = {}
+    for region in regions:
+        x, y = _web_mercator_unit(region["lat"], region["lon"])
+        key = (min(int(x * size), size - 1), min(int(y * size), size - 1))
+        cell = finest.get(key)
+        if cell is None:
+            cell = finest[key] = [0, 0] + [0.0] * num_years
+        population = region["population"]
+        cell[0] += population
+        cell[1] += 1
+        for k, value in enumerate(region["carbon_per_capita"]):
+            cell[2 + k] += value * population
+
+    levels = [finest]
+    for _ in range(max_zoom):
+        parent = {}
+        for (gx, gy), cell in levels[-1].items():
+            key = (gx >> 1, gy >> 1)
+            target = parent.get(key)
+            if target is None:
+                parent[key] = list(cell)
+            else:
+                for k, value in enumerate(cell):
+                    target[k] += value
+        levels.append(parent)
+    levels.reverse()
+    return levels
+
+def _heatmap_tiles(level, bins):
+    """把一级格网按瓦片分组：{(瓦片 x, 瓦片 y): [(瓦片内格子下标, 格子), ...]}"""
+    tiles = {}
+    for (gx, gy), cell in sorted(level.items(), key=lambda item: (item[0][1], item[0][0])):
+        tiles.setdefault((gx // bins, gy // bins), []).append(((gy % bins) * bins + gx % bins, cell))
+    return tiles
+
+@instrumented(items=lambda result: result)
+def write_heatmap_tiles(heatmap_data, output_dir=OUTPUT_DATA_DIR, seed=None,
+                        regions_per_country=HEATMAP_REGIONS_PER_COUNTRY,
+                        max_zoom=HEATMAP_TILE_MAX_ZOOM, bins=HEATMAP_TILE_BINS, tiles=True):
+    """写出 heatmap_tiles/{z}/{x}/{y}.json 瓦片和索引 heatmap_tiles.json，返回写出的瓦片数
+
+    每个瓦片只列出有数据的格子：cells 为格子在瓦片内的下标 (行 * bins + 列)，carbon_per_capita[i][k] 为第 i 个格子
+    在 years[k] 年的人口加权人均碳足迹。索引给出各级的瓦片列表和逐年数值范围、各国逐年数值，
+    以及 GeoJSON 要素名称到国家代码的对应关系（feature_join）。
+    tiles=False 时不生成区域和瓦片，只写出索引中与瓦片无关的部分（页面只用到 feature_join），并删除旧的瓦片目录。
+    """
+    countries = heatmap_data["countries"]
+    years = [entry["year"] for entry in countries[0]["historical_data"]] if countries else []
+    regions = generate_heatmap_regions(heatmap_data, seed, regions_per_country) if tiles else []
+    levels = build_heatmap_pyramid(regions, len(years), max_zoom, bins) if tiles else []
+
+    tiles_dir = os.path.join(output_dir, HEATMAP_TILES_STEM)
+    if os.path.exists(tiles_dir):
+        shutil.rmtree(tiles_dir)
+
+    zooms = []
+    num_tiles = 0
+    for z, level in enumerate(levels):
+        carbon_range = [[math.inf, -math.inf] for _ in years]
+        tile_keys = []
+        for (x, y), cells in _heatmap_tiles(level, bins).items():
+            carbon = []
+            for _, cell in cells:
+                values = [round(total / cell[0], 3) for total in cell[2:]]
+                for k, value in enumerate(values):
+                    carbon_range[k][0] = min(carbon_range[k][0], value)
+                    carbon_range[k][1] = max(carbon_range[k][1], value)
+                carbon.append(values)
+            tile = {
+                "z": z, "x": x, "y": y, "bins": bins,
+                "cells": [index for index, _ in cells],
+                "population": [cell[0] for _, cell in cells],
+                "regions": [cell[1] for _, cell in cells],
+                "carbon_per_capita": carbon
+            }
+            tile_path = os.path.join(tiles_dir, str(z), str(x), f"{y}.json")
+            os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+            with AtomicFile(tile_path) as f:
+                json.dump(tile, f, ensure_ascii=False, separators=(",", ":"))
+            tile_keys.append([x, y])
+        num_tiles += len(tile_keys)
+        zooms.append({"z": z, "tiles": tile_keys, "cells": len(level),
+                      "carbon_range": [r if r[0] <= r[1] else None for r in carbon_range]})
+
+    feature_join = {}
+    for country in countries:
+        code = country["country_code"]
+        for name in [code, country["country_name"]] + HEATMAP_FEATURE_NAMES.get(code, []):
+            feature_join[name] = code
+    index = {
+        "tile_url": f"{HEATMAP_TILES_STEM}/{{z}}/{{x}}/{{y}}.json",
+        "projection": "web_mercator",
+        "min_zoom": 0,
+        "max_zoom": max_zoom,
+        "bins": bins,
+        "years": years,
+        "num_regions": len(regions),
+        "zooms": zooms,
+        "feature_join": feature_join,
+        "countries": {
+            country["country_code"]: {
+                "name": country["country_name"],
+                "coordinates": country["coordinates"],
+                "population": country["population"],
+                "carbon_per_capita": [round(entry["carbon_per_capita"], 3) for entry in country["historical_data"]]
+            }
+            for country in countries
+        },
+        "color_scale": heatmap_data["color_scale"]
     }
-    
-    # 浪费粒子
+    if not tiles:
+        for key in ("tile_url", "projection", "min_zoom", "max_zoom", "bins", "num_regions", "zooms"):
+            del index[key]
+    with AtomicFile(os.path.join(output_dir, f"{HEATMAP_TILES_STEM}.json")) as f:
+        json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+    if tiles:
+        print(f"Generated {num_tiles} heatmap tiles for {len(regions)} regions under {tiles_dir}")
+    else:
+        print(f"Generated {os.path.join(output_dir, HEATMAP_TILES_STEM)}.json (tiles skipped, see --heatmap-tiles)")
+    return num_tiles
+
+def _generate_particle_shard(task):
+    """生成一个分片的浪费粒子，粒子 id 从 start 开始连续编号"""
+    shard_index, start, count, seed = task
+    rng = shard_rng(seed, "particles", shard_index)
     food_types = ["苹果", "面包", "牛奶", "蔬菜", "肉类"]
-    for i in range(100):
-        particle_data["waste_particles"].append({
+    particles = []
+    for i in range(start, start + count):
+        particles.append({
             "id": i,
-            "type": random.choice(food_types),
-            "size": random.uniform(0.5, 2.0),
+            "type": rng.choice(food_types),
+            "size": rng.uniform(0.5, 2.0),
             "initial_position": {
-                "x": random.uniform(-50, 50),
-                "y": random.uniform(0, 100),
-                "z": random.uniform(-50, 50)
+                "x": rng.uniform(-50, 50),
+                "y": rng.uniform(0, 100),
+                "z": rng.uniform(-50, 50)
             },
             "velocity": {
-                "x": random.uniform(-1, 1),
-                "y": random.uniform(-2, -0.5),
-                "z": random.uniform(-1, 1)
+                "x": rng.uniform(-1, 1),
+                "y": rng.uniform(-2, -0.5),
+                "z": rng.uniform(-1, 1)
             },
-            "carbon_value": random.uniform(0.1, 5.0),
-            "lifetime": random.uniform(3000, 8000)  # 毫秒
+            "carbon_value": rng.uniform(0.1, 5.0),
+            "lifetime": rng.uniform(3000, 8000)  # 毫秒
         })
+    return particles
+
+@instrumented(items=lambda result: len(result["waste_particles"]))
+def generate_particle_system_data(num_particles=NUM_PARTICLES, seed=None, workers=1):
+    """生成粒子系统数据，用于展示食物浪费等效果"""
+    particle_data = {
+        "waste_particles": [],
+        "emission_particles": [],
+        "savings_particles": []
+    }
+    
+    # 浪费粒子
+    tasks = [
+        (shard_index, start, min(PARTICLE_SHARD_SIZE, num_particles - start), seed)
+        for shard_index, start in enumerate(range(0, num_particles, PARTICLE_SHARD_SIZE))
+    ]
+    for particles in iter_parallel_shards(_generate_particle_shard, tasks, workers):
+        particle_data["waste_particles"].extend(particles)
     
     return particle_data
 
 def calculate_distance(coord1, coord2):
     """计算两个坐标之间的距离（公里）"""
-    R = 6371  # 地球半径
-    lat1, lon1 = math.radians(coord1["lat"]), math.radians(coord1["lon"])
-    lat2, lon2 = math.radians(coord2["lat"]), math.radians(coord2["lon"])
-    
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    
-    return R * c
+    return haversine_pairs([coord1], [coord2])[0]
+
+# --- 列式二进制导出：小端 float32/uint32 平铺数组 + JSON 头，可直接作为 Three.js BufferGeometry 属性上传 ---
+COLUMNAR_TYPECODES = {"float32": "f", "uint32": "I"}
+COLUMNAR_ITEM_BYTES = 4
+
+def _little_endian_array(dtype, values):
+    if np is not None and isinstance(values, np.ndarray):
+        # numpy 数组直接按小端转换，避免逐元素构造 array
+        return np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder("<")).ravel()
+    arr = array(COLUMNAR_TYPECODES[dtype], values)
+    if arr.itemsize != COLUMNAR_ITEM_BYTES:
+        raise RuntimeError(f"array typecode for {dtype} is {arr.itemsize} bytes on this platform, "
+                           f"expected {COLUMNAR_ITEM_BYTES}")
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr
+
+@instrumented()
+def write_columnar_export(stem, attributes, output_dir=OUTPUT_DATA_DIR, meta=None):
+    """写出 <stem>.bin 和描述它的 <stem>.bin.json
+
+    attributes 为 (名称, dtype, 每个元素的分量数, 平铺后的数值序列) 的列表；各属性在二进制文件中依次连续存放，
+    头文件记录每个属性的 byte_offset / byte_length / count / item_size，前端可用
+    new Float32Array(buffer, byte_offset, count * item_size) 零拷贝地取出。
+    """
+    bin_file_name = f"{stem}.bin"
+    header = {"binary": bin_file_name, "byte_order": "little", "attributes": {}}
+    header.update(meta or {})
+    offset = 0
+    with AtomicFile(os.path.join(output_dir, bin_file_name), 'wb') as f:
+        for name, dtype, item_size, values in attributes:
+            if isinstance(values, ColumnSpool):
+                # 已经落盘的列直接复制，不读回内存
+                byte_length = values.copy_binary(f)
+                count = values.count // item_size
+            else:
+                data = _little_endian_array(dtype, values).tobytes()
+                f.write(data)
+                byte_length = len(data)
+                count = byte_length // COLUMNAR_ITEM_BYTES // item_size
+            header["attributes"][name] = {
+                "dtype": dtype,
+                "item_size": item_size,
+                "count": count,
+                "byte_offset": offset,
+                "byte_length": byte_length
+            }
+            offset += byte_length
+    # meta 中的 ColumnSpool（如食物名列表）以 JSON 数组的形式从磁盘拼接到头文件末尾
+    spooled = {key: value for key, value in header.items() if isinstance(value, ColumnSpool)}
+    with AtomicFile(os.path.join(output_dir, f"{bin_file_name}.json")) as f:
+        text = json.dumps({key: value for key, value in header.items() if key not in spooled},
+                          ensure_ascii=False, separators=(",", ":"))
+        f.write(text[:-1])
+        for key, spool in spooled.items():
+            f.write(f",{_json_string(key)}:[")
+            spool.copy_text(f)
+            f.write("]")
+        f.write("}")
+    print(f"Generated {os.path.join(output_dir, bin_file_name)} ({offset} bytes)")
+
+def lat_lon_to_unit_vector(lat, lon, radius=1.0):
+    """与 food_explorer_3d.js 中 latLonToVector3 相同的坐标约定（y 轴朝北极）"""
+    phi = math.radians(90 - lat)
+    theta = math.radians(lon + 180)
+    return (-radius * math.sin(phi) * math.cos(theta),
+            radius * math.cos(phi),
+            radius * math.sin(phi) * math.sin(theta))
+
+def _label_ids(values):
+    """把字符串列编码为按首次出现顺序编号的整数 id，返回 (id 列表, 标签表)"""
+    labels = {}
+    ids = [labels.setdefault(value, len(labels)) for value in values]
+    return ids, list(labels)
+
+def export_particle_columns(particle_data, output_dir=OUTPUT_DATA_DIR):
+    particles = particle_data["waste_particles"]
+    type_ids, type_labels = _label_ids(p["type"] for p in particles)
+    chain = itertools.chain.from_iterable
+    write_columnar_export("particle_system_data", [
+        ("position", "float32", 3, chain((p["initial_position"]["x"], p["initial_position"]["y"],
+                                          p["initial_position"]["z"]) for p in particles)),
+        ("velocity", "float32", 3, chain((p["velocity"]["x"], p["velocity"]["y"], p["velocity"]["z"])
+                                         for p in particles)),
+        ("size", "float32", 1, (p["size"] for p in particles)),
+        ("carbon_value", "float32", 1, (p["carbon_value"] for p in particles)),
+        ("lifetime", "float32", 1, (p["lifetime"] for p in particles)),
+        ("type", "uint32", 1, type_ids),
+    ], output_dir, meta={"count": len(particles), "type_labels": type_labels})
+
+def _flatten_path_points(path_lists):
+    """把若干条路径的点依次平铺，返回 (点列表, [起始点下标, 点数, ...])"""
+    points = []
+    ranges = []
+    for path_points in path_lists:
+        ranges.extend((len(points), len(path_points)))
+        points.extend(path_points)
+    return points, ranges
+
+def export_earth_columns(earth_data, output_dir=OUTPUT_DATA_DIR):
+    """运输路径点按路径依次平铺，path_ranges 给出每条路径的 (起始点下标, 点数)
+
+    更粗的细节级别 k (k = 1, 2, ...) 以 path_position_lod<k> / path_ranges_lod<k> 的形式附在后面。
+    """
+    paths = earth_data["transport_paths"]
+    vessels = earth_data["real_time_vessels"]
+    points, path_ranges = _flatten_path_points(path["path"] for path in paths)
+    lod_attributes = []
+    num_lods = min((len(path.get("lod", ())) for path in paths), default=0)
+    for k in range(num_lods):
+        lod_points, lod_ranges = _flatten_path_points(path["lod"][k]["path"] for path in paths)
+        lod_attributes.append((f"path_position_lod{k + 1}", "float32", 3,
+                               itertools.chain.from_iterable(
+                                   lat_lon_to_unit_vector(p["lat"], p["lon"], 1 + p["height"]) for p in lod_points)))
+        lod_attributes.append((f"path_ranges_lod{k + 1}", "uint32", 2, lod_ranges))
+    vessel_type_ids, vessel_type_labels = _label_ids(v["type"] for v in vessels)
+    cargo_ids, cargo_labels = _label_ids(v["cargo"] for v in vessels)
+    chain = itertools.chain.from_iterable
+    write_columnar_export("earth_3d_data", [
+        ("path_position", "float32", 3, chain(lat_lon_to_unit_vector(p["lat"], p["lon"], 1 + p["height"])
+                                              for p in points)),
+        ("path_lat_lon_height", "float32", 3, chain((p["lat"], p["lon"], p["height"]) for p in points)),
+        ("path_progress", "float32", 1, (p["progress"] for p in points)),
+        ("path_ranges", "uint32", 2, path_ranges),
+        ("vessel_position", "float32", 3, chain(lat_lon_to_unit_vector(v["position"]["lat"], v["position"]["lon"])
+                                                for v in vessels)),
+        ("vessel_lat_lon", "float32", 2, chain((v["position"]["lat"], v["position"]["lon"]) for v in vessels)),
+        ("vessel_heading", "float32", 1, (v["heading"] for v in vessels)),
+        ("vessel_speed", "float32", 1, (v["speed"] for v in vessels)),
+        ("vessel_carbon_rate", "float32", 1, (v["carbon_rate"] for v in vessels)),
+        ("vessel_type", "uint32", 1, vessel_type_ids),
+        ("vessel_cargo", "uint32", 1, cargo_ids),
+    ] + lod_attributes, output_dir, meta={
+        "paths": [{key: value for key, value in path.items() if key not in ("path", "lod")} for path in paths],
+        "lod_tolerances_km": [path["tolerance_km"] for path in paths[0]["lod"][:num_lods]] if paths else [],
+        "vessel_id_prefix": "vessel_",  # 运输工具 id 为 vessel_<下标>
+        "vessel_type_labels": vessel_type_labels,
+        "cargo_labels": cargo_labels
+    })
+
+# --- 运输工具运动模拟：向量化推进 N 个运输工具 T 个时间步，按块把帧流式写入磁盘 ---
+VESSEL_FRAMES_STEM = "vessel_frames"
+VESSEL_FRAME_CHUNK_STEPS = 16   # 每个帧块文件包含的时间步数；10^5 个运输工具时每块约 25 MB
+VESSEL_TIME_STEP_HOURS = 1.0
+VESSEL_MOTION_MODES = ("heading", "paths")
+# 各类运输工具的速度范围 (km/h)；carbon_rate 为每公里的碳排放 (kg CO2eq/km)，范围与静态数据相同
+VESSEL_TYPE_PROFILES = {
+    "cargo_ship": {"speed_range": (20, 45), "path_modes": ("ship", "sea")},
+    "airplane": {"speed_range": (700, 900), "path_modes": ("air",)},
+    "truck": {"speed_range": (50, 90), "path_modes": ("land_truck", "land_train")},
+}
+VESSEL_CARBON_RATE_RANGE = (0.01, 0.5)
+
+def _require_numpy(feature):
+    if np is None:
+        raise RuntimeError(f"{feature} requires numpy (pip install numpy)")
+
+def _unit_vectors(lat_deg, lon_deg):
+    """lat_lon_to_unit_vector() 的向量化版本，返回 (n, 3) 数组"""
+    phi = np.radians(90 - lat_deg)
+    theta = np.radians(lon_deg + 180)
+    return np.stack((-np.sin(phi) * np.cos(theta), np.cos(phi), np.sin(phi) * np.sin(theta)), axis=-1)
+
+def _advance_along_headings(lat, lon, heading, distance_km):
+    """沿大圆从 (lat, lon) 按初始航向 heading 前进 distance_km，返回新位置及到达点处的航向（均为弧度）"""
+    delta = distance_km / EARTH_RADIUS_KM
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    new_lat = np.arcsin(np.clip(sin_lat * np.cos(delta) + cos_lat * np.sin(delta) * np.cos(heading), -1.0, 1.0))
+    new_lon = lon + np.arctan2(np.sin(heading) * np.sin(delta) * cos_lat,
+                               np.cos(delta) - sin_lat * np.sin(new_lat))
+    new_lon = (new_lon + np.pi) % (2 * np.pi) - np.pi
+    # 到达点处的航向 = 从到达点指回出发点的初始航向 + 180°，这样运输工具始终沿同一条大圆运动
+    d_lon = lon - new_lon
+    back = np.arctan2(np.sin(d_lon) * cos_lat,
+                      np.cos(new_lat) * sin_lat - np.sin(new_lat) * cos_lat * np.cos(d_lon))
+    return new_lat, new_lon, (back + np.pi) % (2 * np.pi)
+
+class VesselFleet:
+    """N 个运输工具的状态，全部以 numpy 数组保存
+
+    motion="heading" 时沿初始航向所在的大圆航行；motion="paths" 时沿 transport_paths 中的路径往返，
+    路径按最精细一级的采样点（等角距）线性插值后投影回球面。两种方式都在同一次数组运算中累计碳排放。
+    """
+
+    def __init__(self, num_vessels, motion="heading", transport_paths=None, seed=None):
+        _require_numpy("vessel simulation")
+        if motion not in VESSEL_MOTION_MODES:
+            raise ValueError(f"unknown vessel motion mode: {motion}")
+        rng = np.random.default_rng(None if seed is None else derive_seed(seed, "vessel_simulation"))
+        self.num_vessels = num_vessels
+        self.motion = motion
+        self.type_labels = list(VESSEL_TYPE_PROFILES)
+
+        if motion == "paths":
+            if not transport_paths:
+                raise ValueError("motion='paths' needs at least one transport path")
+            self._init_paths(transport_paths)
+            self.path_id = rng.integers(0, len(transport_paths), num_vessels)
+            type_for_mode = {mode: i for i, profile in enumerate(VESSEL_TYPE_PROFILES.values())
+                             for mode in profile["path_modes"]}
+            self.type_id = np.array([type_for_mode.get(path["mode"], self.type_labels.index("truck"))
+                                     for path in transport_paths])[self.path_id]
+            self.progress = rng.uniform(0, 1, num_vessels)
+            self.direction = rng.choice((-1.0, 1.0), num_vessels)
+        else:
+            self.type_id = rng.integers(0, len(self.type_labels), num_vessels)
+            self.lat = np.arcsin(rng.uniform(-1, 1, num_vessels))  # 在球面上均匀分布
+            self.lon = rng.uniform(-np.pi, np.pi, num_vessels)
+            self.heading = rng.uniform(0, 2 * np.pi, num_vessels)
+
+        speed_ranges = np.array([VESSEL_TYPE_PROFILES[t]["speed_range"] for t in self.type_labels], dtype=float)
+        low, high = speed_ranges[self.type_id, 0], speed_ranges[self.type_id, 1]
+        self.speed = low + (high - low) * rng.uniform(0, 1, num_vessels)
+        self.carbon_rate = rng.uniform(*VESSEL_CARBON_RATE_RANGE, num_vessels)
+        self.carbon_kg = np.zeros(num_vessels)
+
+    def _init_paths(self, transport_paths):
+        points = [point for path in transport_paths for point in path["path"]]
+        self.path_points = _unit_vectors(np.array([p["lat"] for p in points]), np.array([p["lon"] for p in points]))
+        self.path_heights = np.array([p["height"] for p in points])
+        counts = np.array([len(path["path"]) for path in transport_paths])
+        self.path_start = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        self.path_segments = counts - 1
+        self.path_length_km = np.array([path["total_distance"] for path in transport_paths], dtype=float)
+
+    def step(self, dt_hours):
+        distance = self.speed * dt_hours
+        self.carbon_kg += distance * self.carbon_rate
+        if self.motion == "paths":
+            self.progress += self.direction * distance / self.path_length_km[self.path_id]
+            # 到达端点后掉头；一步走过整条路径时取模再反射
+            self.progress %= 2.0
+            turned = self.progress > 1.0
+            self.progress[turned] = 2.0 - self.progress[turned]
+            self.direction[turned] = -self.direction[turned]
+        else:
+            self.lat, self.lon, self.heading = _advance_along_headings(self.lat, self.lon, self.heading, distance)
+
+    def positions(self):
+        """当前位置，(N, 3) float32，坐标约定与 lat_lon_to_unit_vector() 相同（半径含飞行高度）"""
+        if self.motion == "heading":
+            return _unit_vectors(np.degrees(self.lat), np.degrees(self.lon)).astype(np.float32)
+        segments = self.path_segments[self.path_id]
+        scaled = self.progress * segments
+        index = np.minimum(scaled.astype(np.int64), segments - 1)
+        frac = (scaled - index)[:, None]
+        first = self.path_start[self.path_id] + index
+        v = self.path_points[first] * (1 - frac) + self.path_points[first + 1] * frac
+        v /= np.linalg.norm(v, axis=1, keepdims=True)
+        height = self.path_heights[first] * (1 - frac[:, 0]) + self.path_heights[first + 1] * frac[:, 0]
+        return (v * (1 + height)[:, None]).astype(np.float32)
+
+@instrumented(items=lambda result: result)
+def simulate_vessel_frames(num_vessels, num_steps, dt_hours=VESSEL_TIME_STEP_HOURS, motion="heading",
+                           transport_paths=None, seed=None, output_dir=OUTPUT_DATA_DIR,
+                           chunk_steps=VESSEL_FRAME_CHUNK_STEPS):
+    """模拟并写出 vessel_frames/ 下的帧块文件、vessel_frames_static.bin 以及描述它们的 vessel_frames.json
+
+    帧 0 为初始状态，共 num_steps + 1 帧。每个帧块依次存放 position（帧 × 运输工具 × 3）和
+    carbon_kg（帧 × 运输工具，截至该帧的累计排放）两个小端 float32 数组，前端逐块加载即可回放。
+    """
+    fleet = VesselFleet(num_vessels, motion, transport_paths, seed)
+    frames_dir = os.path.join(output_dir, VESSEL_FRAMES_STEM)
+    if os.path.exists(frames_dir):
+        shutil.rmtree(frames_dir)
+    os.makedirs(frames_dir)
+
+    static_meta = {"count": num_vessels, "type_labels": fleet.type_labels}
+    static_attributes = [
+        ("type", "uint32", 1, fleet.type_id.tolist()),
+        ("speed", "float32", 1, fleet.speed.tolist()),
+        ("carbon_rate", "float32", 1, fleet.carbon_rate.tolist()),
+    ]
+    if motion == "paths":
+        static_attributes.append(("path", "uint32", 1, fleet.path_id.tolist()))
+        static_meta["path_ids"] = [path["id"] for path in transport_paths]
+    write_columnar_export(f"{VESSEL_FRAMES_STEM}_static", static_attributes, output_dir, static_meta)
+
+    num_frames = num_steps + 1
+    chunks = []
+    fleet_carbon = []
+    little_endian = np.dtype(np.float32).newbyteorder("<")
+    for first_frame in range(0, num_frames, chunk_steps):
+        frames = min(chunk_steps, num_frames - first_frame)
+        positions = np.empty((frames, num_vessels, 3), dtype=little_endian)
+        carbon = np.empty((frames, num_vessels), dtype=little_endian)
+        for k in range(frames):
+            if first_frame + k > 0:
+                fleet.step(dt_hours)
+            positions[k] = fleet.positions()
+            carbon[k] = fleet.carbon_kg
+            fleet_carbon.append(round(float(fleet.carbon_kg.sum()), 3))
+        file_name = f"{VESSEL_FRAMES_STEM}-{len(chunks):05d}.bin"
+        with AtomicFile(os.path.join(frames_dir, file_name), 'wb') as f:
+            f.write(positions.tobytes())
+            f.write(carbon.tobytes())
+        chunks.append({"file": f"{VESSEL_FRAMES_STEM}/{file_name}", "first_frame": first_frame, "frames": frames,
+                       "byte_length": positions.nbytes + carbon.nbytes})
+
+    header = {
+        "byte_order": "little",
+        "num_vessels": num_vessels,
+        "num_frames": num_frames,
+        "time_step_hours": dt_hours,
+        "motion": motion,
+        "static": f"{VESSEL_FRAMES_STEM}_static.bin",
+        # 帧块内的布局：position 在前，carbon_kg 紧随其后，字节偏移为 frames * 每帧字节数
+        "attributes": {
+            "position": {"dtype": "float32", "item_size": 3, "bytes_per_frame": num_vessels * 12},
+            "carbon_kg": {"dtype": "float32", "item_size": 1, "bytes_per_frame": num_vessels * 4},
+        },
+        "chunks": chunks,
+        "fleet_carbon_kg": fleet_carbon,
+    }
+    with AtomicFile(os.path.join(output_dir, f"{VESSEL_FRAMES_STEM}.json")) as f:
+        json.dump(header, f, ensure_ascii=False, separators=(",", ":"))
+    print(f"Simulated {num_vessels} vessels over {num_steps} steps into {len(chunks)} chunks under {frames_dir}")
+    return num_vessels * num_frames
+
+# 分片输出模式下增强版数据各列表字段的分片键；其余字段体量很小，直接写入清单的 meta
+ENHANCED_SHARD_KEYS = {
+    "earth_3d_data": {"transport_paths": "id", "real_time_vessels": "id",
+                      "weather_conditions": "id", "port_activities": "id"},
+    "timeline_data": {"historical_data": "year", "future_projections": "year"},
+    "global_heatmap_data": {"countries": "country_code"},
+    "particle_system_data": {"waste_particles": "id", "emission_particles": "id", "savings_particles": "id"},
+}
+
+@instrumented()
+def write_enhanced_dataset(stem, data, output_dir=OUTPUT_DATA_DIR, shard_size=None):
+    """写出一份增强版数据；分片模式下另外写出分片，返回 (清单中的数据集条目, meta)
+
+    页面按单文件读取，因此分片模式下完整的 <stem>.json 也照常写出。
+    """
+    with AtomicFile(os.path.join(output_dir, f"{stem}.json")) as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    if not shard_size:
+        return {}, {}
+
+    datasets = {}
+    meta = {}
+    for section, value in data.items():
+        key_field = ENHANCED_SHARD_KEYS.get(stem, {}).get(section)
+        if key_field is None:
+            meta[section] = value
+            continue
+        dataset = f"{stem}.{section}"
+        with ShardedDatasetWriter(dataset, output_dir, shard_size, key_field, compact=True) as writer:
+            for item in value:
+                writer.write(item)
+        datasets[dataset] = writer.manifest_entry()
+    return datasets, {stem: meta}
 
 # 在主生成函数中添加新的数据生成
-def generate_all_enhanced_data():
-    """生成所有增强版数据"""
-    print("生成3D地球可视化数据...")
-    earth_data = generate_3d_earth_data()
-    with open('../data/earth_3d_data.json', 'w', encoding='utf-8') as f:
-        json.dump(earth_data, f, ensure_ascii=False, indent=2)
-    
-    print("生成时间线数据...")
-    timeline_data = generate_timeline_data()
-    with open('../data/timeline_data.json', 'w', encoding='utf-8') as f:
-        json.dump(timeline_data, f, ensure_ascii=False, indent=2)
-    
-    print("生成全球热力图数据...")
-    heatmap_data = generate_global_heatmap_data()
-    with open('../data/global_heatmap_data.json', 'w', encoding='utf-8') as f:
-        json.dump(heatmap_data, f, ensure_ascii=False, indent=2)
-    
-    print("生成粒子系统数据...")
-    particle_data = generate_particle_system_data()
-    with open('../data/particle_system_data.json', 'w', encoding='utf-8') as f:
-        json.dump(particle_data, f, ensure_ascii=False, indent=2)
+def generate_all_enhanced_data(seed=None, workers=1, shard_size=None, columnar=False,
+                               num_particles=NUM_PARTICLES, num_vessels=NUM_VESSELS, incremental=False,
+                               simulate_vessels=0, simulation_steps=0, time_step_hours=VESSEL_TIME_STEP_HOURS,
+                               vessel_motion="heading", heatmap_regions=HEATMAP_REGIONS_PER_COUNTRY,
+                               heatmap_tiles=False, timeline_ensemble=0, timeline_resolution="yearly", timeline_full_ensemble=False):
+    """生成所有增强版数据；columnar=True 时另外写出粒子和 3D 路径的列式二进制版本
+
+    incremental=True 时每个数据集是一个独立的构建阶段，输入指纹未变的阶段直接跳过。
+    simulate_vessels > 0 时另外模拟这么多运输工具 simulation_steps 个时间步，写出 vessel_frames。
+    热力图阶段总是写出索引 heatmap_tiles.json；heatmap_tiles=True 时另外为每个国家生成 heatmap_regions 个合成区域
+    并写出瓦片金字塔 heatmap_tiles/。
+    timeline_ensemble > 0 时另外按 timeline_resolution 计算这么多个情景的时间线预测集合，写出 timeline_ensemble。
+    """
+    seed = resolve_master_seed(seed, workers)
+    build = IncrementalBuild(OUTPUT_DATA_DIR) if incremental else None
+    datasets = {}
+    meta = {}
+    written_stems = []
+
+    def write(stem, data):
+        stem_datasets, stem_meta = write_enhanced_dataset(stem, data, OUTPUT_DATA_DIR, shard_size)
+        datasets.update(stem_datasets)
+        meta.update(stem_meta)
+        written_stems.append(stem)
+
+    def earth_stage():
+        print("生成3D地球可视化数据...")
+        earth_data = generate_3d_earth_data(shard_rng(seed, "earth"), num_vessels)
+        write("earth_3d_data", earth_data)
+        if columnar:
+            export_earth_columns(earth_data, OUTPUT_DATA_DIR)
+
+    def timeline_stage():
+        print("生成时间线数据...")
+        write("timeline_data", generate_timeline_data())
+
+    def timeline_ensemble_stage():
+        print("计算时间线情景集合...")
+        generate_timeline_ensemble(OUTPUT_DATA_DIR, timeline_ensemble, timeline_resolution,
+                                   timeline_full_ensemble, seed)
+
+    def heatmap_stage():
+        print("生成全球热力图数据...")
+        heatmap_data = generate_global_heatmap_data(seed=seed, workers=workers)
+        write("global_heatmap_data", heatmap_data)
+        write_heatmap_tiles(heatmap_data, OUTPUT_DATA_DIR, seed, heatmap_regions, tiles=heatmap_tiles)
+
+    def particle_stage():
+        print("生成粒子系统数据...")
+        particle_data = generate_particle_system_data(num_particles, seed=seed, workers=workers)
+        write("particle_system_data", particle_data)
+        if columnar:
+            export_particle_columns(particle_data, OUTPUT_DATA_DIR)
+
+    def vessel_frames_stage():
+        print("模拟运输工具运动...")
+        # 运输路径与 3D 地球数据中的相同（路径几何不含随机成分）
+        transport_paths = generate_3d_earth_data(shard_rng(seed, "earth"), 0)["transport_paths"]
+        simulate_vessel_frames(simulate_vessels, simulation_steps, time_step_hours, vessel_motion,
+                               transport_paths, seed, OUTPUT_DATA_DIR)
+
+    output = {"shard_size": shard_size, "columnar": columnar}
+    run_build_stage(build, "earth_3d_data", {"seed": seed, "num_vessels": num_vessels, "output": output},
+                    earth_stage)
+    run_build_stage(build, "timeline_data", {"output": output}, timeline_stage)
+    if timeline_ensemble:
+        run_build_stage(build, TIMELINE_ENSEMBLE_STEM,
+                        {"seed": seed, "scenarios": timeline_ensemble, "resolution": timeline_resolution,
+                         "full": timeline_full_ensemble}, timeline_ensemble_stage)
+    run_build_stage(build, "global_heatmap_data",
+                    {"seed": seed, "profiles": HEATMAP_COUNTRY_PROFILES, "output": output,
+                     "tiles": heatmap_tiles, "regions": heatmap_regions, "max_zoom": HEATMAP_TILE_MAX_ZOOM,
+                     "bins": HEATMAP_TILE_BINS},
+                    heatmap_stage)
+    run_build_stage(build, "particle_system_data",
+                    {"seed": seed, "num_particles": num_particles, "PARTICLE_SHARD_SIZE": PARTICLE_SHARD_SIZE,
+                     "output": output}, particle_stage)
+    if simulate_vessels:
+        run_build_stage(build, VESSEL_FRAMES_STEM,
+                        {"seed": seed, "num_vessels": simulate_vessels, "steps": simulation_steps,
+                         "time_step_hours": time_step_hours, "motion": vessel_motion,
+                         "chunk_steps": VESSEL_FRAME_CHUNK_STEPS}, vessel_frames_stage)
+
+    # 跳过的阶段不会出现在 datasets 中，update_manifest 会保留它们上次写入的条目
+    if shard_size:
+        update_manifest(OUTPUT_DATA_DIR, datasets, meta)
+    else:
+        update_manifest(OUTPUT_DATA_DIR, {}, unsharded=written_stems)
     
     print("增强版数据生成完成！")
 
-if __name__ == "__main__":
-    generate_all_data()
+# --- 预压缩：为输出目录中的数据文件写出 .br / .gz 版本，由 data_server.py 按 Accept-Encoding 直接发送 ---
+PRECOMPRESS_ENCODINGS = {"br": ".br", "gzip": ".gz"}  # 按服务器的优先顺序排列
+PRECOMPRESS_EXTENSIONS = (".json", ".ndjson", ".bin", ".csv")
+PRECOMPRESS_MIN_BYTES = 1024
+PRECOMPRESS_MIN_SAVING = 0.05  # 压缩后至少小 5% 才保留压缩版本
+BROTLI_QUALITY = 9
+
+def precompressed_variant_is_fresh(source_path, variant_path):
+    """压缩版本存在且不早于源文件时才可用；源文件重新生成后旧的压缩版本自动失效"""
+    try:
+        return os.stat(variant_path).st_mtime_ns >= os.stat(source_path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+def _compress(encoding, data):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # mtime=0 使相同内容的 gzip 输出逐字节相同
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+@instrumented(items=lambda result: result)
+def precompress_outputs(output_dir=OUTPUT_DATA_DIR):
+    """为 output_dir 下（含子目录）的数据文件写出压缩版本，返回本次写出的文件数
+
+    已是最新的压缩版本直接跳过，源文件已不存在或压缩收益不足的压缩版本会被删除。
+    """
+    encodings = [encoding for encoding in PRECOMPRESS_ENCODINGS if encoding != "br" or brotli is not None]
+    suffixes = tuple(PRECOMPRESS_ENCODINGS.values())
+    written = 0
+    for root, _, names in os.walk(output_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            if name.startswith("."):
+                continue
+            if name.endswith(suffixes):
+                if not os.path.exists(path[:-len(os.path.splitext(name)[1])]):
+                    os.unlink(path)
+                continue
+            if not name.endswith(PRECOMPRESS_EXTENSIONS) or os.path.getsize(path) < PRECOMPRESS_MIN_BYTES:
+                continue
+            data = None
+            for encoding in encodings:
+                variant_path = path + PRECOMPRESS_ENCODINGS[encoding]
+                if precompressed_variant_is_fresh(path, variant_path):
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                compressed = _compress(encoding, data)
+                if len(compressed) > len(data) * (1 - PRECOMPRESS_MIN_SAVING):
+                    if os.path.exists(variant_path):
+                        os.unlink(variant_path)
+                    continue
+                with AtomicFile(variant_path, 'wb', track=False) as f:
+                    f.write(compressed)
+                written += 1
+    print(f"Precompressed {written} files under {output_dir} ({', '.join(encodings)})")
+    return written
+
+# --- 命令行入口 ---
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="生成食物碳足迹可视化所需的数据文件")
+    parser.add_argument("--scale", action="store_true",
+                        help="规模模式：生成合成食物 × 合成国家的大规模压力测试数据集")
+    parser.add_argument("--config", help="JSON 配置文件，键名与下列参数相同（命令行参数优先）")
+    parser.add_argument("--num-foods", type=int, help=f"规模模式的食物数量（默认 {SCALE_NUM_FOODS}）")
+    parser.add_argument("--num-countries", type=int, help=f"规模模式的国家节点数量（默认 {SCALE_NUM_COUNTRIES}）")
+    parser.add_argument("--origins", type=int, nargs=2, metavar=("MIN", "MAX"),
+                        help="每个食物的产地数量范围")
+    parser.add_argument("--destinations", type=int, nargs=2, metavar=("MIN", "MAX"),
+                        help="每个产地的目的地数量范围")
+    parser.add_argument("--output-dir", help=f"规模模式的输出目录（默认 {SCALE_OUTPUT_DIR}）")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS,
+                        help="食物数据的输出格式：json 数组或 ndjson（默认 json，规模模式默认 ndjson）")
+    parser.add_argument("--fused", action="store_true",
+                        help="融合流水线：路线与营养/碳足迹数据在一次遍历中生成（规模模式总是融合）")
+    parser.add_argument("--compact", action="store_true",
+                        help="使用紧凑分隔符输出 JSON，不缩进（规模模式总是紧凑输出）")
+    parser.add_argument("--shard-size", type=int,
+                        help="分片输出：每个分片文件包含的条目数（食物、国家或年份），并写出 manifest.json")
+    parser.add_argument("--columnar", action="store_true",
+                        help="另外写出粒子、3D 路径和规范化路线表的列式二进制版本（小端 float32/uint32 + JSON 头）")
+    parser.add_argument("--nutrient-rankings", action="store_true",
+                        help=f"另外写出营养效率排名 {NUTRIENT_RANKINGS_FILE_NAME}（需要在内存中保留每个食物的数值，"
+                             f"规模模式下内存随食物数增长）")
+    parser.add_argument("--diet-scenarios", action="store_true",
+                        help=f"另外写出饮食情景与浪费影响查询表 {DIET_SCENARIOS_STEM}.bin（页面目前不读取）")
+    parser.add_argument("--num-particles", type=int, default=NUM_PARTICLES, help="粒子系统的粒子数量")
+    parser.add_argument("--num-vessels", type=int, default=NUM_VESSELS, help="3D 地球上的运输工具数量")
+    parser.add_argument("--timeline-ensemble", type=int, nargs="?", const=TIMELINE_ENSEMBLE_SCENARIOS, metavar="N",
+                        help=f"计算 N 个参数化情景（默认 {TIMELINE_ENSEMBLE_SCENARIOS}）的时间线预测，"
+                             f"写出分位带 {TIMELINE_ENSEMBLE_STEM}.bin（需要 numpy）")
+    parser.add_argument("--timeline-resolution", choices=TIMELINE_RESOLUTIONS, default="yearly",
+                        help="时间线情景集合的时间步长")
+    parser.add_argument("--timeline-full-ensemble", action="store_true",
+                        help="同时写出每个情景的参数和完整时间序列，而不只是分位带")
+    parser.add_argument("--heatmap-regions", type=int, default=HEATMAP_REGIONS_PER_COUNTRY, metavar="N",
+                        help=f"热力图瓦片金字塔中每个国家的合成区域数（默认 {HEATMAP_REGIONS_PER_COUNTRY}，配合 --heatmap-tiles）")
+    parser.add_argument("--heatmap-tiles", action="store_true",
+                        help=f"另外写出热力图瓦片金字塔 {HEATMAP_TILES_STEM}/{{z}}/{{x}}/{{y}}.json"
+                             f"（页面目前只读取索引中的 feature_join）")
+    parser.add_argument("--simulate-vessels", type=int, default=0, metavar="N",
+                        help="模拟 N 个运输工具的运动并把逐帧位置和累计碳排放写入 vessel_frames（需要 numpy）")
+    parser.add_argument("--simulation-steps", type=int, default=240, help="运输工具模拟的时间步数")
+    parser.add_argument("--time-step-hours", type=float, default=VESSEL_TIME_STEP_HOURS,
+                        help="运输工具模拟每个时间步的时长（小时）")
+    parser.add_argument("--vessel-motion", choices=VESSEL_MOTION_MODES, default="heading",
+                        help="heading：沿初始航向的大圆航行；paths：沿 3D 地球数据中的运输路径往返")
+    parser.add_argument("--monte-carlo", type=int, nargs="?", const=MONTE_CARLO_DRAWS, metavar="DRAWS",
+                        help=f"蒙特卡洛不确定性：每个食物抽样 DRAWS 次（默认 {MONTE_CARLO_DRAWS}），"
+                             f"写出 {CO2_UNCERTAINTY_FILE_NAME}（需要 numpy；路线同时写出 {ROUTES_BINARY_STEM}.bin 供抽样读取）")
+    parser.add_argument("--optimal-sourcing", action="store_true",
+                        help=f"在多式联运图上求每个 (食物, 目的地) 排放最低的产地和运输路径，写出 {OPTIMAL_SOURCING_FILE_NAME}"
+                             f"（不能与 --scale 同时使用）")
+    parser.add_argument("--sourcing-destinations", nargs="+", metavar="COUNTRY",
+                        help="只为这些目的地国家求最低碳采购（默认所有国家）")
+    parser.add_argument("--metrics", nargs="?", const="", metavar="PATH",
+                        help=f"记录各阶段的耗时、条目数、写出字节数和峰值内存，运行结束时写出 JSON 报告"
+                             f"（默认写到输出目录的 {METRICS_FILE_NAME}）")
+    parser.add_argument("--profile", action="store_true",
+                        help="同时用 cProfile 分析整次运行，统计文件写在报告旁边（.prof），报告中列出耗时最多的函数")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="同时用 tracemalloc 记录每个阶段 Python 对象的峰值内存（会明显变慢）")
+    parser.add_argument("--precompress", action="store_true",
+                        help="生成结束后为数据文件写出 gzip（安装了 brotli 时还有 brotli）压缩版本，供 data_server.py 使用")
+    parser.add_argument("--seed", type=int,
+                        help="主随机种子：各分片的随机数由它派生，同一种子的输出与进程数无关")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="并行生成的进程数（默认 1，即在当前进程中生成）")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"增量构建：输入指纹（配置、种子、该阶段用到的生成代码和常量）与上次相同且输出未被改动的阶段直接跳过，"
+                             f"指纹记录在输出目录的 {BUILD_CACHE_FILE_NAME} 中")
+    # 先只取出 --config：配置文件中的键作为各参数的默认值，命令行上显式给出的参数仍然优先，
+    # 与参数本身是否有非 None 的默认值无关
+    args, _ = parser.parse_known_args(argv)
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        defaults = {}
+        for key, value in config.items():
+            attr = key.replace("-", "_")
+            if attr == "config" or not hasattr(args, attr):
+                parser.error(f"unknown config key: {key}")
+            defaults[attr] = value
+        parser.set_defaults(**defaults)
+    args = parser.parse_args(argv)
+
+    if args.optimal_sourcing and args.scale:
+        # 规模模式的合成国家没有陆地划分，国家数也使全图最短路不可行
+        parser.error("--optimal-sourcing cannot be combined with --scale")
+    if args.sourcing_destinations:
+        if not args.optimal_sourcing:
+            parser.error("--sourcing-destinations requires --optimal-sourcing")
+        unknown = [name for name in args.sourcing_destinations if name not in COUNTRIES_DATA]
+        if unknown:
+            parser.error(f"unknown destination countries: {', '.join(unknown)}")
+    return args
+
+def run_generation(args):
+    seed = resolve_master_seed(args.seed, args.workers)
+    # 蒙特卡洛阶段从路线的二进制列读取距离，因此同时写出路线的列式版本
+    routes_columnar = args.columnar or bool(args.monte_carlo)
+    if args.scale:
+        generate_scale_data(
+            num_foods=args.num_foods if args.num_foods is not None else SCALE_NUM_FOODS,
+            num_countries=args.num_countries if args.num_countries is not None else SCALE_NUM_COUNTRIES,
+            origins_range=tuple(args.origins or (NUM_ORIGINS_PER_FOOD_MIN, NUM_ORIGINS_PER_FOOD_MAX)),
+            destinations_range=tuple(args.destinations or (NUM_DESTINATIONS_PER_ORIGIN_MIN, NUM_DESTINATIONS_PER_ORIGIN_MAX)),
+            output_dir=args.output_dir or SCALE_OUTPUT_DIR,
+            output_format=args.format or "ndjson",
+            seed=seed,
+            workers=args.workers,
+            shard_size=args.shard_size,
+            incremental=args.incremental,
+            columnar=routes_columnar,
+            nutrient_rankings=args.nutrient_rankings,
+            diet_scenarios=args.diet_scenarios,
+        )
+        if args.monte_carlo:
+            run_co2_uncertainty_stage(args.output_dir or SCALE_OUTPUT_DIR, args.monte_carlo, seed, args.workers,
+                                      args.incremental)
+        if args.precompress:
+            precompress_outputs(args.output_dir or SCALE_OUTPUT_DIR)
+        return
+
+    generate_all_data(output_format=args.format or "json", compact=args.compact, fused=args.fused,
+                      seed=seed, workers=args.workers, shard_size=args.shard_size, incremental=args.incremental,
+                      columnar=routes_columnar, nutrient_rankings=args.nutrient_rankings,
+                      diet_scenarios=args.diet_scenarios)
+    if args.monte_carlo:
+        run_co2_uncertainty_stage(OUTPUT_DATA_DIR, args.monte_carlo, seed, args.workers, args.incremental)
+    if args.optimal_sourcing:
+        run_optimal_sourcing_stage(OUTPUT_DATA_DIR, args.incremental, args.sourcing_destinations)
     print(f"All data generation complete. Files saved in {os.path.abspath(OUTPUT_DATA_DIR)}")
-    generate_all_enhanced_data()
+    generate_all_enhanced_data(seed=seed, workers=args.workers, shard_size=args.shard_size,
+                               columnar=args.columnar, num_particles=args.num_particles,
+                               num_vessels=args.num_vessels, incremental=args.incremental,
+                               simulate_vessels=args.simulate_vessels, simulation_steps=args.simulation_steps,
+                               time_step_hours=args.time_step_hours, vessel_motion=args.vessel_motion,
+                               heatmap_regions=args.heatmap_regions, heatmap_tiles=args.heatmap_tiles,
+                               timeline_ensemble=args.timeline_ensemble,
+                               timeline_resolution=args.timeline_resolution,
+                               timeline_full_ensemble=args.timeline_full_ensemble)
+    if args.precompress:
+        precompress_outputs(OUTPUT_DATA_DIR)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.metrics is None and not (args.profile or args.trace_memory):
+        run_generation(args)
+        return
+
+    output_dir = (args.output_dir or SCALE_OUTPUT_DIR) if args.scale else OUTPUT_DATA_DIR
+    report_path = args.metrics or os.path.join(output_dir, METRICS_FILE_NAME)
+    start_run_metrics(profile=args.profile, trace_memory=args.trace_memory)
+    status = "failed"
+    try:
+        with metrics_stage("total"):
+            run_generation(args)
+        status = "ok"
+    finally:
+        os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+        finish_run_metrics(report_path, status)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""data_server Range 解析的回归测试：python -m unittest test_data_server"""
+import unittest
+
+import data_server as ds
+
+class ParseRangeTest(unittest.TestCase):
+    SIZE = 1000
+
+    def test_closed_range(self):
+        self.assertEqual(ds.parse_range("bytes=0-99", self.SIZE), (0, 99))
+        self.assertEqual(ds.parse_range("bytes=500-500", self.SIZE), (500, 500))
+
+    def test_end_past_file_is_clamped(self):
+        self.assertEqual(ds.parse_range("bytes=900-5000", self.SIZE), (900, 999))
+
+    def test_open_ended(self):
+        self.assertEqual(ds.parse_range("bytes=990-", self.SIZE), (990, 999))
+        self.assertEqual(ds.parse_range("bytes=0-", self.SIZE), (0, 999))
+
+    def test_suffix(self):
+        self.assertEqual(ds.parse_range("bytes=-100", self.SIZE), (900, 999))
+        # 后缀比文件还长时返回整个文件
+        self.assertEqual(ds.parse_range("bytes=-5000", self.SIZE), (0, 999))
+
+    def test_unsatisfiable(self):
+        for header, size in (("bytes=1000-", self.SIZE), ("bytes=1000-2000", self.SIZE),
+                             ("bytes=-0", self.SIZE), ("bytes=-10", 0), ("bytes=0-", 0)):
+            with self.subTest(header=header, size=size):
+                with self.assertRaises(ds.RangeNotSatisfiable):
+                    ds.parse_range(header, size)
+
+    def test_ignored_headers_serve_whole_file(self):
+        # 多个区间、其他单位、格式错误和 start > end 时忽略 Range
+        for header in ("bytes=0-9,20-29", "bytes=0-9, -5", "items=0-9", "bytes=", "bytes=-", "bytes=abc-def",
+                       "bytes=5", "bytes=20-10", "bytes=1-2-3"):
+            with self.subTest(header=header):
+                self.assertIsNone(ds.parse_range(header, self.SIZE))
+
+    def test_whitespace_around_spec(self):
+        self.assertEqual(ds.parse_range("bytes= 10-19 ", self.SIZE), (10, 19))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+"""main_generator 命令行解析的回归测试：python -m unittest test_main_generator"""
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import main_generator as mg
+
+class ConfigFileTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.config_path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        self.addCleanup(os.remove, self.config_path)
+
+    def parse_with_config(self, config, *argv):
+        with open(self.config_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+        return mg.parse_args(["--config", self.config_path, *argv])
+
+    def test_config_overrides_non_none_defaults(self):
+        args = self.parse_with_config({"workers": 4, "num_particles": 500, "simulation_steps": 10,
+                                       "vessel-motion": "paths", "heatmap_regions": 2})
+        self.assertEqual(args.workers, 4)
+        self.assertEqual(args.num_particles, 500)
+        self.assertEqual(args.simulation_steps, 10)
+        self.assertEqual(args.vessel_motion, "paths")
+        self.assertEqual(args.heatmap_regions, 2)
+        # 配置文件中没有的键保持参数本身的默认值
+        self.assertEqual(args.num_vessels, mg.NUM_VESSELS)
+
+    def test_command_line_takes_precedence(self):
+        args = self.parse_with_config({"workers": 4, "num_particles": 500}, "--workers", "2")
+        self.assertEqual(args.workers, 2)
+        self.assertEqual(args.num_particles, 500)
+
+    def test_unknown_key_is_rejected(self):
+        with self.assertRaises(SystemExit):
+            self.parse_with_config({"num_parrots": 3})
+
+DIET_SIMULATOR_JS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "web", "js", "diet_simulator.js")
+
+def parse_js_object(source, name):
+    """取出 `const <name> = {...};` 的对象字面量，去掉注释、单引号和尾逗号后按 JSON 解析"""
+    start = source.index("{", source.index(f"const {name} = "))
+    depth = 0
+    for end in range(start, len(source)):
+        depth += {"{": 1, "}": -1}.get(source[end], 0)
+        if depth == 0:
+            break
+    text = re.sub(r"//[^\n]*", "", source[start:end + 1])
+    text = re.sub(r"'([^']*)'", lambda m: json.dumps(m.group(1)), text)
+    text = re.sub(r"([{,]\s*)([A-Za-z_]\w*)\s*:", r'\1"\2":', text)
+    text = re.sub(r",(\s*[}\]])", r"\1", text)
+    return json.loads(text)
+
+class DietTablesTest(unittest.TestCase):
+    """饮食情景查询表使用的常量必须与 diet_simulator.js 中页面实际使用的保持一致"""
+
+    @classmethod
+    def setUpClass(cls):
+        with open(DIET_SIMULATOR_JS, 'r', encoding='utf-8') as f:
+            cls.source = f.read()
+
+    def test_category_mapping_matches_page(self):
+        js_mapping = parse_js_object(self.source, "CATEGORY_MAPPING")
+        # Python 版本另外补上了本数据集中的其余食物名，JS 中已有的键必须完全相同
+        self.assertEqual({name: mg.CATEGORY_MAPPING.get(name) for name in js_mapping}, js_mapping)
+
+    def test_diet_structures_match_page(self):
+        self.assertEqual(mg.DIET_STRUCTURES, parse_js_object(self.source, "DIET_STRUCTURES"))
+
+    def test_diet_categories_cover_page_categories(self):
+        for diet in mg.DIET_STRUCTURES.values():
+            self.assertEqual(list(diet["annual_consumption_kg"]), mg.DIET_CATEGORIES)
+
+class SeedDerivationTest(unittest.TestCase):
+    def test_derive_seed_is_stable_and_keyed(self):
+        self.assertEqual(mg.derive_seed(42, "foods", 3), mg.derive_seed(42, "foods", 3))
+        seeds = {mg.derive_seed(42, "foods", 3), mg.derive_seed(42, "foods", 4),
+                 mg.derive_seed(42, "particles", 3), mg.derive_seed(43, "foods", 3)}
+        self.assertEqual(len(seeds), 4)
+        self.assertTrue(all(0 <= seed < 2**64 for seed in seeds))
+
+    def test_shard_rng_without_seed_uses_global_random(self):
+        self.assertIs(mg.shard_rng(None, "foods", 0), mg.random)
+
+    def test_food_records_independent_of_worker_count(self):
+        names = list(mg.iter_synthetic_food_names(12))
+        transport_factors = mg.generate_transport_factors(mg.shard_rng(7, "catalogue"))
+
+        def records(workers):
+            mg.clear_distance_cache()
+            return list(mg.iter_sharded_food_records(names, transport_factors, seed=7, workers=workers, shard_size=5))
+
+        single = records(1)
+        self.assertEqual(len(single), len(names))
+        self.assertEqual(records(2), single)
+        self.assertEqual(records(3), single)
+
+    def test_particles_independent_of_worker_count(self):
+        num_particles = mg.PARTICLE_SHARD_SIZE * 2 + 7
+        single = mg.generate_particle_system_data(num_particles, seed=7, workers=1)
+        self.assertEqual(mg.generate_particle_system_data(num_particles, seed=7, workers=2), single)
+
+class JsonStreamWriterTest(unittest.TestCase):
+    ITEMS = [
+        {"name": "牛肉", "routes": [{"origin_country": "巴西", "distance_km": 18000.5, "modes": []}], "tags": {}},
+        {"name": "line\nbreak \"quoted\"", "values": [1, 2.5, None, True], "nested": {"a": {"b": [[], [{}]]}}},
+        [],
+        "plain string",
+        0,
+    ]
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+
+    def write(self, items, *args, **kwargs):
+        file_path = os.path.join(self.output_dir, "items.json")
+        with mg.JsonStreamWriter(file_path, *args, **kwargs) as writer:
+            positions = [writer.write(item) for item in items]
+        with open(file_path, 'rb') as f:
+            return f.read(), positions
+
+    def test_indented_output_matches_json_dump(self):
+        for items in (self.ITEMS, self.ITEMS[:1], []):
+            for indent in (4, 2):
+                with self.subTest(count=len(items), indent=indent):
+                    data, _ = self.write(items, indent=indent)
+                    self.assertEqual(data, json.dumps(items, ensure_ascii=False, indent=indent).encode('utf-8'))
+
+    def test_compact_output_matches_json_dump(self):
+        data, _ = self.write(self.ITEMS, compact=True)
+        self.assertEqual(data, json.dumps(self.ITEMS, ensure_ascii=False, separators=(",", ":")).encode('utf-8'))
+
+    def test_ndjson_lines(self):
+        data, _ = self.write(self.ITEMS, "ndjson")
+        self.assertEqual([json.loads(line) for line in data.decode('utf-8').splitlines()], self.ITEMS)
+
+    def test_offsets_locate_each_item(self):
+        for args in ((), ("json", True), ("ndjson",)):
+            data, positions = self.write(self.ITEMS, *args)
+            with self.subTest(args=args):
+                self.assertEqual([json.loads(data[offset:offset + length]) for offset, length in positions], self.ITEMS)
+
+def undirected_graph(num_nodes, edges):
+    """由 (a, b, 方式, 距离, 排放) 列表构造 lowest_carbon_paths 使用的无向邻接表"""
+    graph = [[] for _ in range(num_nodes)]
+    for a, b, mode, leg_km, leg_co2 in edges:
+        graph[a].append((b, mode, leg_km, leg_co2))
+        graph[b].append((a, mode, leg_km, leg_co2))
+    return graph
+
+class LowestCarbonPathsTest(unittest.TestCase):
+    # 0 -- 1 有海运和空运两条边；经 3 转运到 2 比直接空运排放更低；4 不连通
+    NAMES = ["A", "B", "C", "D", "E"]
+    GRAPH = undirected_graph(5, [
+        (0, 1, "sea", 100.0, 1.0),
+        (0, 1, "air", 100.0, 6.0),
+        (1, 2, "air", 50.0, 5.0),
+        (0, 2, "air", 200.0, 8.0),
+        (1, 3, "land_truck", 30.0, 1.5),
+        (3, 2, "land_train", 40.0, 1.0),
+    ])
+
+    def test_lowest_emissions_from_source(self):
+        best, previous = mg.lowest_carbon_paths(self.GRAPH, 2)
+        self.assertEqual(best, [3.5, 2.5, 0.0, 1.0, math.inf])
+        self.assertIsNone(previous[2])
+        self.assertIsNone(previous[4])
+
+    def test_path_legs_follow_cheapest_modes(self):
+        _, previous = mg.lowest_carbon_paths(self.GRAPH, 2)
+        legs = mg._path_legs(self.NAMES, previous, 0)
+        self.assertEqual([(leg["from"], leg["to"], leg["mode"]) for leg in legs],
+                         [("A", "B", "sea"), ("B", "D", "land_truck"), ("D", "C", "land_train")])
+        self.assertEqual(sum(leg["co2_per_kg"] for leg in legs), 3.5)
+        self.assertEqual(mg._path_legs(self.NAMES, previous, 2), [])
+
+    def test_direct_edge_wins_when_cheaper(self):
+        graph = undirected_graph(3, [(0, 1, "sea", 10.0, 0.5), (1, 2, "sea", 10.0, 0.5), (0, 2, "land_train", 15.0, 0.75)])
+        best, previous = mg.lowest_carbon_paths(graph, 0)
+        self.assertEqual(best, [0.0, 0.5, 0.75])
+        self.assertEqual(previous[2], (0, "land_train", 15.0, 0.75))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,8 @@ class GlobalHeatmap {
     constructor() {
         this.map = null;
         this.heatmapData = null;
+        this.countriesByCode = null;
+        this.tileIndex = null;
         this.currentYear = 2024;
         this.countriesLayer = null;
         this.selectedCountry = null;
@@ -42,9 +44,18 @@ class GlobalHeatmap {
         try {
             const response = await fetch('../data/global_heatmap_data.json');
             this.heatmapData = await response.json();
+            this.countriesByCode = new Map(this.heatmapData.countries.map(c => [c.country_code, c]));
         } catch (error) {
             console.error('Failed to load heatmap data:', error);
         }
+
+        try {
+            // 瓦片索引中带有生成时预先算好的 GeoJSON 要素名称 -> 国家代码对应关系
+            const response = await fetch('../data/heatmap_tiles.json');
+            this.tileIndex = await response.json();
+        } catch (error) {
+            this.tileIndex = null;
+        }
     }
 
     initMap() {
@@ -117,9 +128,9 @@ class GlobalHeatmap {
             'Germany': 'DEU'
         };
         
-        const countryCode = countryMap[countryName];
-        if (countryCode && this.heatmapData) {
-            return this.heatmapData.countries.find(c => c.country_code === countryCode);
+        const countryCode = (this.tileIndex && this.tileIndex.feature_join[countryName]) || countryMap[countryName];
+        if (countryCode && this.countriesByCode) {
+            return this.countriesByCode.get(countryCode);
         }
         
         // 返回默认数据